@@ -22,6 +22,7 @@ from app.db.base import Base
 from app.models.user import User
 from app.models.audit import AuditLog
 from app.models.biometric import Biometric
+from app.models.face_template import FaceTemplate
 target_metadata = Base.metadata
 
 import os
@@ -0,0 +1,43 @@
+"""add face_templates table
+
+Revision ID: 49cb53ce0784
+Revises: 972ddd1b7e75
+Create Date: 2026-10-18 11:02:17.532904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '49cb53ce0784'
+down_revision: Union[str, None] = '972ddd1b7e75'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('face_templates',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('template', sa.LargeBinary(), nullable=False),
+    sa.Column('yaw', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_face_templates_user_id'), 'face_templates', ['user_id'], unique=False)
+
+    # существующий единственный шаблон становится первым шаблоном пользователя
+    op.execute(
+        "INSERT INTO face_templates (user_id, template) "
+        "SELECT user_id, face_template FROM biometrics"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_face_templates_user_id'), table_name='face_templates')
+    op.drop_table('face_templates')
@@ -0,0 +1,30 @@
+"""add updated_at to biometrics
+
+Revision ID: 972ddd1b7e75
+Revises: b430e3dcbbf2
+Create Date: 2026-10-18 10:12:41.208335
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '972ddd1b7e75'
+down_revision: Union[str, None] = 'b430e3dcbbf2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('biometrics', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+    op.create_index(op.f('ix_biometrics_updated_at'), 'biometrics', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_biometrics_updated_at'), table_name='biometrics')
+    op.drop_column('biometrics', 'updated_at')
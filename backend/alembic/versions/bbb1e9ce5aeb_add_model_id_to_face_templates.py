@@ -0,0 +1,33 @@
+"""add model_id to face_templates
+
+Revision ID: bbb1e9ce5aeb
+Revises: 49cb53ce0784
+Create Date: 2026-10-18 14:36:05.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bbb1e9ce5aeb'
+down_revision: Union[str, None] = '49cb53ce0784'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # все существующие шаблоны сняты buffalo_l; server_default заполняет их
+    # одной операцией, потом убираем — новые строки всегда пишут модель явно
+    op.add_column('face_templates', sa.Column('model_id', sa.String(length=64), server_default='buffalo_l', nullable=False))
+    op.alter_column('face_templates', 'model_id', server_default=None)
+    op.create_index(op.f('ix_face_templates_model_id'), 'face_templates', ['model_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_face_templates_model_id'), table_name='face_templates')
+    op.drop_column('face_templates', 'model_id')
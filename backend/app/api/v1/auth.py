@@ -1,108 +1,269 @@
-from fastapi import APIRouter, Depends, Response, HTTPException
-from sqlalchemy.orm import Session
+import logging
+from functools import partial
+
+from fastapi import APIRouter, Depends, Request, Response, HTTPException, File, Form, UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Cookie
-from datetime import datetime, timedelta
 
 from app.schemas.auth import RegisterRequest, LoginRequest, TokenResponse, SetPinRequest, PinLoginRequest
 from app.schemas.user import UserRead as UserResponse
 from app.services.auth_service import register, login
+from app.api.v1.biometrics import face_verdict, load_face_templates
+from app.api.v1.voice import load_voice_template, voice_verdict
+from app.services.audit_writer import client_ip, log_action
 from app.db.session import get_db
 from app.models.user import User
-from app.core.security import hash_pin, verify_pin
+from app.services.hashing_pool import hashing_pool
+from app.services.mfa_service import FactorPolicy, evaluate_factors
+from app.services.rate_limiter import (
+    auth_ip_limiter,
+    check_rate,
+    face_ip_limiter,
+    face_user_limiter,
+    login_failure_limiter,
+    pin_failure_limiter,
+    voice_ip_limiter,
+    voice_user_limiter,
+)
+from app.services.token_store import token_store
+from app.core.config import settings
 from app.core.jwt_manager import create_access_token, create_refresh_token, decode_token
 import jwt
 
-router = APIRouter(prefix="/auth", tags=["Auth"])
+logger = logging.getLogger(__name__)
 
-@router.post("/register", response_model=UserResponse)
-def register_user(data: RegisterRequest, db: Session = Depends(get_db)):
-    return register(data, db)
+router = APIRouter(prefix="/auth", tags=["Auth"])
 
-@router.post("/login", response_model=TokenResponse)
-def login_user(data: LoginRequest, response: Response, db: Session = Depends(get_db)):
-    access, refresh, user = login(data, db)
+REFRESH_COOKIE = "refresh_token"
 
+def _set_refresh_cookie(response: Response, refresh: str):
+    # Ставим refresh токен в HttpOnly cookie
     response.set_cookie(
-        key="refresh_token",
+        key=REFRESH_COOKIE,
         value=refresh,
         httponly=True,
         samesite="strict",
-        max_age=60*60*24*30
+        max_age=60*60*24*settings.REFRESH_TOKEN_EXPIRE_DAYS
     )
 
+@router.post("/register", response_model=UserResponse)
+async def register_user(data: RegisterRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    return await register(data, db, ip=client_ip(request))
+
+@router.post("/login", response_model=TokenResponse)
+async def login_user(data: LoginRequest, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    access, refresh, user = await login(data, db, ip=client_ip(request))
+    _set_refresh_cookie(response, refresh)
     return TokenResponse(access_token=access)
 
 @router.post("/set_pin")
-def set_pin(data: SetPinRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == data.user_id).first()
+async def set_pin(data: SetPinRequest, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == data.user_id))
     if not user:
         raise HTTPException(404, "User not found")
 
-    user.hashed_pin = hash_pin(data.pin)
-    user.pin_attempts = 0
-    user.pin_locked_until = None
+    # Argon2 — в отдельном пуле процессов с бюджетом памяти
+    user.hashed_pin = await hashing_pool.hash_pin(data.pin)
     db.add(user)
-    db.commit()
+    await db.commit()
+    pin_failure_limiter.reset(user.id)
     return {"message": "PIN saved"}
 
-MAX_PIN_ATTEMPTS = 5
-LOCK_MINUTES = 15
-
 @router.post("/login/pin")
-def login_with_pin(data: PinLoginRequest, db: Session = Depends(get_db), response: Response = None):
-    user = db.query(User).filter(User.id == data.user_id).first()
+async def login_with_pin(data: PinLoginRequest, request: Request, db: AsyncSession = Depends(get_db), response: Response = None):
+    ip = client_ip(request)
+
+    # ✅ лимиты проверяются в памяти до Argon2 и до запроса в БД;
+    # счётчик неудачных PIN больше не пишется в users на каждую попытку
+    check_rate(auth_ip_limiter, ip)
+    check_rate(
+        pin_failure_limiter, data.user_id,
+        status_code=403, detail="Account temporarily locked due to failed attempts",
+    )
+
+    user = await db.scalar(select(User).where(User.id == data.user_id))
     if not user:
         raise HTTPException(404, "User not found")
 
-    # Проверяем блокировку
-    if user.pin_locked_until and user.pin_locked_until > datetime.utcnow():
-        raise HTTPException(403, "Account temporarily locked due to failed attempts")
-
     if not user.hashed_pin:
         raise HTTPException(400, "PIN not set for user")
 
-    if not verify_pin(data.pin, user.hashed_pin):
-        # неверный PIN -> инкремент попыток
-        user.pin_attempts = (user.pin_attempts or 0) + 1
-        if user.pin_attempts >= MAX_PIN_ATTEMPTS:
-            user.pin_locked_until = datetime.utcnow() + timedelta(minutes=LOCK_MINUTES)
-            user.pin_attempts = 0  # опционально обнуляем
-        db.add(user)
-        db.commit()
+    if not await hashing_pool.verify_pin(data.pin, user.hashed_pin):
+        # попытка уже учтена в pin_failure_limiter
+        log_action(user.id, "login_pin_fail", success=False, ip=ip)
         raise HTTPException(401, "Incorrect PIN")
 
-    # Успех
-    user.pin_attempts = 0
-    user.pin_locked_until = None
-    db.add(user)
-    db.commit()
+    # Успех — счётчик попыток обнуляется
+    pin_failure_limiter.reset(user.id)
+    log_action(user.id, "login_pin", ip=ip)
 
     # Создаём JWT токены
-    access_token = create_access_token({"sub": str(user.id)})
-    refresh_token = create_refresh_token({"sub": str(user.id)})
-
-    # Ставим refresh токен в HttpOnly cookie
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token,
-        httponly=True,
-        samesite="strict",
-        max_age=60*60*24*30
-    )
+    access_token = create_access_token(user.id)
+    _set_refresh_cookie(response, create_refresh_token(user.id))
 
     return {"access_token": access_token}
 
-@router.post("/refresh")
-def refresh_token(refresh_token: str = Cookie(None)):
+# -----------------------------
+# Единый вход: face / voice / PIN / пароль параллельно
+# -----------------------------
+
+mfa_policy = FactorPolicy(settings.MFA_REQUIRED_FACTORS, settings.MFA_MIN_FACTORS)
+
+
+async def _failed(detail: str) -> dict:
+    return {"verified": False, "detail": detail}
+
+
+async def _secret_factor(verify, plain: str, hashed: str | None, not_set: str) -> dict:
+    if not hashed:
+        return {"verified": False, "detail": not_set}
+    return {"verified": await verify(plain, hashed)}
+
+
+@router.post("/biometric")
+async def login_biometric(
+    request: Request,
+    response: Response,
+    user_id: int = Form(...),
+    pin: str | None = Form(None),
+    password: str | None = Form(None),
+    files: list[UploadFile] | None = File(None),
+    audio: UploadFile | None = File(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Log in with any combination of factors allowed by MFA_REQUIRED_FACTORS / MFA_MIN_FACTORS.
+
+    Face frames go to the inference pool, PIN/password to the hashing pool,
+    all at once; the answer comes as soon as the policy is met (or can no
+    longer be met), so the latency is that of the slowest needed factor.
+    """
+    ip = client_ip(request)
+    submitted = {
+        name for name, value in (("face", files), ("voice", audio), ("pin", pin), ("password", password))
+        if value
+    }
+    reason = mfa_policy.missing(submitted)
+    if reason:
+        raise HTTPException(400, reason)
+
+    # ✅ все лимиты — до БД, Argon2 и инференса
+    check_rate(auth_ip_limiter, ip)
+    if "pin" in submitted:
+        check_rate(
+            pin_failure_limiter, user_id,
+            status_code=403, detail="Account temporarily locked due to failed attempts",
+        )
+    if "face" in submitted:
+        check_rate(face_ip_limiter, ip)
+        check_rate(face_user_limiter, user_id)
+    if "voice" in submitted:
+        check_rate(voice_ip_limiter, ip)
+        check_rate(voice_user_limiter, user_id)
+
+    user = await db.scalar(select(User).where(User.id == user_id))
+    if not user:
+        raise HTTPException(404, "User not found")
+    # после rollback объект user протухает — нужные поля забираем сразу
+    email = user.email.lower()
+    if "password" in submitted:
+        check_rate(login_failure_limiter, email)
+
+    # шаблоны читаются заранее и последовательно: AsyncSession нельзя
+    # использовать из нескольких задач, а факторы ниже работают параллельно.
+    # В factors — фабрики (partial), корутины создаёт evaluate_factors: если
+    # чтение/rollback ниже упадут, не останется корутин, которые никто не ждёт
+    factors = {}
+    if "face" in submitted:
+        try:
+            templates = await load_face_templates(user_id, db)
+        except HTTPException as e:
+            factors["face"] = partial(_failed, e.detail)
+        else:
+            factors["face"] = (
+                partial(face_verdict, files, templates) if len(files) >= 2
+                else partial(_failed, "Need at least 2 images for liveness check")
+            )
+    if "voice" in submitted:
+        try:
+            factors["voice"] = partial(voice_verdict, audio, await load_voice_template(user_id, db))
+        except HTTPException as e:
+            factors["voice"] = partial(_failed, e.detail)
+    if "pin" in submitted:
+        factors["pin"] = partial(
+            _secret_factor, hashing_pool.verify_pin, pin, user.hashed_pin, "PIN not set for user"
+        )
+    if "password" in submitted:
+        factors["password"] = partial(
+            _secret_factor, hashing_pool.verify_password, password, user.hashed_password, "Password not set for user"
+        )
+    # соединение не держим на время инференса и Argon2
+    await db.rollback()
+
+    verified, results = await evaluate_factors(factors, mfa_policy)
+
+    # попытки PIN/пароля уже учтены — сбрасываем только по успешному фактору
+    if results.get("pin", {}).get("status") == "passed":
+        pin_failure_limiter.reset(user_id)
+    if results.get("password", {}).get("status") == "passed":
+        login_failure_limiter.reset(email)
+
+    log_action(user_id, "login_biometric", success=verified, ip=ip)
+    # разбивку по факторам клиенту не отдаём: иначе каждый фактор можно
+    # подбирать по отдельности (similarity лица, какой фактор не прошёл)
+    logger.info("login_biometric user=%s verified=%s factors=%s", user_id, verified, results)
+    if not verified:
+        raise HTTPException(401, "Authentication failed")
+
+    _set_refresh_cookie(response, create_refresh_token(user_id))
+    return {"access_token": create_access_token(user_id), "token_type": "bearer"}
+
+def _decode_refresh(refresh_token: str | None) -> dict:
     if not refresh_token:
         raise HTTPException(401, "No refresh token")
     try:
         payload = decode_token(refresh_token)
-        if payload.get("type") != "refresh":
-            raise HTTPException(401, "Invalid token type")
-        user_id = payload["sub"]
     except jwt.PyJWTError:
         raise HTTPException(401, "Invalid token")
+    if payload.get("type") != "refresh" or "jti" not in payload:
+        raise HTTPException(401, "Invalid token type")
+    return payload
+
+@router.post("/refresh")
+async def refresh_token(request: Request, response: Response, refresh_token: str = Cookie(None)):
+    payload = _decode_refresh(refresh_token)
+
+    # ✅ ротация: каждый refresh токен одноразовый — jti отзывается при
+    # использовании, повторное предъявление (украденная копия) -> 401
+    if not await token_store.revoke(payload["jti"], payload["exp"]):
+        log_action(int(payload["sub"]), "refresh_reuse", success=False, ip=client_ip(request))
+        raise HTTPException(401, "Refresh token already used")
+
+    user_id = int(payload["sub"])
+    _set_refresh_cookie(response, create_refresh_token(user_id))
+    return {"access_token": create_access_token(user_id)}
+
+@router.post("/logout")
+async def logout(request: Request, response: Response, refresh_token: str = Cookie(None)):
+    """Revoke the refresh cookie and the bearer access token (if sent)."""
+    user_id = None
+    tokens = [refresh_token]
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        tokens.append(authorization.removeprefix("Bearer "))
+
+    for token in tokens:
+        if not token:
+            continue
+        try:
+            payload = decode_token(token)
+        except jwt.PyJWTError:
+            continue  # истёкший/чужой токен отзывать не нужно
+        if "jti" in payload:
+            await token_store.revoke(payload["jti"], payload["exp"])
+            user_id = int(payload["sub"])
 
-    new_access = create_access_token({"sub": user_id})
-    return {"access_token": new_access}
\ No newline at end of file
+    response.delete_cookie(REFRESH_COOKIE, httponly=True, samesite="strict")
+    if user_id is not None:
+        log_action(user_id, "logout", ip=client_ip(request))
+    return {"message": "Logged out"}
\ No newline at end of file
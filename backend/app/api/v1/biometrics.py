@@ -1,13 +1,34 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+import asyncio
+
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse
+from sqlalchemy import null, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 import numpy as np
-import cv2
-import insightface
 
+from app.db.locks import lock_users
 from app.db.session import get_db
 from app.models.biometric import Biometric
-from app.core.security import encrypt_data, decrypt_data
+from app.models.face_template import FaceTemplate
+from app.core.config import settings
+from app.services.audit_writer import client_ip, log_action
+from app.services.face_index import face_index
+from app.services.image_io import ImageTooLarge, read_upload, release_buffers
+from app.services.inference_pool import inference_pool
+from app.services.metrics import stage, timed
+from app.services.rate_limiter import check_rate, face_ip_limiter, face_user_limiter
+from app.services.reembed import reembedder
+from app.services.template_cache import UserTemplates, template_cache
+from app.services.template_codec import Template, is_current, open_templates, seal_template
+from app.services.face_service import (
+    analyze_frame,
+    analyze_frames,
+    centroid,
+    decode_image,
+    get_best_face,
+    score_templates,
+)
 
 router = APIRouter()
 
@@ -27,52 +48,16 @@ ROTATION_ABS_MIN = 10     # abs(yaw) >= 10
 # Разница между front и rotated должна быть существенной
 ROTATION_DELTA_MIN = 10   # abs(yaw_rot - yaw_front) >= 10
 
-# -----------------------------
-# Модель
-# -----------------------------
-face_model = insightface.app.FaceAnalysis(name="buffalo_l")
-face_model.prepare(ctx_id=-1)
-
 
 # -----------------------------
 # Вспомогательные функции
 # -----------------------------
 
-def decode_image(file_bytes: bytes):
-    """Decode bytes into cv2 image."""
-    np_arr = np.frombuffer(file_bytes, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    return img
-
-
-def get_best_face(img):
-    """Return the biggest detected face (most likely the user)."""
-    faces = face_model.get(img)
-    if not faces:
-        return None
-
-    # выбираем самое крупное лицо (по площади bbox)
-    best = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-    return best
-
-
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    """Cosine similarity between embeddings."""
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
-
-
-# -----------------------------
-# Этап 1: регистрация лица
-# -----------------------------
-@router.post("/biometrics/face/enroll")
-async def enroll_face(
-    user_id: int,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
-    contents = await file.read()
-    img = decode_image(contents)
-
+def _enroll_embedding(contents):
+    try:
+        img = decode_image(contents)
+    except ImageTooLarge:
+        raise HTTPException(status_code=413, detail="Image resolution is too large")
     if img is None:
         raise HTTPException(status_code=400, detail="Invalid image file")
 
@@ -80,95 +65,89 @@ async def enroll_face(
     if not face:
         raise HTTPException(status_code=400, detail="No face detected")
 
-    # берем embedding одного лица
-    embedding = np.array(face.embedding, dtype=np.float32)
-
-    encrypted_embedding = encrypt_data(embedding.tobytes())
-
-    # ✅ если запись уже есть — обновляем
-    biometric = db.query(Biometric).filter(Biometric.user_id == user_id).first()
-
-    if biometric:
-        biometric.face_template = encrypted_embedding
-        db.commit()
-        db.refresh(biometric)
-        return {
-            "message": "Face updated successfully",
-            "biometric_id": biometric.id
-        }
-
-    # иначе создаём новую
-    biometric_record = Biometric(user_id=user_id, face_template=encrypted_embedding)
-    db.add(biometric_record)
-    db.commit()
-    db.refresh(biometric_record)
-
-    return {
-        "message": "Face enrolled successfully",
-        "biometric_id": biometric_record.id
-    }
-
-
-# -----------------------------
-# Этап 2: верификация лица (multiframe)
-# -----------------------------
-@router.post("/biometrics/face/verify-multiframe")
-async def verify_multiframe(
-    user_id: int,
-    files: list[UploadFile] = File(...),
-    db: Session = Depends(get_db)
-):
-    # ✅ минимум 2 кадра
-    if len(files) < 2:
-        raise HTTPException(400, detail="Need at least 2 images for liveness check")
-
-    biometric = db.query(Biometric).filter(Biometric.user_id == user_id).first()
-    if not biometric:
-        raise HTTPException(404, detail="User not enrolled")
-
-    saved_embedding = np.frombuffer(
-        decrypt_data(biometric.face_template),
-        dtype=np.float32
-    )
-
-    frames = []
-
-    # ✅ обрабатываем все кадры
-    for idx, file in enumerate(files):
-        content = await file.read()
-        img = decode_image(content)
-        if img is None:
-            continue
-
-        face = get_best_face(img)
-        if not face:
-            continue
-
-        emb = np.array(face.embedding, dtype=np.float32)
-        yaw = float(face.pose[0])  # yaw (left/right head turn)
-        sim = cosine_similarity(emb, saved_embedding)
-
-        frames.append({
-            "idx": idx,
-            "yaw": yaw,
-            "embedding": emb,
-            "similarity": sim,
-        })
-
-    # если лицо распознано менее чем в 2 кадрах — fail
-    if len(frames) < 2:
-        raise HTTPException(400, detail="Face not detected on enough frames")
-
-    # ---------------------------------------------------------
-    # 1) выбираем лучший front: yaw ближе всего к 0
-    # ---------------------------------------------------------
-    best_front = min(frames, key=lambda x: abs(x["yaw"]))
-
-    # ---------------------------------------------------------
-    # 2) выбираем лучший rotated: максимальный abs(yaw)
-    # ---------------------------------------------------------
-    best_rotated = max(frames, key=lambda x: abs(x["yaw"]))
-
+    return np.array(face.embedding, dtype=np.float32), float(face.pose[0])
+
+
+def _identify(contents, top_k: int) -> list[tuple[int, float]]:
+    embedding, _ = _enroll_embedding(contents)
+    return face_index.search(embedding, top_k, THRESHOLD)
+
+
+@timed("decrypt")
+def _open_templates(blobs: list, default_models: list | None = None) -> list[Template]:
+    return open_templates(blobs, default_models)
+
+
+async def _migrate_templates(db: AsyncSession, column, rows: list[tuple[int, Template]]) -> bool:
+    """Rewrite rows still in an old format (legacy float32 / other TEMPLATE_DTYPE).
+
+    Only templates of the current model are touched; returns True when
+    something was written (the caller commits).
+    """
+    table = column.class_
+    stale = [
+        (row_id, template) for row_id, template in rows
+        if template.model_id == settings.FACE_MODEL_PACK and not is_current(template, settings.FACE_MODEL_PACK)
+    ]
+    for row_id, template in stale:
+        await db.execute(
+            update(table).where(table.id == row_id).values({column.key: seal_template(template.vector)})
+        )
+    return bool(stale)
+
+
+def _pick_model(decoded: list[tuple[int, Template]]) -> list[tuple[int, Template]]:
+    """Templates to verify against: current model first, legacy model during a migration."""
+    for model_id in (settings.FACE_MODEL_PACK, settings.FACE_LEGACY_MODEL_PACK):
+        picked = [(row_id, t) for row_id, t in decoded if model_id and t.model_id == model_id]
+        if picked:
+            return picked
+    # шаблоны другой модели сравнивать не с чем — только новая регистрация
+    raise HTTPException(409, detail="Face templates are outdated, re-enroll required")
+
+
+async def load_face_templates(user_id: int, db: AsyncSession) -> UserTemplates:
+    """(T, 512) normalized templates of the user: cache first, then DB + decrypt."""
+    cached = template_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    column = FaceTemplate.template
+    with stage("template_fetch"):
+        rows = (await db.execute(
+            select(FaceTemplate.id, column, FaceTemplate.model_id).where(FaceTemplate.user_id == user_id)
+        )).all()
+        if not rows:
+            # пользователь без face_templates (запись до миграции) — один шаблон
+            column = Biometric.face_template
+            rows = (await db.execute(
+                select(Biometric.id, column, null()).where(Biometric.user_id == user_id)
+            )).all()
+            if not rows:
+                raise HTTPException(404, detail="User not enrolled")
+    row_ids, blobs, models = zip(*rows)
+    decoded = _pick_model(list(zip(row_ids, _open_templates(list(blobs), list(models)))))
+    templates = np.stack([template.vector for _, template in decoded])
+
+    # ленивая миграция формата: строка перезаписывается один раз, при первом чтении
+    if settings.TEMPLATE_MIGRATE_ON_READ and await _migrate_templates(db, column, decoded):
+        await db.commit()
+    else:
+        # закрываем read-транзакцию: соединение не должно висеть на время инференса
+        await db.rollback()
+    return template_cache.put(user_id, templates, decoded[0][1].model_id)
+
+
+def _queue_reembed(templates: UserTemplates, verdict: dict, *frames: dict):
+    """After a successful legacy-model verification, re-enroll from its frames in the background."""
+    if verdict["verified"] and templates.model_id != settings.FACE_MODEL_PACK:
+        # front и rotated могут совпасть (два кадра с одинаковым yaw)
+        unique = {id(f): f for f in frames}.values()
+        reembedder.submit(templates.user_id, [(f["crop"], f["yaw"]) for f in unique])
+
+
+def _liveness_verdict(best_front: dict, best_rotated: dict) -> dict:
+    """Identity + head-rotation decision from the chosen front/rotated frames."""
     yaw_front = best_front["yaw"]
     yaw_rot = best_rotated["yaw"]
 
@@ -190,7 +169,7 @@ async def verify_multiframe(
 
     liveness_pass = bool(identity_ok and rotation_detected)
 
-    result = {
+    return {
         "verified": liveness_pass,
         "similarity": similarity,
 
@@ -211,9 +190,335 @@ async def verify_multiframe(
         "front_max_angle": FRONT_MAX_ANGLE,
         "rotation_abs_min": ROTATION_ABS_MIN,
         "rotation_delta_min": ROTATION_DELTA_MIN,
+    }
+
+
+# -----------------------------
+# Этап 1: регистрация лица
+# -----------------------------
+@router.post("/biometrics/face/enroll")
+async def enroll_face(
+    user_id: int,
+    request: Request,
+    file: UploadFile = File(...),
+    replace: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """Add one face template (up to FACE_MAX_TEMPLATES); ``replace`` starts over."""
+    buffers = []
+    contents = await read_upload(file, buffers)
+
+    # берем embedding одного лица (инференс — в пуле, не в event loop)
+    embedding, yaw = await inference_pool.run(
+        _enroll_embedding, contents, on_done=lambda: release_buffers(buffers)
+    )
+
+    # ✅ блокируем строку пользователя до commit: параллельные enroll одного
+    # пользователя иначе оба проходят проверку лимита по старому SELECT
+    locked = await db.scalar(lock_users([user_id]))
+    if locked is None:
+        raise HTTPException(404, detail="User not found")
+
+    templates = list((await db.scalars(select(FaceTemplate).where(FaceTemplate.user_id == user_id))).all())
+    if replace:
+        for template in templates:
+            await db.delete(template)
+        templates = []
+
+    # ✅ лимит шаблонов: заменяем тот, чей ракурс ближе всего к новому,
+    # чтобы набор оставался "фронт + несколько поворотов"
+    if len(templates) >= settings.FACE_MAX_TEMPLATES:
+        closest = min(templates, key=lambda t: abs((t.yaw or 0.0) - yaw))
+        await db.delete(closest)
+        templates.remove(closest)
+
+    # ✅ шаблоны старой модели с новым embedding не смешиваем — заменяем
+    for template in [t for t in templates if t.model_id != settings.FACE_MODEL_PACK]:
+        await db.delete(template)
+        templates.remove(template)
+
+    db.add(FaceTemplate(user_id=user_id, template=seal_template(embedding), model_id=settings.FACE_MODEL_PACK, yaw=yaw))
+
+    # в biometrics.face_template храним центроид — по нему работают индекс и 1:N
+    vectors = np.stack([t.vector for t in _open_templates([t.template for t in templates])] + [embedding])
+    user_centroid = centroid(vectors)
+    encrypted_centroid = seal_template(user_centroid)
+
+    # ✅ если запись уже есть — обновляем
+    biometric = await db.scalar(select(Biometric).where(Biometric.user_id == user_id))
+    created = biometric is None
+    if created:
+        biometric = Biometric(user_id=user_id, face_template=encrypted_centroid)
+        db.add(biometric)
+    else:
+        biometric.face_template = encrypted_centroid
+
+    await db.commit()
+    await db.refresh(biometric)
+
+    template_cache.invalidate(user_id)
+    if settings.FACE_INDEX_ENABLED:
+        face_index.add(user_id, user_centroid)
+
+    log_action(user_id, "face_enroll", ip=client_ip(request))
+
+    return {
+        "message": "Face enrolled successfully" if created else "Face updated successfully",
+        "biometric_id": biometric.id,
+        "templates": len(vectors),
+    }
+
+
+async def face_verdict(files: list[UploadFile], templates: UserTemplates) -> dict:
+    """Liveness + identity verdict for uploaded frames against ``templates``.
+
+    No DB access (templates are loaded by the caller), so it can run
+    concurrently with other factors. Frames are embedded with the model the
+    templates were made with; a verified legacy-model user is queued for
+    re-embedding. When fewer than 2 frames have a face the result carries
+    ``verified=False`` and a ``detail``.
+    """
+    # кадры читаются в переиспользуемые буферы, отдаём их после инференса
+    buffers = []
+    try:
+        contents = [await read_upload(file, buffers) for file in files]
+    except BaseException:
+        release_buffers(buffers)
+        raise
+
+    # ✅ обрабатываем все кадры одной задачей в пуле инференса
+    # кадры, отсеянные фильтром качества/детектором, в анализ не попадают
+    frames, rejected = await inference_pool.run(
+        analyze_frames, contents, templates.model_id, on_done=lambda: release_buffers(buffers)
+    )
+
+    # в лёгком профиле embedding есть только у front кадра
+    embedded = [f for f in frames if f["embedding"] is not None]
+    for frame in frames:
+        frame["similarity"] = None
+    if embedded:
+        # все кадры x все шаблоны одной матрицей, затем fusion по шаблонам
+        sims = score_templates(
+            np.stack([f["embedding"] for f in embedded]), templates.matrix, settings.FACE_SCORE_FUSION
+        )
+        for frame, sim in zip(embedded, sims):
+            frame["similarity"] = float(sim)
+
+    # если лицо распознано менее чем в 2 кадрах — fail
+    if len(frames) < 2:
+        return {
+            "verified": False,
+            "detail": "Face not detected on enough frames",
+            "rejected_frames": rejected,
+        }
+
+    # ---------------------------------------------------------
+    # 1) выбираем лучший front: yaw ближе всего к 0
+    # ---------------------------------------------------------
+    best_front = min(frames, key=lambda x: abs(x["yaw"]))
+
+    # ---------------------------------------------------------
+    # 2) выбираем лучший rotated: максимальный abs(yaw)
+    # ---------------------------------------------------------
+    best_rotated = max(frames, key=lambda x: abs(x["yaw"]))
+
+    verdict = _liveness_verdict(best_front, best_rotated)
+    _queue_reembed(templates, verdict, best_front, best_rotated)
+
+    return {
+        **verdict,
 
         # полезно для анализа
         "frames_detected": len(frames),
+        "rejected_frames": rejected,
+        "templates_compared": len(templates.matrix),
+        "score_fusion": settings.FACE_SCORE_FUSION,
     }
 
+
+# -----------------------------
+# Этап 2: верификация лица (multiframe)
+# -----------------------------
+@router.post("/biometrics/face/verify-multiframe")
+async def verify_multiframe(
+    user_id: int,
+    request: Request,
+    files: list[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    # ✅ минимум 2 кадра
+    if len(files) < 2:
+        raise HTTPException(400, detail="Need at least 2 images for liveness check")
+
+    # ✅ лимиты до чтения кадров и инференса
+    check_rate(face_ip_limiter, client_ip(request))
+    check_rate(face_user_limiter, user_id)
+
+    # шаблоны уже нормализованы (из кэша или только что положены туда)
+    templates = await load_face_templates(user_id, db)
+
+    result = await face_verdict(files, templates)
+    log_action(user_id, "face_verify", success=result["verified"], ip=client_ip(request))
+
+    if "detail" in result:
+        # detail остаётся строкой (фронт показывает его как есть)
+        return JSONResponse(status_code=400, content={
+            "detail": result["detail"],
+            "rejected_frames": result["rejected_frames"],
+        })
+
     return jsonable_encoder(result)
+
+
+# -----------------------------
+# Этап 2b: потоковая верификация (WebSocket)
+# -----------------------------
+# Клиент шлёт кадры бинарными сообщениями по одному (текст "end" — кадров
+# больше не будет). После каждого кадра сервер отвечает {"type": "frame"},
+# в конце — {"type": "verdict", ...} с теми же полями, что verify-multiframe.
+# Сессия завершается сразу, как только front + rotated + similarity выполнены.
+@router.websocket("/biometrics/face/verify-stream")
+async def verify_stream(
+    websocket: WebSocket,
+    user_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    await websocket.accept()
+
+    async def fail(status: int, detail: str, code: int):
+        await websocket.send_json({"type": "error", "status": status, "detail": detail})
+        await websocket.close(code=code)
+
+    try:
+        check_rate(face_ip_limiter, client_ip(websocket))
+        check_rate(face_user_limiter, user_id)
+    except HTTPException as e:
+        await fail(e.status_code, e.detail, 1013)
+        return
+
+    try:
+        templates = await load_face_templates(user_id, db)
+    except HTTPException as e:
+        await fail(e.status_code, e.detail, 1008)
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.FACE_STREAM_MAX_SECONDS
+
+    best_front = best_rotated = None
+    frames_received = frames_detected = 0
+    rejected = []
+    seen_hashes = []
+    verdict = None
+
+    try:
+        while frames_received < settings.FACE_STREAM_MAX_FRAMES:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is None:
+                break  # "end" или любой текст — кадров больше нет
+
+            idx = frames_received
+            frames_received += 1
+
+            # embedding считаем только если кадр станет новым front
+            front_yaw = abs(best_front["yaw"]) if best_front else float("inf")
+            try:
+                frame, reason = await inference_pool.run(
+                    analyze_frame, message["bytes"], front_yaw, seen_hashes, templates.model_id
+                )
+            except HTTPException as e:
+                # 429/504 от пула: клиенту стоит повторить позже
+                await fail(e.status_code, e.detail, 1013)
+                return
+
+            if frame is None:
+                rejected.append({"idx": idx, "reason": reason})
+                await websocket.send_json({"type": "frame", "idx": idx, "face": False, "reason": reason})
+                continue
+
+            frames_detected += 1
+            frame["idx"] = idx
+            frame["similarity"] = None
+            if frame["embedding"] is not None:
+                frame["similarity"] = float(score_templates(
+                    frame["embedding"][None, :], templates.matrix, settings.FACE_SCORE_FUSION
+                )[0])
+                best_front = frame
+            if best_rotated is None or abs(frame["yaw"]) > abs(best_rotated["yaw"]):
+                best_rotated = frame
+
+            await websocket.send_json({
+                "type": "frame",
+                "idx": idx,
+                "face": True,
+                "yaw": frame["yaw"],
+                "similarity": frame["similarity"],
+            })
+
+            if frames_detected >= 2:
+                verdict = _liveness_verdict(best_front, best_rotated)
+                if verdict["verified"]:
+                    break  # ✅ ранний выход: всё уже выполнено
+
+        if verdict is None:
+            log_action(user_id, "face_verify_stream", success=False, ip=client_ip(websocket))
+            await fail(400, "Face not detected on enough frames", 1000)
+            return
+
+        log_action(user_id, "face_verify_stream", success=verdict["verified"], ip=client_ip(websocket))
+        _queue_reembed(templates, verdict, best_front, best_rotated)
+
+        await websocket.send_json(jsonable_encoder({
+            "type": "verdict",
+            **verdict,
+            "frames_received": frames_received,
+            "frames_detected": frames_detected,
+            "rejected_frames": rejected,
+            "templates_compared": len(templates.matrix),
+            "score_fusion": settings.FACE_SCORE_FUSION,
+        }))
+        await websocket.close()
+    except WebSocketDisconnect:
+        return
+
+
+# -----------------------------
+# 1:N идентификация по одному кадру
+# -----------------------------
+@router.post("/biometrics/face/identify")
+async def identify_face(
+    file: UploadFile = File(...),
+    top_k: int = settings.IDENTIFY_TOP_K,
+):
+    if not settings.FACE_INDEX_ENABLED:
+        raise HTTPException(404, detail="Identification is disabled")
+    if not face_index.ready:
+        raise HTTPException(503, detail="Face index is not ready yet")
+    if top_k < 1:
+        raise HTTPException(400, detail="top_k must be >= 1")
+
+    buffers = []
+    contents = await read_upload(file, buffers)
+
+    # embedding + поиск по матрице — оба CPU-bound, выполняем в пуле
+    matches = await inference_pool.run(
+        _identify, contents, top_k, on_done=lambda: release_buffers(buffers)
+    )
+
+    return {
+        "matches": [
+            {"user_id": user_id, "similarity": similarity}
+            for user_id, similarity in matches
+        ],
+        "threshold_similarity": THRESHOLD,
+        "gallery_size": len(face_index),
+    }
@@ -0,0 +1,133 @@
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import numpy as np
+
+from app.db.session import get_db
+from app.models.biometric import Biometric
+from app.core.config import settings
+from app.services.audio_io import AudioError
+from app.services.audit_writer import client_ip, log_action
+from app.services.inference_pool import inference_pool
+from app.services.metrics import timed
+from app.services.rate_limiter import check_rate, voice_ip_limiter, voice_user_limiter
+from app.services.template_codec import open_template, seal_template
+from app.services.voice_models import voice_models
+from app.services.voice_service import voice_embedding
+
+router = APIRouter()
+
+
+# -----------------------------
+# Вспомогательные функции
+# -----------------------------
+
+def _check_upload(file: UploadFile):
+    if not voice_models.configured:
+        raise HTTPException(503, detail="Voice model is not configured")
+
+    size = file.size
+    if size is None:
+        file.file.seek(0, 2)
+        size = file.file.tell()
+    if size > settings.VOICE_MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(413, detail="Uploaded audio is too large")
+
+
+def _embed_upload(fileobj) -> dict:
+    # файл читается чанками прямо из SpooledTemporaryFile, целиком в память не попадает
+    try:
+        return voice_embedding(fileobj)
+    except AudioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@timed("decrypt")
+def _decrypt_embedding(blob: bytes) -> np.ndarray:
+    return open_template(blob, voice_models.model_id).vector
+
+
+async def load_voice_template(user_id: int, db: AsyncSession) -> np.ndarray:
+    blob = await db.scalar(select(Biometric.voice_template).where(Biometric.user_id == user_id))
+    if blob is None:
+        raise HTTPException(404, detail="Voice not enrolled")
+    return _decrypt_embedding(blob)
+
+
+async def voice_verdict(audio: UploadFile, template: np.ndarray) -> dict:
+    """Speaker check of one recording against the stored template (no DB access)."""
+    _check_upload(audio)
+    result = await inference_pool.run(_embed_upload, audio.file)
+
+    # оба вектора L2-нормализованы -> cosine = dot
+    similarity = float(np.dot(result["embedding"], template.astype(np.float32)))
+    return {
+        "verified": similarity >= settings.VOICE_THRESHOLD,
+        "similarity": similarity,
+        "threshold_similarity": settings.VOICE_THRESHOLD,
+        "speech_seconds": result["speech_seconds"],
+        "audio_seconds": result["audio_seconds"],
+        "segments": result["segments"],
+    }
+
+
+# -----------------------------
+# Регистрация голоса
+# -----------------------------
+@router.post("/biometrics/voice/enroll")
+async def enroll_voice(
+    user_id: int,
+    request: Request,
+    audio: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """Store the speaker embedding of one recording (replaces the previous one)."""
+    _check_upload(audio)
+
+    # голос — второй фактор после лица, строка biometrics создаётся на face enroll
+    biometric = await db.scalar(select(Biometric).where(Biometric.user_id == user_id))
+    if biometric is None:
+        raise HTTPException(400, detail="Enroll face first")
+
+    result = await inference_pool.run(_embed_upload, audio.file)
+
+    created = biometric.voice_template is None
+    biometric.voice_template = seal_template(result["embedding"], voice_models.model_id)
+    await db.commit()
+
+    log_action(user_id, "voice_enroll", ip=client_ip(request))
+
+    return {
+        "message": "Voice enrolled successfully" if created else "Voice updated successfully",
+        "biometric_id": biometric.id,
+        "speech_seconds": result["speech_seconds"],
+    }
+
+
+# -----------------------------
+# Верификация голоса
+# -----------------------------
+@router.post("/biometrics/voice/verify")
+async def verify_voice(
+    user_id: int,
+    request: Request,
+    audio: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    _check_upload(audio)
+
+    # ✅ лимиты до инференса
+    check_rate(voice_ip_limiter, client_ip(request))
+    check_rate(voice_user_limiter, user_id)
+
+    template = await load_voice_template(user_id, db)
+
+    try:
+        result = await voice_verdict(audio, template)
+    except HTTPException as e:
+        if e.status_code == 400:
+            log_action(user_id, "voice_verify", success=False, ip=client_ip(request))
+        raise
+
+    log_action(user_id, "voice_verify", success=result["verified"], ip=client_ip(request))
+    return result
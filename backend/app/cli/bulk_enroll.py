@@ -0,0 +1,324 @@
+"""Bulk face enrollment from a directory, .zip or .tar(.gz) of photos.
+
+    python -m app.cli.bulk_enroll --source photos.tar.gz --manifest manifest.csv
+
+``manifest.csv`` has a header with ``user_id,path`` (path relative to the
+source root / archive member name; several photos per user become several
+templates, up to FACE_MAX_TEMPLATES). Images are decoded and embedded in
+worker processes (detection per image, recognition batched per chunk),
+results are written per chunk in one transaction: FaceTemplate rows plus a
+Biometric upsert with the new centroid.
+
+Processed paths are appended to the journal (``<manifest>.done`` by
+default) after their transaction commits, so an interrupted run can simply
+be started again. Rejected images go to the error report CSV.
+A running API picks the new templates up on its next start (the face index
+snapshot is caught up via ``biometrics.updated_at``).
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.db.locks import lock_users
+from app.db.session import SessionLocal
+from app.models.biometric import Biometric
+from app.models.face_template import FaceTemplate
+from app.services.template_codec import open_templates, seal_template
+
+
+# -----------------------------
+# Источник и манифест
+# -----------------------------
+
+def _member_name(name: str) -> str:
+    return name.replace(os.sep, "/").removeprefix("./")
+
+
+def iter_source(source: str, wanted):
+    """Yield ``(name, bytes)`` in storage order, reading only names ``wanted(name)`` accepts."""
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = _member_name(os.path.relpath(path, source))
+                if wanted(name):
+                    with open(path, "rb") as f:
+                        yield name, f.read()
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = _member_name(info.filename)
+                if not info.is_dir() and wanted(name):
+                    yield name, archive.read(info)
+    elif tarfile.is_tarfile(source):
+        # "r|*" — потоковое чтение, без построения списка всех членов архива
+        with tarfile.open(source, "r|*") as archive:
+            for member in archive:
+                name = _member_name(member.name)
+                if member.isfile() and wanted(name):
+                    yield name, archive.extractfile(member).read()
+    else:
+        raise SystemExit(f"Unsupported source: {source} (directory, .zip or .tar expected)")
+
+
+def read_manifest(path: str) -> dict[str, int]:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or not {"user_id", "path"} <= set(reader.fieldnames):
+            raise SystemExit("Manifest must have a header with user_id,path columns")
+        return {_member_name(row["path"]): int(row["user_id"]) for row in reader}
+
+
+def read_journal(path: str) -> set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+# -----------------------------
+# Воркеры
+# -----------------------------
+
+def _init_worker(onnx_threads: int):
+    from app.services.face_models import face_models
+
+    face_models.load(onnx_threads=onnx_threads)
+
+
+def _embed_chunk(contents: list):
+    from app.services.face_service import embed_enroll_images
+
+    return embed_enroll_images(contents)
+
+
+class _InlineFuture:
+    """``--workers 0``: run the chunk in this process (debugging / tiny imports)."""
+
+    def __init__(self, contents):
+        self._result = _embed_chunk(contents)
+
+    def result(self):
+        return self._result
+
+
+# -----------------------------
+# Запись в БД
+# -----------------------------
+
+def _upsert_biometrics(db, rows: list[dict]):
+    """INSERT ... ON CONFLICT (user_id) DO UPDATE for all rows in one statement."""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(Biometric).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Biometric.user_id],
+        # onupdate не срабатывает для upsert — ставим водяной знак явно
+        set_={"face_template": stmt.excluded.face_template, "updated_at": func.now()},
+    )
+    db.execute(stmt)
+
+
+def store_chunk(db, items: list[tuple[str, int, np.ndarray, float]]) -> list[tuple[str, int, str]]:
+    """Write templates of one chunk in one transaction; returns (path, user_id, reason) errors."""
+    from app.services.face_service import centroid
+
+    user_ids = sorted({user_id for _, user_id, _, _ in items})
+    # блокируем пользователей чанка до commit — как enroll и re-embedding,
+    # иначе параллельная запись шаблонов проскочит между чтением и заменой
+    known = set(db.scalars(lock_users(user_ids)))
+
+    # существующие шаблоны: (строка, вектор) — нужны для лимита и центроида
+    templates = defaultdict(list)
+    existing = []
+    for template in db.scalars(select(FaceTemplate).where(FaceTemplate.user_id.in_(user_ids))):
+        if template.model_id != settings.FACE_MODEL_PACK:
+            # шаблоны старой модели с новыми не смешиваем — заменяются целиком
+            db.delete(template)
+        else:
+            existing.append(template)
+    for template, opened in zip(existing, open_templates([t.template for t in existing])):
+        templates[template.user_id].append((template, opened.vector))
+
+    errors = []
+    changed = set()
+    for path, user_id, embedding, yaw in items:
+        if user_id not in known:
+            errors.append((path, user_id, "unknown_user"))
+            continue
+        user_templates = templates[user_id]
+        # как в /face/enroll: при лимите заменяем шаблон с ближайшим ракурсом
+        if len(user_templates) >= settings.FACE_MAX_TEMPLATES:
+            closest = min(user_templates, key=lambda t: abs((t[0].yaw or 0.0) - yaw))
+            db.delete(closest[0])
+            user_templates.remove(closest)
+        template = FaceTemplate(
+            user_id=user_id, template=seal_template(embedding), model_id=settings.FACE_MODEL_PACK, yaw=yaw
+        )
+        db.add(template)
+        user_templates.append((template, embedding))
+        changed.add(user_id)
+
+    if changed:
+        _upsert_biometrics(db, [
+            {
+                "user_id": user_id,
+                "face_template": seal_template(centroid(np.stack([vector for _, vector in templates[user_id]]))),
+            }
+            for user_id in sorted(changed)
+        ])
+    db.commit()
+    return errors
+
+
+# -----------------------------
+# Основной цикл
+# -----------------------------
+
+class Progress:
+    def __init__(self, total: int, every: int):
+        self.total = total
+        self.every = every
+        self.started = time.monotonic()
+        self.processed = 0
+        self.enrolled = 0
+        self.reasons = Counter()
+        self._next_report = every
+
+    def add(self, enrolled: int, errors: list):
+        self.enrolled += enrolled
+        self.processed += enrolled + len(errors)
+        self.reasons.update(reason for _, _, reason in errors)
+        if self.processed >= self._next_report:
+            self._next_report += self.every
+            print(
+                f"{self.processed}/{self.total} images, {self.enrolled} enrolled, "
+                f"{self.processed - self.enrolled} rejected, {self.rate():.1f} img/s",
+                file=sys.stderr,
+            )
+
+    def rate(self) -> float:
+        return self.processed / max(time.monotonic() - self.started, 1e-9)
+
+
+def run(args):
+    manifest = read_manifest(args.manifest)
+    journal_path = args.journal or args.manifest + ".done"
+    done = read_journal(journal_path)
+    todo = {path: user_id for path, user_id in manifest.items() if path not in done}
+    print(f"{len(manifest)} images in manifest, {len(manifest) - len(todo)} already done", file=sys.stderr)
+
+    report_exists = os.path.exists(args.report)
+    report = open(args.report, "a", newline="", encoding="utf-8")
+    report_writer = csv.writer(report)
+    if not report_exists:
+        report_writer.writerow(["path", "user_id", "reason"])
+    journal = open(journal_path, "a", encoding="utf-8")
+
+    executor = None
+    if args.workers > 0:
+        onnx_threads = args.onnx_threads or max(1, (os.cpu_count() or 1) // args.workers)
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(onnx_threads,),
+        )
+
+    progress = Progress(len(todo), args.progress_every)
+    pending = deque()  # (future, names) — не больше 2 чанков на воркер в полёте
+    seen = set()
+
+    def submit(chunk):
+        names = [name for name, _ in chunk]
+        contents = [data for _, data in chunk]
+        future = executor.submit(_embed_chunk, contents) if executor else _InlineFuture(contents)
+        pending.append((future, names))
+
+    def drain():
+        future, names = pending.popleft()
+        items, errors = [], []
+        for name, (embedding, yaw, reason) in zip(names, future.result()):
+            if reason:
+                errors.append((name, todo[name], reason))
+            else:
+                items.append((name, todo[name], embedding, yaw))
+        if items:
+            with SessionLocal() as db:
+                db_errors = store_chunk(db, items)
+            failed = {name for name, _, _ in db_errors}
+            errors += db_errors
+            items = [item for item in items if item[0] not in failed]
+
+        report_writer.writerows(errors)
+        report.flush()
+        # журнал пишется только после commit — при падении чанк обработается заново
+        journal.writelines(name + "\n" for name in names)
+        journal.flush()
+        progress.add(len(items), errors)
+
+    def wanted(name):
+        return name in todo and name not in seen
+
+    try:
+        chunk = []
+        for name, data in iter_source(args.source, wanted):
+            seen.add(name)
+            chunk.append((name, data))
+            if len(chunk) == args.batch_size:
+                submit(chunk)
+                chunk = []
+            while len(pending) >= max(1, args.workers) * 2:
+                drain()
+        if chunk:
+            submit(chunk)
+        while pending:
+            drain()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        journal.close()
+        report.close()
+
+    missing = len(todo) - len(seen)
+    elapsed = time.monotonic() - progress.started
+    print(
+        f"done: {progress.processed} images in {elapsed:.1f}s ({progress.rate():.1f} img/s), "
+        f"{progress.enrolled} enrolled, {progress.processed - progress.enrolled} rejected, "
+        f"{missing} missing from source",
+        file=sys.stderr,
+    )
+    for reason, count in progress.reasons.most_common():
+        print(f"  {reason}: {count}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="directory, .zip or .tar(.gz) with the photos")
+    parser.add_argument("--manifest", required=True, help="CSV with user_id,path columns")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="inference processes (0 = inline)")
+    parser.add_argument("--onnx-threads", type=int, default=0, help="ONNX threads per worker (0 = cpus / workers)")
+    parser.add_argument("--batch-size", type=int, default=32, help="images per worker task / DB transaction")
+    parser.add_argument("--journal", default="", help="resume journal (default: <manifest>.done)")
+    parser.add_argument("--report", default="bulk_enroll_errors.csv", help="per-image error report")
+    parser.add_argument("--progress-every", type=int, default=500)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
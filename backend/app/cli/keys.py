@@ -0,0 +1,96 @@
+"""Keyring management for template encryption (envelope keys).
+
+    python -m app.cli.keys init                       # new keyring with data key 1
+    python -m app.cli.keys add-key                    # new epoch: key N+1 becomes active
+    python -m app.cli.keys rewrap --new-master-file new_master.hex
+    python -m app.cli.keys status
+    python -m app.cli.keys generate-master > new_master.hex
+
+Works on KEYRING_PATH with the master key from MASTER_KEY / MASTER_KEY_FILE.
+None of the commands touches the database: ``add-key`` only changes what
+new ciphertexts are written with, ``rewrap`` re-encrypts the data keys
+under a new master key (switch MASTER_KEY before the next restart).
+Running API processes read the file again when they meet an unknown key id.
+"""
+import argparse
+import os
+import sys
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.core.config import settings
+from app.core.keyring import (
+    add_data_key,
+    fingerprint,
+    load_master_key,
+    new_keyring,
+    read_keyring_file,
+    rewrap,
+    write_keyring_file,
+)
+
+
+def _master_key() -> bytes:
+    return load_master_key(settings.MASTER_KEY, settings.MASTER_KEY_FILE)
+
+
+def cmd_init(args):
+    if os.path.exists(args.keyring):
+        raise SystemExit(f"{args.keyring} already exists")
+    data = new_keyring(_master_key())
+    write_keyring_file(args.keyring, data)
+    print(f"Keyring created, active data key: {data['active']}")
+
+
+def cmd_add_key(args):
+    data = add_data_key(read_keyring_file(args.keyring), _master_key())
+    write_keyring_file(args.keyring, data)
+    print(f"Active data key: {data['active']}")
+
+
+def cmd_rewrap(args):
+    new_master = load_master_key(path=args.new_master_file)
+    data = rewrap(read_keyring_file(args.keyring), _master_key(), new_master)
+    write_keyring_file(args.keyring, data)
+    print(f"{len(data['keys'])} data key(s) re-wrapped, master fingerprint: {data['master']}")
+
+
+def cmd_status(args):
+    data = read_keyring_file(args.keyring)
+    print(f"master fingerprint: {data['master']}")
+    if settings.MASTER_KEY or settings.MASTER_KEY_FILE:
+        matches = fingerprint(_master_key()) == data["master"]
+        print(f"configured master key matches: {matches}")
+    for key in data["keys"]:
+        active = " (active)" if key["id"] == data["active"] else ""
+        print(f"  key {key['id']}: created {key['created_at']}{active}")
+
+
+def cmd_generate_master(args):
+    print(AESGCM.generate_key(bit_length=256).hex())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keyring", default=settings.KEYRING_PATH, help="keyring file (default: KEYRING_PATH)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init").set_defaults(func=cmd_init)
+    commands.add_parser("add-key").set_defaults(func=cmd_add_key)
+    rewrap_parser = commands.add_parser("rewrap")
+    rewrap_parser.add_argument("--new-master-file", required=True, help="file with the new hex master key")
+    rewrap_parser.set_defaults(func=cmd_rewrap)
+    commands.add_parser("status").set_defaults(func=cmd_status)
+    commands.add_parser("generate-master").set_defaults(func=cmd_generate_master)
+
+    args = parser.parse_args()
+    if args.command != "generate-master" and not args.keyring:
+        raise SystemExit("KEYRING_PATH is not set (or pass --keyring)")
+    try:
+        args.func(args)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
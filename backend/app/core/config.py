@@ -7,4 +7,155 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MIN: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30
 
+    # Пул соединений с БД
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE_SEC: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 100    # asyncpg prepared statements на соединение
+
+    # Кэш проверенных JWT в auth middleware
+    AUTH_CLAIMS_CACHE_SIZE: int = 10_000
+    AUTH_CLAIMS_CACHE_TTL_SEC: float = 60.0
+
+    # Отозванные токены: пусто = память процесса, redis://... = общий Redis
+    TOKEN_STORE_URL: str = ""
+    TOKEN_STORE_MAX_ENTRIES: int = 100_000  # только для памяти: ~250 байт на jti -> ~25 MB
+
+    # /auth/biometric: факторы (face, voice, pin, password) проверяются параллельно
+    MFA_REQUIRED_FACTORS: list[str] = ["face"]
+    MFA_MIN_FACTORS: int = 2
+
+    # Rate limiting (в памяти процесса, до Argon2/инференса/БД)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_MAX_KEYS: int = 100_000      # на каждый лимитер
+    RATE_LIMIT_AUTH_IP_ATTEMPTS: int = 30   # логин + PIN с одного IP
+    RATE_LIMIT_AUTH_IP_WINDOW_SEC: float = 60
+    RATE_LIMIT_LOGIN_FAILURES: int = 10     # неверных паролей на email
+    RATE_LIMIT_LOGIN_WINDOW_SEC: float = 900
+    RATE_LIMIT_PIN_FAILURES: int = 5        # неверных PIN на пользователя
+    RATE_LIMIT_PIN_WINDOW_SEC: float = 900  # = блокировка на 15 минут
+    RATE_LIMIT_FACE_ATTEMPTS: int = 10      # face verify на пользователя
+    RATE_LIMIT_FACE_IP_ATTEMPTS: int = 30   # face verify с одного IP
+    RATE_LIMIT_FACE_WINDOW_SEC: float = 60
+
+    # Метрики: /metrics (Prometheus), тайминги этапов
+    METRICS_ENABLED: bool = True
+    METRICS_PUBLIC: bool = False          # /metrics без токена (только за закрытой сетью)
+    SERVER_TIMING: bool = False           # заголовок Server-Timing с этапами запроса
+    SLOW_REQUEST_MS: int = 0              # 0 = не логировать медленные запросы
+    SLOW_REQUEST_SAMPLE_RATE: float = 0.1
+
+    # Пул хэширования Argon2 (отдельные процессы + бюджет памяти)
+    HASHING_WORKERS: int = 2
+    HASHING_MEMORY_BUDGET_MB: int = 192   # пароль = 64 MB, PIN = 32 MB
+    HASHING_QUEUE_SIZE: int = 64
+    HASHING_TIMEOUT_SEC: float = 10.0     # сколько ждать бюджета в очереди
+    HASHING_RETRY_AFTER_SEC: int = 1
+
+    # Audit log: события пишутся в БД пачками в фоне
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_INTERVAL_SEC: float = 1.0
+    AUDIT_MAX_QUEUE: int = 10_000         # сверх лимита — в spill-файл или отбрасываем
+    AUDIT_SPILL_PATH: str = ""            # JSON lines; пусто = без spill-файла
+
+    # Пул инференса (InsightFace / ONNX)
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_ONNX_THREADS: int = 0       # 0 -> cpu_count // INFERENCE_WORKERS
+    INFERENCE_QUEUE_SIZE: int = 8         # сколько задач может ждать сверх workers
+    INFERENCE_TIMEOUT_SEC: float = 15.0
+    INFERENCE_RETRY_AFTER_SEC: int = 2
+
+    # Профиль моделей InsightFace: грузим только то, что реально читаем
+    # (bbox/kps -> detection, pose -> landmark_3d_68, embedding -> recognition)
+    FACE_MODEL_PACK: str = "buffalo_l"
+    FACE_ALLOWED_MODULES: list[str] = ["detection", "landmark_3d_68", "recognition"]
+    FACE_DET_SIZE: int = 640              # 320 хватает для селфи-кадров
+    # Лёгкий пакет (например buffalo_s) для кадров, нужных только для liveness;
+    # пусто -> все кадры идут через FACE_MODEL_PACK
+    LIVENESS_MODEL_PACK: str = ""
+    LIVENESS_DET_SIZE: int = 320
+
+    # Загрузка моделей: лениво при первом запросе или в фоне на старте
+    FACE_PRELOAD: bool = True             # грузить в lifespan (не блокируя старт)
+    FACE_WARMUP: bool = True              # прогнать пустой инференс после загрузки
+    # gunicorn --preload: грузим в master до fork, воркеры делят память (COW)
+    FACE_PRELOAD_BEFORE_FORK: bool = False
+
+    # Смена модели распознавания: старый пакет остаётся для пользователей,
+    # у которых ещё нет шаблонов FACE_MODEL_PACK; их шаблоны переснимаются
+    # в фоне с кадров успешной верификации
+    FACE_LEGACY_MODEL_PACK: str = ""
+    REEMBED_ENABLED: bool = True
+    REEMBED_QUEUE_SIZE: int = 256         # пользователей в очереди (кропы 112x112 ~37 KB)
+    REEMBED_INTERVAL_SEC: float = 1.0     # не чаще одного пользователя в секунду
+    REEMBED_IDLE_POLL_SEC: float = 0.2    # работаем только когда пул инференса пуст
+
+    # Несколько шаблонов лица на пользователя (фронт + ракурсы)
+    FACE_MAX_TEMPLATES: int = 5
+    FACE_SCORE_FUSION: str = "max"        # max | centroid
+
+    # Загрузка и декодирование изображений
+    IMAGE_MAX_UPLOAD_MB: int = 15
+    IMAGE_MAX_PIXELS: int = 16_000_000    # после уменьшенного декодирования JPEG
+    UPLOAD_BUFFER_POOL_SIZE: int = 32
+    UPLOAD_BUFFER_KEEP_MB: int = 4        # буферы больше этого не переиспользуем
+
+    # Дешёвый фильтр кадров до полного анализа лица
+    FRAME_FILTER_ENABLED: bool = True
+    FRAME_MIN_SIDE: int = 112             # px, меньше — лицо не распознать
+    FRAME_MIN_BRIGHTNESS: float = 40.0    # средняя яркость 0..255
+    FRAME_MAX_BRIGHTNESS: float = 220.0
+    FRAME_MIN_SHARPNESS: float = 30.0     # дисперсия лапласиана на 320px копии
+    FRAME_DUP_MAX_DISTANCE: int = 4       # hamming по dHash -> почти дубликат
+
+    # WebSocket-сессия liveness: бюджет на кадры и время
+    FACE_STREAM_MAX_FRAMES: int = 30
+    FACE_STREAM_MAX_SECONDS: float = 20.0
+
+    # Формат хранения шаблонов (конверт с версией/моделью внутри шифротекста):
+    # float32 | float16 (x2 меньше) | int8 (x4 меньше, scale на вектор)
+    TEMPLATE_DTYPE: str = "float32"
+    TEMPLATE_MIGRATE_ON_READ: bool = True  # старые строки перезаписываются при чтении
+
+    # Шифрование шаблонов: data keys (эпохи) в KEYRING_PATH обёрнуты мастер-ключом
+    # (python -m app.cli.keys); без keyring приложение не стартует
+    KEYRING_PATH: str = ""
+    MASTER_KEY: str = ""                  # hex, 32 байта
+    MASTER_KEY_FILE: str = ""             # или файл с ним (docker/k8s secret)
+    # Ключ записей без заголовка (до keyring) — только для их расшифровки;
+    # пусто -> таких записей нет
+    LEGACY_ENCRYPTION_KEY: str = ""       # hex, 32 байта
+    LEGACY_ENCRYPTION_KEY_FILE: str = ""
+
+    # Кэш расшифрованных шаблонов лица (на процесс)
+    TEMPLATE_CACHE_MAX_MB: int = 64       # ~2 KB на пользователя -> ~32k записей
+    TEMPLATE_CACHE_TTL_SEC: float = 300.0
+
+    # 1:N идентификация (индекс всех шаблонов в памяти, ~2 KB на пользователя)
+    FACE_INDEX_ENABLED: bool = True
+    IDENTIFY_TOP_K: int = 5
+    FACE_INDEX_BACKEND: str = "flat"      # flat (точный) | ivf | hnsw (нужен hnswlib)
+    FACE_INDEX_PATH: str = ""             # каталог для mmap-снапшота; пусто -> без снапшота
+    FACE_INDEX_WATERMARK_MARGIN_SEC: int = 900  # > самой долгой транзакции записи biometrics
+    IVF_NLIST: int = 0                    # 0 -> sqrt(N)
+    IVF_NPROBE: int = 16
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64
+
+    # Голос: ONNX-модель speaker embedding (WeSpeaker/ECAPA экспорт:
+    # fbank (1, T, VOICE_N_MELS) -> embedding); пусто -> голосовые эндпоинты 503
+    VOICE_MODEL_PATH: str = ""
+    VOICE_PRELOAD: bool = True            # грузить в lifespan, если путь задан
+    VOICE_SAMPLE_RATE: int = 16_000
+    VOICE_N_MELS: int = 80
+    VOICE_THRESHOLD: float = 0.5          # cosine similarity
+    VOICE_MAX_UPLOAD_MB: int = 10
+    VOICE_MAX_AUDIO_SEC: float = 60.0     # дальше файл не читаем
+    VOICE_MIN_SPEECH_SEC: float = 1.0     # после отрезания тишины
+    VOICE_MAX_SPEECH_SEC: float = 20.0    # речи больше этого не эмбеддим
+    VOICE_SEGMENT_SEC: float = 2.0        # окно одного прогона модели
+    VOICE_VAD_DB: float = -45.0           # dBFS кадра 25 мс, ниже — тишина
+
 settings = Settings()
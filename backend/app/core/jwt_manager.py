@@ -1,14 +1,23 @@
 from datetime import datetime, timedelta
+import uuid
 import jwt
 from app.core.config import settings
 
+def _create_token(user_id: int, token_type: str, lifetime: timedelta):
+    expire = datetime.utcnow() + lifetime
+    payload = {
+        "sub": str(user_id),
+        "exp": expire,
+        "type": token_type,
+        "jti": uuid.uuid4().hex,  # id токена — для отзыва и ротации refresh
+    }
+    return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
+
 def create_access_token(user_id: int):
-    expire = datetime.utcnow() + timedelta(minutes= settings.ACCESS_TOKEN_EXPIRE_MIN)
-    return jwt.encode({"sub": str(user_id), "exp": expire}, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
+    return _create_token(user_id, "access", timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MIN))
 
 def create_refresh_token(user_id: int):
-    expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
-    return jwt.encode({"sub": str(user_id), "exp": expire}, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
+    return _create_token(user_id, "refresh", timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS))
 
 def decode_token(token: str):
-    return jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
\ No newline at end of file
+    return jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
@@ -0,0 +1,213 @@
+"""Envelope encryption: per-epoch data keys wrapped by a master key.
+
+Ciphertext written with a keyring:
+
+    magic "DK" | version u8 | key_id u32 | nonce (12) | AES-GCM ciphertext + tag
+
+The 7-byte header is authenticated as associated data. Data keys are
+stored wrapped (AES-GCM under the master key) in a JSON keyring file::
+
+    {"version": 1, "active": 2, "master": "<fingerprint>",
+     "keys": [{"id": 1, "wrapped": "<base64>", "created_at": "..."}, ...]}
+
+Rotating the master key re-wraps the few data keys, and a new data key
+(epoch) only changes what new ciphertexts are written with. Stored
+templates are never re-encrypted. Ciphertexts without the header
+(``nonce | ciphertext`` under the legacy key) stay readable while the
+legacy key is configured; nothing new is written with it.
+"""
+import base64
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime, timezone
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+MAGIC = b"DK"
+VERSION = 1
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+_HEADER = struct.Struct("<2sBI")
+_PREFIX = MAGIC + bytes([VERSION])
+_KEYRING_VERSION = 1
+
+
+def fingerprint(master_key: bytes) -> str:
+    """Short, non-secret id of a master key (detects a wrong MASTER_KEY early)."""
+    return hashlib.sha256(b"keyring-master:" + master_key).hexdigest()[:16]
+
+
+def parse_key(value: str, name: str = "key") -> bytes:
+    key = bytes.fromhex(value.strip())
+    if len(key) != 32:
+        raise ValueError(f"{name} must be 32 bytes (64 hex chars)")
+    return key
+
+
+def read_key(value: str = "", path: str = "", name: str = "key") -> bytes | None:
+    """Key from a hex string or from a file holding it (a mounted secret); None if neither is set."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            value = f.read()
+    if not value.strip():
+        return None
+    return parse_key(value, name)
+
+
+def load_master_key(value: str = "", path: str = "") -> bytes:
+    key = read_key(value, path, "master key")
+    if key is None:
+        raise ValueError("Master key is not configured (MASTER_KEY / MASTER_KEY_FILE)")
+    return key
+
+
+# -----------------------------
+# Обёртка data keys
+# -----------------------------
+
+def _wrap(master_key: bytes, key_id: int, data_key: bytes) -> str:
+    nonce = os.urandom(NONCE_SIZE)
+    wrapped = AESGCM(master_key).encrypt(nonce, data_key, b"data-key:%d" % key_id)
+    return base64.b64encode(nonce + wrapped).decode("ascii")
+
+
+def _unwrap(master_key: bytes, key_id: int, wrapped: str) -> bytes:
+    raw = base64.b64decode(wrapped)
+    return AESGCM(master_key).decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], b"data-key:%d" % key_id)
+
+
+def new_keyring(master_key: bytes) -> dict:
+    """Keyring file contents with one fresh, active data key."""
+    data = {"version": _KEYRING_VERSION, "active": 0, "master": fingerprint(master_key), "keys": []}
+    return add_data_key(data, master_key)
+
+
+def add_data_key(data: dict, master_key: bytes) -> dict:
+    """Append a new data key (next epoch) and make it active."""
+    _check_master(data, master_key)
+    key_id = max((k["id"] for k in data["keys"]), default=0) + 1
+    data["keys"].append({
+        "id": key_id,
+        "wrapped": _wrap(master_key, key_id, AESGCM.generate_key(bit_length=256)),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    })
+    data["active"] = key_id
+    return data
+
+
+def rewrap(data: dict, old_master: bytes, new_master: bytes) -> dict:
+    """Re-wrap every data key under ``new_master``; ciphertexts stay valid as they are."""
+    _check_master(data, old_master)
+    for key in data["keys"]:
+        key["wrapped"] = _wrap(new_master, key["id"], _unwrap(old_master, key["id"], key["wrapped"]))
+    data["master"] = fingerprint(new_master)
+    return data
+
+
+def _check_master(data: dict, master_key: bytes):
+    if data["master"] != fingerprint(master_key):
+        raise ValueError("Master key does not match the keyring")
+
+
+def read_keyring_file(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != _KEYRING_VERSION:
+        raise ValueError(f"Unsupported keyring version: {data.get('version')!r}")
+    return data
+
+
+def write_keyring_file(path: str, data: dict):
+    """Atomic replace, readable by the owner only."""
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# -----------------------------
+# Шифрование
+# -----------------------------
+
+class Keyring:
+    """Unwrapped data keys with one cached ``AESGCM`` object per key.
+
+    New ciphertexts are always written with the ``active`` data key.
+    ``legacy_key`` only decrypts headerless ciphertexts from before
+    envelope encryption; without it they fail like any foreign blob.
+    """
+
+    def __init__(self, data_keys: dict[int, bytes], active: int, legacy_key: bytes | None = None):
+        self._ciphers = {key_id: AESGCM(key) for key_id, key in data_keys.items()}
+        self._legacy = AESGCM(legacy_key) if legacy_key else None
+        self.active = active
+        self._active_cipher = self._ciphers[active]
+        self._active_header = _HEADER.pack(MAGIC, VERSION, active)
+
+    @classmethod
+    def from_file(cls, path: str, master_key: bytes, legacy_key: bytes | None = None) -> "Keyring":
+        data = read_keyring_file(path)
+        _check_master(data, master_key)
+        keys = {key["id"]: _unwrap(master_key, key["id"], key["wrapped"]) for key in data["keys"]}
+        return cls(keys, data["active"], legacy_key)
+
+    @property
+    def key_ids(self) -> list[int]:
+        return sorted(self._ciphers)
+
+    def encrypt(self, data: bytes) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        header = self._active_header
+        return header + nonce + self._active_cipher.encrypt(nonce, data, header)
+
+    def key_id(self, blob: bytes) -> int | None:
+        """Data key id from the header, None for a legacy (headerless) ciphertext."""
+        if len(blob) >= _HEADER.size + NONCE_SIZE + TAG_SIZE and blob[:2] == MAGIC:
+            _, version, key_id = _HEADER.unpack_from(blob)
+            if version == VERSION:
+                return key_id
+        return None
+
+    def decrypt(self, blob: bytes) -> bytes:
+        """Plaintext of a header or legacy ciphertext; KeyError for an unknown data key."""
+        key_id = self.key_id(blob)
+        if key_id is not None:
+            cipher = self._ciphers.get(key_id)
+            if cipher is not None:
+                try:
+                    return cipher.decrypt(blob[7:19], blob[19:], blob[:7])
+                except InvalidTag:
+                    pass  # legacy nonce, случайно начавшийся с "DK"
+        if self._legacy is not None:
+            try:
+                return self._legacy.decrypt(blob[:NONCE_SIZE], blob[NONCE_SIZE:], None)
+            except InvalidTag:
+                pass
+        if key_id is not None and key_id not in self._ciphers:
+            raise KeyError(key_id)
+        raise InvalidTag()
+
+    def decrypt_many(self, blobs) -> list[bytes]:
+        """``decrypt`` for a batch (index build, bulk loads): no per-call lookups."""
+        ciphers, min_size = self._ciphers, _HEADER.size + NONCE_SIZE + TAG_SIZE
+        out = []
+        for blob in blobs:
+            cipher = None
+            if blob[:3] == _PREFIX and len(blob) >= min_size:
+                cipher = ciphers.get(int.from_bytes(blob[3:7], "little"))
+            if cipher is not None:
+                try:
+                    out.append(cipher.decrypt(blob[7:19], blob[19:], blob[:7]))
+                    continue
+                except InvalidTag:
+                    pass
+            out.append(self.decrypt(blob))
+        return out
+
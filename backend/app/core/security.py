@@ -1,13 +1,20 @@
 from argon2 import PasswordHasher
 from argon2.low_level import Type
 from argon2.exceptions import VerifyMismatchError
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
+import threading
+
+from app.core.config import settings
+from app.core.keyring import Keyring, load_master_key, read_key
+
+# Память одного хэширования (KiB) — по ним считается бюджет пула хэширования
+PASSWORD_MEMORY_KB = 64 * 1024
+PIN_MEMORY_KB = 32 * 1024
 
 # Настройки Argon2 для паролей (более медленно и безопасно)
 password_hasher = PasswordHasher(
     time_cost=3,       # Кол-во итераций
-    memory_cost=64 * 1024,  # 64 MB
+    memory_cost=PASSWORD_MEMORY_KB,  # 64 MB
     parallelism=2,
     hash_len=32,
     type=Type.ID       # Argon2id — самая безопасная комбинация
@@ -16,7 +23,7 @@ password_hasher = PasswordHasher(
 # Настройки Argon2 для PIN (немного быстрее)
 pin_hasher = PasswordHasher(
     time_cost=2,
-    memory_cost=32 * 1024,  # 32 MB
+    memory_cost=PIN_MEMORY_KB,  # 32 MB
     parallelism=1,
     hash_len=16,
     type=Type.ID
@@ -53,19 +60,67 @@ def verify_pin(plain: str, hashed: str) -> bool:
     except VerifyMismatchError:
         return False
 
-hex_key = "9b0fae9a72c19589f4cb5ec9258e3bb37205c1635c8de7d05a4d398c4c8ef434"
-AES_KEY = bytes.fromhex(hex_key)
+# === Шифрование (envelope) ===
+_keyring: Keyring | None = None
+_keyring_mtime: float | None = None
+_keyring_lock = threading.Lock()
+
+
+def _load_keyring():
+    global _keyring, _keyring_mtime
+    path = settings.KEYRING_PATH
+    if not path:
+        raise ValueError("KEYRING_PATH is not set (create a keyring: python -m app.cli.keys init)")
+    master_key = load_master_key(settings.MASTER_KEY, settings.MASTER_KEY_FILE)
+    # ключ записей до keyring (без заголовка) — только для расшифровки
+    legacy_key = read_key(settings.LEGACY_ENCRYPTION_KEY, settings.LEGACY_ENCRYPTION_KEY_FILE, "legacy key")
+    mtime = os.path.getmtime(path)
+    _keyring, _keyring_mtime = Keyring.from_file(path, master_key, legacy_key), mtime
+
+
+def get_keyring() -> Keyring:
+    """Process-wide keyring, unwrapped on first use.
+
+    Lazy: spawn workers of the hashing pool import this module but never
+    encrypt anything.
+    """
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _load_keyring()
+    return _keyring
+
+
+def reload_keyring() -> bool:
+    """Re-read KEYRING_PATH if it changed (another process added a data key)."""
+    with _keyring_lock:
+        if _keyring is not None and os.path.getmtime(settings.KEYRING_PATH) == _keyring_mtime:
+            return False
+        _load_keyring()
+    return True
+
 
 def encrypt_data(data: str | bytes) -> bytes:
     if isinstance(data, str):
         data = data.encode('utf-8')
-    aesgcm = AESGCM(AES_KEY)
-    nonce = os.urandom(12)
-    encrypted = aesgcm.encrypt(nonce, data, None)
-    return nonce + encrypted
+    return get_keyring().encrypt(data)
+
 
 def decrypt_data(encrypted: bytes) -> bytes:
-    aesgcm = AESGCM(AES_KEY)
-    nonce = encrypted[:12]
-    ct = encrypted[12:]
-    return aesgcm.decrypt(nonce, ct, None)
\ No newline at end of file
+    try:
+        return get_keyring().decrypt(encrypted)
+    except KeyError:
+        # data key новее, чем наш keyring — перечитываем файл один раз
+        if not reload_keyring():
+            raise
+        return get_keyring().decrypt(encrypted)
+
+
+def decrypt_many(blobs) -> list[bytes]:
+    """``decrypt_data`` for a batch: index build, cache fill, bulk tools."""
+    try:
+        return get_keyring().decrypt_many(blobs)
+    except KeyError:
+        if not reload_keyring():
+            raise
+        return get_keyring().decrypt_many(blobs)
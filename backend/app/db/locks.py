@@ -0,0 +1,17 @@
+from sqlalchemy import Select, select
+
+from app.models.user import User
+
+
+def lock_users(user_ids) -> Select:
+    """``SELECT users.id ... FOR UPDATE`` for the given ids (existing ones come back).
+
+    Serializes writers of the same users' templates until commit:
+    enroll, re-embedding and bulk import read the current templates and
+    decide what to replace, so two of them must not interleave. The row in
+    ``users`` is locked because ``biometrics`` may not exist yet. Rows are
+    locked in id order, so batches can't deadlock each other. Works with
+    both ``Session`` and ``AsyncSession``; SQLite ignores FOR UPDATE (its
+    writers are serialized anyway).
+    """
+    return select(User.id).where(User.id.in_(user_ids)).order_by(User.id).with_for_update()
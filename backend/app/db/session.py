@@ -1,13 +1,43 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
-engine = create_engine(settings.DATABASE_URL, future=True)
+
+def _pool_kwargs(url) -> dict:
+    if url.get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SEC,
+    }
+
+
+def _async_url(url):
+    """postgresql(+psycopg2):// -> postgresql+asyncpg://, sqlite:// -> sqlite+aiosqlite://"""
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        # кэш prepared statements на соединение (0 — для pgbouncer в transaction mode)
+        return url.update_query_dict({"prepared_statement_cache_size": str(settings.DB_STATEMENT_CACHE_SIZE)})
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+_url = make_url(settings.DATABASE_URL)
+
+# ✅ синхронный движок — для фоновых задач и утилит (индекс лиц, alembic-скрипты)
+engine = create_engine(_url, future=True, **_pool_kwargs(_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+# ✅ асинхронный движок (asyncpg) — для всех запросов API
+async_engine = create_async_engine(_async_url(_url), **_pool_kwargs(_url))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
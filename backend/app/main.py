@@ -1,12 +1,119 @@
-from fastapi import FastAPI, Request
+import asyncio
+import gc
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.v1.auth import router as auth_router
 from app.api.v1.biometrics import router as biometrics_router
-from app.middlewares.auth_middleware import auth_middleware
+from app.api.v1.voice import router as voice_router
+from app.core.config import settings
+from app.core.security import get_keyring
+from app.db.session import async_engine
+from app.middlewares.auth_middleware import AuthMiddleware
+from app.services.audit_writer import audit_writer
+from app.services.face_index import face_index, load_face_index, save_snapshot
+from app.services.face_models import face_models
+from app.services.hashing_pool import hashing_pool
+from app.services.inference_pool import inference_pool
+from app.services.metrics import MetricsMiddleware, registry
+from app.services.rate_limiter import rate_limiter_stats
+from app.services.reembed import reembedder
+from app.services.template_cache import template_cache
+from app.services.token_store import token_store
+from app.services.voice_models import voice_models
+
+logger = logging.getLogger(__name__)
+
+# ✅ gunicorn -k uvicorn.workers.UvicornWorker --preload app.main:app
+# Модели грузятся один раз в master, воркеры получают их через fork (COW).
+# ONNX сессии с 1 intra-op потоком: пулы потоков ORT не переживают fork.
+# (uvicorn --workers использует spawn, там это ничего не даёт)
+if settings.FACE_PRELOAD_BEFORE_FORK:
+    face_models.load(onnx_threads=1)
+    gc.freeze()  # чтобы GC не трогал страницы с моделями и не ломал COW
+
+
+def _load_face_models():
+    try:
+        face_models.load()
+        if settings.FACE_WARMUP:
+            face_models.warmup()
+    except Exception:
+        # /health/ready останется 503, первый face-запрос попробует ещё раз
+        logger.exception("Failed to load face models")
+        return
+    logger.info("Face models ready: %s", face_models.loaded_models())
+
+
+def _load_voice_model():
+    try:
+        voice_models.load()
+        voice_models.warmup()
+    except Exception:
+        # голосовые запросы попробуют загрузить модель ещё раз
+        logger.exception("Failed to load voice model")
+        return
+    logger.info("Voice model ready: %s", settings.VOICE_MODEL_PATH)
+
+
+def _build_face_index():
+    try:
+        load_face_index(face_index, settings.FACE_INDEX_PATH)
+    except Exception:
+        logger.exception("Failed to build face index")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # keyring разворачиваем сразу: отсутствующий keyring или неверный MASTER_KEY
+    # должны ронять старт, а не логин
+    get_keyring()
+    await audit_writer.start()
+    # переснятие шаблонов старой модели (только при FACE_LEGACY_MODEL_PACK)
+    await reembedder.start()
+
+    # модели грузятся в фоне: auth-эндпоинты работают сразу,
+    # /health/ready станет 200 когда всё загружено
+    loading = None
+    if settings.FACE_PRELOAD:
+        loading = asyncio.create_task(asyncio.to_thread(_load_face_models))
+
+    voice_loading = None
+    if settings.VOICE_PRELOAD and voice_models.configured:
+        voice_loading = asyncio.create_task(asyncio.to_thread(_load_voice_model))
+
+    # индекс для 1:N строится один раз целиком, дальше обновляется на enroll
+    indexing = None
+    if settings.FACE_INDEX_ENABLED:
+        indexing = asyncio.create_task(asyncio.to_thread(_build_face_index))
+
+    yield
 
+    for task in (loading, voice_loading, indexing):
+        if task is not None and not task.done():
+            task.cancel()
+    await reembedder.stop()
 
-app = FastAPI(title="Biometric Auth System")
+    # сохраняем изменения индекса, чтобы следующий старт не расшифровывал их заново
+    if settings.FACE_INDEX_PATH and face_index.ready and face_index.dirty:
+        await asyncio.to_thread(save_snapshot, face_index, settings.FACE_INDEX_PATH)
+    inference_pool.shutdown()
+    hashing_pool.shutdown()
+    # дописываем накопленные события audit log до закрытия пула соединений
+    await audit_writer.stop()
+    await token_store.close()
+    await async_engine.dispose()
+
+
+app = FastAPI(title="Biometric Auth System", lifespan=lifespan)
+
+# ✅ Auth middleware (pure ASGI) добавляется первым: последний добавленный
+# middleware — внешний, так CORS оборачивает и ответы 401 от auth
+app.add_middleware(AuthMiddleware)
 
 # ✅ CORS конфигурация
 # Важно: docker IP (172.x) НЕ стабилен, лучше использовать regex для dev
@@ -26,12 +133,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ✅ Auth middleware после CORS
-app.middleware("http")(auth_middleware)
+# ✅ Метрики — самый внешний middleware (считает и auth, и CORS)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 # ✅ Routers
 app.include_router(auth_router, prefix="/api/v1", tags=["Auth"])
 app.include_router(biometrics_router, prefix="/api/v1", tags=["Biometrics"])
+app.include_router(voice_router, prefix="/api/v1", tags=["Biometrics"])
 
 # ✅ Проверка токена: /secure (должен возвращать user_id из middleware)
 @app.get("/secure")
@@ -40,3 +149,62 @@ def secure(request: Request):
         "message": "OK",
         "user_id": getattr(request.state, "user_id", None),
     }
+
+
+# ✅ Health probes
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def health_ready(response: Response):
+    if not face_models.ready:
+        response.status_code = 503
+        return {"status": "loading"}
+    return {"status": "ready", "models": {**face_models.loaded_models(), **voice_models.loaded_models()}}
+
+
+@app.get("/health/stats")
+def health_stats():
+    return {
+        "inference_pool": {"pending": inference_pool.pending},
+        "hashing_pool": hashing_pool.stats(),
+        "audit_log": audit_writer.stats(),
+        "rate_limiter_keys": rate_limiter_stats(),
+        "template_cache": template_cache.stats(),
+        "face_index": face_index.stats(),
+        "reembed": reembedder.stats(),
+        "token_store": token_store.stats(),
+    }
+
+
+# ✅ Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(404, "Metrics are disabled")
+    hashing = hashing_pool.stats()
+    audit = audit_writer.stats()
+    reembed = reembedder.stats()
+    gauges = {
+        "inference_pool_pending": inference_pool.pending,
+        "hashing_pool_queue_depth": hashing["queue_depth"],
+        "hashing_pool_memory_in_use_mb": hashing["memory_in_use_mb"],
+        "audit_queue_size": audit["queued"],
+        "template_cache_entries": template_cache.stats()["entries"],
+        "face_index_size": face_index.stats()["size"],
+        "reembed_queue_size": reembed["queued"],
+        "face_models_ready": int(face_models.ready),
+        "voice_model_ready": int(voice_models.ready),
+    }
+    # монотонные значения — counter, иначе rate() и promtool их не примут
+    counters = {
+        "hashing_pool_rejected_total": hashing["rejected"],
+        "hashing_pool_failed_total": hashing["failed"],
+        "hashing_pool_cancelled_total": hashing["cancelled"],
+        "audit_dropped_total": audit["dropped"],
+        "reembed_done_total": reembed["reembedded"],
+        "reembed_failed_total": reembed["failed"],
+    }
+    return PlainTextResponse(registry.render(gauges, counters), media_type="text/plain; version=0.0.4")
@@ -1,34 +1,170 @@
-from fastapi import Request, HTTPException
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
 import jwt
 from app.core.config import settings
+from app.core.jwt_manager import decode_token
+from app.services.metrics import stage
+from app.services.token_store import token_store
 
 PUBLIC_PATHS = [
     "/api/v1/auth",
     "/docs",
-    "/openapi.json"
+    "/openapi.json",
+    "/health",
 ]
+# метрики (трафик по маршрутам, очереди, размер индекса) — только с токеном,
+# если скрейпер не ходит через отдельную сеть/прокси
+if settings.METRICS_PUBLIC:
+    PUBLIC_PATHS.append("/metrics")
+
+# один regex вместо цикла startswith по списку
+_PUBLIC_RE = re.compile("|".join(re.escape(path) for path in PUBLIC_PATHS))
+
+
+def is_public_path(path: str) -> bool:
+    return _PUBLIC_RE.match(path) is not None
+
+
+class ClaimsCache:
+    """LRU of verified JWT claims keyed by sha256 of the token.
+
+    An entry lives ``ttl`` seconds but never past the token's own ``exp``,
+    so a cached token stops working exactly when ``jwt.decode`` would
+    start rejecting it.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def put(self, key: bytes, claims: dict):
+        expires_at = time.time() + self.ttl
+        if "exp" in claims:
+            expires_at = min(expires_at, float(claims["exp"]))
+        self._entries[key] = (claims, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+claims_cache = ClaimsCache(
+    max_entries=settings.AUTH_CLAIMS_CACHE_SIZE,
+    ttl=settings.AUTH_CLAIMS_CACHE_TTL_SEC,
+)
+
+
+def verify_token(token: str) -> dict | None:
+    """Claims of a valid token (cached), or None."""
+    key = claims_cache.key(token)
+    claims = claims_cache.get(key)
+    if claims is None:
+        try:
+            with stage("jwt_decode"):
+                claims = decode_token(token)
+            int(claims["sub"])
+        except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+            return None
+        claims_cache.put(key, claims)
+    return claims
+
+
+def _get_token(scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            token = value.decode("latin-1")
+            return token[7:] if token.startswith("Bearer ") else token
+
+    # браузерный WebSocket не умеет ставить заголовки — токен в ?token=
+    if scope["type"] == "websocket":
+        tokens = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+        if tokens:
+            return tokens[0]
+    return None
+
+
+class AuthMiddleware:
+    """Pure ASGI JWT check: puts ``user_id`` into ``request.state``.
+
+    Unauthenticated HTTP requests get a JSON 401, WebSocket handshakes are
+    closed with 1008 before ``accept``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        # ✅ 1) Пропускаем CORS preflight и публичные пути
+        if scope.get("method") == "OPTIONS" or is_public_path(scope["path"]):
+            await self.app(scope, receive, send)
+            return
 
-async def auth_middleware(request: Request, call_next):
+        # ✅ 2) Проверяем токен
+        token = _get_token(scope)
+        if not token:
+            await self._reject(scope, send, "Missing access token")
+            return
 
-    # ✅ 1) Пропускаем CORS preflight
-    if request.method == "OPTIONS":
-        return await call_next(request)
+        claims = verify_token(token)
+        if claims is None:
+            await self._reject(scope, send, "Invalid token")
+            return
 
-    # ✅ 2) Разрешаем публичные пути
-    for path in PUBLIC_PATHS:
-        if request.url.path.startswith(path):
-            return await call_next(request)
+        # refresh токен не годится как access; отозванные (logout) — отклоняем
+        if claims.get("type") == "refresh":
+            await self._reject(scope, send, "Invalid token type")
+            return
+        if "jti" in claims and await token_store.is_revoked(claims["jti"]):
+            await self._reject(scope, send, "Token revoked")
+            return
 
-    # ✅ 3) Проверяем токен
-    token = request.headers.get("Authorization")
-    if not token:
-        raise HTTPException(401, "Missing access token")
+        scope.setdefault("state", {})["user_id"] = int(claims["sub"])
+        await self.app(scope, receive, send)
 
-    token = token.replace("Bearer ", "")
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        request.state.user_id = int(payload["sub"])
-    except Exception:
-        raise HTTPException(401, "Invalid token")
+    @staticmethod
+    async def _reject(scope, send, detail: str):
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008, "reason": detail})
+            return
 
-    return await call_next(request)
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"www-authenticate", b"Bearer"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
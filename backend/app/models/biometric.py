@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, LargeBinary
+from sqlalchemy import Column, Integer, LargeBinary, DateTime, func
 from app.db.base import Base
 
 class Biometric(Base):
@@ -8,3 +8,5 @@ class Biometric(Base):
     user_id = Column(Integer, unique=True, nullable=False)
     face_template = Column(LargeBinary, nullable=False)
     voice_template = Column(LargeBinary, nullable=True)
+    # водяной знак для догрузки снапшота индекса лиц
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False, index=True)
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, LargeBinary, Float, DateTime, String, func
+from app.db.base import Base
+
+class FaceTemplate(Base):
+    """One enrolled face embedding; a user has up to FACE_MAX_TEMPLATES of them."""
+    __tablename__ = "face_templates"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    template = Column(LargeBinary, nullable=False)
+    # модель распознавания, которой снят шаблон (FACE_MODEL_PACK на момент записи)
+    model_id = Column(String(64), nullable=False, index=True)
+    yaw = Column(Float, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
@@ -0,0 +1,144 @@
+import math
+import wave
+
+import numpy as np
+
+
+class AudioError(ValueError):
+    """Upload is not usable audio (unsupported format, no speech, ...)."""
+
+
+# -----------------------------
+# Потоковое декодирование
+# -----------------------------
+
+# сколько секунд исходного аудио декодируется за раз
+CHUNK_SEC = 0.5
+
+
+def _pcm_to_float(raw: bytes, width: int, channels: int) -> np.ndarray:
+    """Interleaved PCM frames -> mono float32 in [-1, 1]."""
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        # 24 бит: три байта little-endian -> старшие байты int32
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)).astype(np.float32) / 2147483648.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise AudioError(f"Unsupported PCM sample width: {width}")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def _wav_chunks(reader: wave.Wave_read, frames: int):
+    width, channels = reader.getsampwidth(), reader.getnchannels()
+    with reader:
+        while True:
+            raw = reader.readframes(frames)
+            if not raw:
+                return
+            yield _pcm_to_float(raw, width, channels)
+
+
+def _soundfile_chunks(f, frames: int):
+    with f:
+        for block in f.blocks(blocksize=frames, dtype="float32", always_2d=True):
+            yield block.mean(axis=1)
+
+
+def open_audio(fileobj) -> tuple[int, object]:
+    """(sample rate, iterator of mono float32 chunks of ~CHUNK_SEC) for an audio file.
+
+    PCM WAV is read with the stdlib ``wave`` module; other containers
+    (FLAC, OGG, float WAV) go through ``soundfile`` when it is installed.
+    Only one chunk is decoded at a time, the file itself is never loaded
+    whole.
+    """
+    fileobj.seek(0)
+    try:
+        reader = wave.open(fileobj, "rb")
+    except (wave.Error, EOFError):
+        reader = None
+    if reader is not None:
+        rate = reader.getframerate()
+        return rate, _wav_chunks(reader, max(1, int(rate * CHUNK_SEC)))
+
+    try:
+        import soundfile
+    except ImportError:
+        raise AudioError("Unsupported audio format, send 16-bit PCM WAV")
+
+    fileobj.seek(0)
+    try:
+        f = soundfile.SoundFile(fileobj)
+    except RuntimeError:
+        raise AudioError("Invalid audio file")
+    return f.samplerate, _soundfile_chunks(f, max(1, int(f.samplerate * CHUNK_SEC)))
+
+
+# -----------------------------
+# Потоковый ресемплинг
+# -----------------------------
+
+def _lowpass(cutoff: float, taps: int) -> np.ndarray:
+    """Hamming-windowed sinc, ``cutoff`` in cycles per sample."""
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class StreamingResampler:
+    """Resample chunk by chunk with state carried across chunk boundaries.
+
+    Downsampling runs an anti-alias FIR first (its history is kept between
+    chunks), then linear interpolation at fractional positions; the phase
+    of the next output sample is carried over, so chunked output is the
+    same as resampling the whole signal at once. Memory is O(taps + chunk).
+    """
+
+    def __init__(self, src_rate: int, dst_rate: int):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.step = src_rate / dst_rate
+        self._filter = None
+        if src_rate > dst_rate:
+            taps = 32 * math.ceil(self.step) + 1
+            # срез чуть ниже новой частоты Найквиста
+            self._filter = _lowpass(0.45 / self.step, taps)
+            self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._pos = 0.0  # позиция следующего выходного сэмпла относительно _tail
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if self.src_rate == self.dst_rate:
+            return chunk
+
+        if self._filter is not None:
+            padded = np.concatenate([self._history, chunk])
+            self._history = padded[len(padded) - len(self._history):]
+            chunk = np.convolve(padded, self._filter, mode="valid").astype(np.float32)
+
+        buf = np.concatenate([self._tail, chunk])
+        # нужен и сэмпл i, и i + 1
+        if len(buf) < 2 or self._pos > len(buf) - 2:
+            self._tail = buf
+            return np.zeros(0, dtype=np.float32)
+
+        count = int((len(buf) - 2 - self._pos) // self.step) + 1
+        positions = self._pos + self.step * np.arange(count)
+        left = positions.astype(np.int64)
+        frac = (positions - left).astype(np.float32)
+        out = buf[left] * (1.0 - frac) + buf[left + 1] * frac
+
+        next_pos = self._pos + self.step * count
+        # позиция может уйти за конец буфера (шаг > 1) — остаток переносим в фазу
+        drop = min(int(next_pos), len(buf))
+        self._tail = buf[drop:]
+        self._pos = next_pos - drop
+        return out
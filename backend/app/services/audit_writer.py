@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+from starlette.requests import HTTPConnection
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.audit import AuditLog
+from app.services.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+def client_ip(conn: HTTPConnection | None) -> str | None:
+    """Peer address of a Request/WebSocket (X-Forwarded-For is not trusted)."""
+    if conn is None or conn.client is None:
+        return None
+    return conn.client.host
+
+
+class AuditWriter:
+    """In-process queue of audit events, written to the DB in batches.
+
+    ``log`` only appends to a bounded deque; a background task inserts the
+    events with one multi-row INSERT when ``batch_size`` events have piled up
+    or every ``flush_interval`` seconds. When the queue is full or the DB
+    is unavailable, events go to the spill file (JSON lines) if one is
+    configured and are replayed on the next start, or once a flush succeeds
+    again and the queue is empty; otherwise the oldest events are dropped
+    and counted. Spill file IO of the background task runs in a thread.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int, spill_path: str = ""):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spill_path = spill_path
+
+        self._queue: deque[dict] = deque()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        # spill-файл пишется и из потока (to_thread), и из log() на event loop
+        self._spill_lock = threading.Lock()
+        self._spill_pending = False   # в файле есть события, которые ещё не подобраны
+        self._last_flush_ok = True
+
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    # --- запись событий (горячий путь) ---
+
+    def log(self, user_id, action: str, success: bool = True, ip: str | None = None):
+        event = {
+            "user_id": user_id,
+            "action": action,
+            "success": success,
+            "ip": ip,
+            "timestamp": datetime.utcnow(),
+        }
+        if len(self._queue) >= self.max_queue:
+            if self.spill_path:
+                self._spill([event])
+                return
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(event)
+
+        if self._wakeup is not None and len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    # --- фоновая запись ---
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self._replay_spill()
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush everything that is left."""
+        if self._task is not None:
+            # не cancel: текущая пачка должна дописаться
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        while self._queue:
+            if not await self.flush():
+                break
+        if self._queue and self.spill_path:
+            events = list(self._queue)
+            self._queue.clear()
+            await asyncio.to_thread(self._spill, events)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._queue:
+                if not await self.flush() or len(self._queue) < self.batch_size:
+                    break
+            # БД снова доступна и очередь пуста — подбираем то, что ушло в spill-файл.
+            # Пока flush падает, файл не перечитываем (иначе читали бы его каждый интервал)
+            if not self._queue and self._spill_pending and self._last_flush_ok:
+                await self._replay_spill()
+
+    async def flush(self) -> bool:
+        """Insert one batch; on failure the batch goes back (or to the spill file)."""
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        if not batch:
+            return True
+        try:
+            with stage("audit_write"):
+                async with AsyncSessionLocal() as db:
+                    # executemany -> один INSERT ... VALUES (...), (...) на пачку
+                    await db.execute(insert(AuditLog), batch)
+                    await db.commit()
+        except Exception:
+            self.failed_flushes += 1
+            self._last_flush_ok = False
+            logger.exception("Audit flush failed (%d events)", len(batch))
+            if self.spill_path:
+                await asyncio.to_thread(self._spill, batch)
+            else:
+                # возвращаем в начало очереди, лишнее сверх лимита отбрасываем
+                self._queue.extendleft(reversed(batch))
+                while len(self._queue) > self.max_queue:
+                    self._queue.pop()
+                    self.dropped += 1
+            return False
+        self._last_flush_ok = True
+        self.written += len(batch)
+        return True
+
+    # --- spill-файл ---
+
+    def _spill(self, events: list[dict]):
+        """Append events to the spill file (blocking: background task calls it via to_thread)."""
+        lines = "".join(json.dumps({**event, "timestamp": event["timestamp"].isoformat()}) + "\n" for event in events)
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                self.spilled += len(events)
+                self._spill_pending = True
+            except OSError:
+                logger.exception("Audit spill failed, dropping %d events", len(events))
+                self.dropped += len(events)
+
+    def _take_spill(self) -> list[str]:
+        """Read and remove the spill file (blocking)."""
+        with self._spill_lock:
+            self._spill_pending = False
+            try:
+                with open(self.spill_path, encoding="utf-8") as f:
+                    lines = f.readlines()
+                os.remove(self.spill_path)
+            except FileNotFoundError:
+                return []
+            except OSError:
+                logger.exception("Cannot read audit spill file %s", self.spill_path)
+                return []
+        return lines
+
+    async def _replay_spill(self):
+        """Move events from the spill file back into the queue."""
+        if not self.spill_path:
+            return
+        lines = await asyncio.to_thread(self._take_spill)
+        if not lines:
+            return
+
+        for line in lines:
+            try:
+                event = json.loads(line)
+                event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+            except (ValueError, KeyError):
+                continue  # оборванная последняя строка и т.п.
+            self._queue.append(event)
+        # всё, что не влезло в очередь, снова уходит в файл
+        overflow = len(self._queue) - self.max_queue
+        if overflow > 0:
+            await asyncio.to_thread(self._spill, [self._queue.pop() for _ in range(overflow)][::-1])
+        logger.info("Replayed %d audit events from %s", len(lines), self.spill_path)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+audit_writer = AuditWriter(
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_SEC,
+    max_queue=settings.AUDIT_MAX_QUEUE,
+    spill_path=settings.AUDIT_SPILL_PATH,
+)
+
+
+def log_action(user_id, action: str, success: bool = True, ip: str | None = None):
+    """Queue an audit event; it reaches the DB with the next batch."""
+    audit_writer.log(user_id, action, success=success, ip=ip)
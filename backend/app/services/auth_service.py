@@ -1,47 +1,56 @@
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
-from app.models.audit import AuditLog
-from app.core.security import hash_password, verify_password, hash_pin
+from app.services.audit_writer import log_action
+from app.services.hashing_pool import hashing_pool
+from app.services.rate_limiter import auth_ip_limiter, check_rate, login_failure_limiter
 from app.core.jwt_manager import create_access_token, create_refresh_token
 
-def register(data, db: Session):
-    user = db.query(User).filter(User.email == data.email).first()
+
+async def register(data, db: AsyncSession, ip: str | None = None):
+    user = await db.scalar(select(User).where(User.email == data.email))
     if user:
         raise HTTPException(400, "User already exists")
 
+    # Argon2 — в отдельном пуле процессов с бюджетом памяти
+    hashed_password = await hashing_pool.hash_password(data.password)
+    hashed_pin = await hashing_pool.hash_pin(data.pin) if data.pin else None
+
     new_user = User(
         email=data.email,
-        hashed_password=hash_password(data.password),
-        hashed_pin=hash_pin(data.pin) if data.pin else None
+        hashed_password=hashed_password,
+        hashed_pin=hashed_pin
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
-    log_action(db, new_user.id, "register")
+    log_action(new_user.id, "register", ip=ip)
 
     return new_user
 
 
-def login(data, db: Session):
-    user = db.query(User).filter(User.email == data.email).first()
+async def login(data, db: AsyncSession, ip: str | None = None):
+    # лимиты до БД и Argon2: попытки с IP и на email (сброс при успехе)
+    email = data.email.lower()
+    check_rate(auth_ip_limiter, ip)
+    check_rate(login_failure_limiter, email)
+
+    user = await db.scalar(select(User).where(User.email == data.email))
     if not user:
+        log_action(None, "login_fail", success=False, ip=ip)
         raise HTTPException(400, "Invalid credentials")
 
-    if not verify_password(data.password, user.hashed_password):
-        log_action(db, None, "login_fail", success=False)
+    if not await hashing_pool.verify_password(data.password, user.hashed_password):
+        log_action(user.id, "login_fail", success=False, ip=ip)
         raise HTTPException(400, "Invalid credentials")
 
+    login_failure_limiter.reset(email)
+
     access = create_access_token(user.id)
     refresh = create_refresh_token(user.id)
 
-    log_action(db, user.id, "login")
+    log_action(user.id, "login", ip=ip)
 
     return access, refresh, user
-
-
-def log_action(db, user_id, action, success=True):
-    entry = AuditLog(user_id=user_id, action=action, success=success)
-    db.add(entry)
-    db.commit()
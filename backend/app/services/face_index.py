@@ -0,0 +1,565 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.biometric import Biometric
+from app.services.template_codec import open_templates
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` best scores, best first."""
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+# -----------------------------
+# Точный поиск (flat)
+# -----------------------------
+
+class FaceIndex:
+    """Exact 1:N search over all enrolled face templates.
+
+    Templates live in one contiguous, L2-normalized float32 matrix (2 KB per
+    user for 512-d ArcFace), so a search is a single matmul + argpartition.
+    Rows are upserted in place on enroll; the matrix grows by doubling.
+
+    Subclasses (ANN backends) keep this matrix as the source of truth and
+    hook row writes/moves to maintain their own structures.
+    """
+
+    kind = "flat"
+
+    def __init__(self, dim: int = EMBEDDING_DIM, capacity: int = 1024):
+        self.dim = dim
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        self._user_ids = np.empty(capacity, dtype=np.int64)
+        self._rows: dict[int, int] = {}
+        self._size = 0
+
+        self._lock = threading.RLock()
+        self._building = False
+        self._pending: list[tuple[int, np.ndarray]] = []
+        self.ready = False
+        # есть изменения после последней загрузки/снапшота
+        self.dirty = False
+        # max(Biometric.updated_at), покрытый содержимым индекса
+        self.watermark: datetime | None = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    # --- хуки для ANN-наследников ---
+
+    def _on_grow(self, capacity: int):
+        pass
+
+    def _on_write(self, row: int, user_id: int, vector: np.ndarray, is_new: bool):
+        pass
+
+    def _on_move(self, src: int, dst: int):
+        pass
+
+    def _on_remove(self, user_id: int):
+        pass
+
+    def _after_build(self, extra_dir: str | None):
+        pass
+
+    def save_extra(self, directory: str):
+        """Persist backend-specific structures next to the vectors."""
+
+    # --- изменение ---
+
+    def _grow(self, capacity: int):
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        user_ids = np.empty(capacity, dtype=np.int64)
+        matrix[:self._size] = self._matrix[:self._size]
+        user_ids[:self._size] = self._user_ids[:self._size]
+        self._matrix, self._user_ids = matrix, user_ids
+        self._on_grow(capacity)
+
+    def add(self, user_id: int, embedding: np.ndarray):
+        """Insert or replace the template of ``user_id``."""
+        vector = _normalize(embedding)
+        with self._lock:
+            if self._building:
+                # bulk build ещё идёт — применим после него
+                self._pending.append((user_id, vector))
+                return
+
+            row = self._rows.get(user_id)
+            is_new = row is None
+            if is_new:
+                if self._size == len(self._matrix):
+                    self._grow(max(1024, 2 * len(self._matrix)))
+                row = self._size
+                self._rows[user_id] = row
+                self._user_ids[row] = user_id
+                self._size += 1
+            self._matrix[row] = vector
+            self._on_write(row, user_id, vector, is_new)
+            self.dirty = True
+
+    def remove(self, user_id: int):
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return
+            # на место удалённой строки переносим последнюю
+            last = self._size - 1
+            if row != last:
+                moved = int(self._user_ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._user_ids[row] = moved
+                self._rows[moved] = row
+                self._on_move(last, row)
+            self._size -= 1
+            self._on_remove(user_id)
+            self.dirty = True
+
+    def begin_build(self):
+        with self._lock:
+            self._building = True
+            self._pending = []
+
+    def abort_build(self):
+        """Keep the current contents, just apply adds that arrived during the build."""
+        with self._lock:
+            self._building = False
+            pending, self._pending = self._pending, []
+            for user_id, vector in pending:
+                self.add(user_id, vector)
+
+    def build(self, user_ids: np.ndarray, vectors: np.ndarray, normalized: bool = False, extra_dir: str | None = None):
+        """Replace the whole index, then replay adds made meanwhile.
+
+        With ``normalized=True`` the matrix is used as is (no copy), which is
+        how a memory-mapped snapshot is attached.
+        """
+        if not normalized:
+            vectors = np.ascontiguousarray(_normalize(vectors.reshape(-1, self.dim)))
+
+        with self._lock:
+            self._matrix = vectors
+            self._user_ids = np.array(user_ids, dtype=np.int64)
+            self._rows = {int(uid): row for row, uid in enumerate(self._user_ids)}
+            self._size = len(self._user_ids)
+            self._after_build(extra_dir)
+
+            self._building = False
+            pending, self._pending = self._pending, []
+            self.dirty = False
+            for user_id, vector in pending:
+                self.add(user_id, vector)
+            self.ready = True
+
+    # --- поиск ---
+
+    def search(self, query: np.ndarray, k: int, threshold: float) -> list[tuple[int, float]]:
+        """Top-``k`` (user_id, similarity) with similarity >= ``threshold``, best first."""
+        q = _normalize(query)
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+            scores = self._matrix[:n] @ q
+            top = _top_k(scores, k)
+            return [
+                (int(self._user_ids[i]), float(scores[i]))
+                for i in top
+                if scores[i] >= threshold
+            ]
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.kind,
+            "ready": self.ready,
+            "size": self._size,
+            "capacity": len(self._matrix),
+            "bytes": int(self._matrix.nbytes),
+        }
+
+
+# -----------------------------
+# IVF-flat на чистом NumPy
+# -----------------------------
+
+def _spherical_kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """k-means on the unit sphere (cosine), returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        # пустые списки оставляют старый центроид
+        centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class IVFFlatIndex(FaceIndex):
+    """Inverted-file index: probe the ``nprobe`` closest of ``nlist`` clusters.
+
+    Candidates are scored exactly against the shared matrix, so recall only
+    depends on ``nprobe``. Below ``MIN_POINTS_PER_LIST * nlist`` templates the
+    index is not trained and searches fall back to the exact scan.
+    """
+
+    kind = "ivf"
+    MIN_POINTS_PER_LIST = 39
+
+    def __init__(self, nlist: int = 0, nprobe: int = 16, **kwargs):
+        super().__init__(**kwargs)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._centroids: np.ndarray | None = None
+        self._assign = np.empty(len(self._matrix), dtype=np.int32)
+
+    def _on_grow(self, capacity: int):
+        assign = np.empty(capacity, dtype=np.int32)
+        assign[:self._size] = self._assign[:self._size]
+        self._assign = assign
+
+    def _on_write(self, row, user_id, vector, is_new):
+        if self._centroids is not None:
+            self._assign[row] = int(np.argmax(self._centroids @ vector))
+
+    def _on_move(self, src, dst):
+        self._assign[dst] = self._assign[src]
+
+    def _assign_all(self, chunk: int = 65536):
+        n = self._size
+        self._assign = np.empty(max(n, len(self._matrix)), dtype=np.int32)
+        for start in range(0, n, chunk):
+            block = self._matrix[start:start + chunk] @ self._centroids.T
+            self._assign[start:start + len(block)] = np.argmax(block, axis=1)
+
+    def _after_build(self, extra_dir):
+        n = self._size
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        self._centroids = None
+        self._assign = np.empty(max(n, len(self._matrix)), dtype=np.int32)
+
+        if extra_dir:
+            centroids_path = os.path.join(extra_dir, "ivf_centroids.npy")
+            assign_path = os.path.join(extra_dir, "ivf_assign.npy")
+            if os.path.exists(centroids_path) and os.path.exists(assign_path):
+                assign = np.load(assign_path)
+                if len(assign) == n:
+                    self._centroids = np.load(centroids_path)
+                    self._assign[:n] = assign
+                    return
+
+        if n < self.MIN_POINTS_PER_LIST * nlist:
+            return
+
+        rng = np.random.default_rng(0)
+        sample = self._matrix[:n]
+        if n > nlist * 64:
+            sample = sample[np.sort(rng.choice(n, nlist * 64, replace=False))]
+        self._centroids = _spherical_kmeans(np.asarray(sample), nlist)
+        self._assign_all()
+
+    def save_extra(self, directory):
+        if self._centroids is not None:
+            np.save(os.path.join(directory, "ivf_centroids.npy"), self._centroids)
+            np.save(os.path.join(directory, "ivf_assign.npy"), self._assign[:self._size])
+
+    def search(self, query, k, threshold):
+        if self._centroids is None:
+            return super().search(query, k, threshold)
+
+        q = _normalize(query)
+        with self._lock:
+            n = self._size
+            probes = _top_k(self._centroids @ q, self.nprobe)
+            candidates = np.flatnonzero(np.isin(self._assign[:n], probes))
+            if len(candidates) == 0:
+                return []
+
+            scores = self._matrix[candidates] @ q
+            top = _top_k(scores, k)
+            return [
+                (int(self._user_ids[candidates[i]]), float(scores[i]))
+                for i in top
+                if scores[i] >= threshold
+            ]
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "trained": self._centroids is not None,
+            "nlist": 0 if self._centroids is None else len(self._centroids),
+            "nprobe": self.nprobe,
+        }
+
+
+# -----------------------------
+# HNSW (опционально, hnswlib)
+# -----------------------------
+
+class HNSWFaceIndex(FaceIndex):
+    """HNSW graph (hnswlib) over the shared matrix, labels are user ids.
+
+    Needs ``pip install hnswlib``; the graph is saved next to the vectors so a
+    restart doesn't rebuild it.
+    """
+
+    kind = "hnsw"
+
+    def __init__(self, m: int = 16, ef_construction: int = 200, ef_search: int = 64, **kwargs):
+        import hnswlib  # опциональная зависимость
+
+        super().__init__(**kwargs)
+        self._hnswlib = hnswlib
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._graph = self._new_graph(len(self._matrix))
+        self._deleted: set[int] = set()
+
+    def _new_graph(self, capacity: int):
+        graph = self._hnswlib.Index(space="ip", dim=self.dim)
+        graph.init_index(max_elements=max(capacity, 1), ef_construction=self.ef_construction, M=self.m)
+        graph.set_ef(self.ef_search)
+        return graph
+
+    def _on_grow(self, capacity):
+        self._graph.resize_index(capacity)
+
+    def _on_write(self, row, user_id, vector, is_new):
+        if self._graph.get_current_count() >= self._graph.get_max_elements():
+            self._graph.resize_index(max(1024, 2 * self._graph.get_max_elements()))
+        if user_id in self._deleted:
+            self._graph.unmark_deleted(user_id)
+            self._deleted.discard(user_id)
+        self._graph.add_items(vector.reshape(1, -1), np.array([user_id]))
+
+    def _on_remove(self, user_id):
+        self._graph.mark_deleted(user_id)
+        self._deleted.add(user_id)
+
+    def _after_build(self, extra_dir):
+        n = self._size
+        self._deleted = set()
+        graph_path = os.path.join(extra_dir, "hnsw.bin") if extra_dir else None
+        if graph_path and os.path.exists(graph_path):
+            graph = self._hnswlib.Index(space="ip", dim=self.dim)
+            graph.load_index(graph_path, max_elements=max(n, 1))
+            if graph.get_current_count() == n:
+                graph.set_ef(self.ef_search)
+                self._graph = graph
+                return
+
+        self._graph = self._new_graph(n)
+        if n:
+            self._graph.add_items(np.asarray(self._matrix[:n]), self._user_ids[:n])
+
+    def save_extra(self, directory):
+        if not self._deleted:
+            self._graph.save_index(os.path.join(directory, "hnsw.bin"))
+
+    def search(self, query, k, threshold):
+        q = _normalize(query).reshape(1, -1)
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+            k = min(k, n)
+            self._graph.set_ef(max(self.ef_search, k))
+            labels, distances = self._graph.knn_query(q, k=k)
+            # space="ip": distance = 1 - <a, b>
+            return [
+                (int(label), float(1.0 - dist))
+                for label, dist in zip(labels[0], distances[0])
+                if 1.0 - dist >= threshold
+            ]
+
+    def stats(self):
+        return {**super().stats(), "ef_search": self.ef_search, "m": self.m}
+
+
+def create_face_index(backend: str) -> FaceIndex:
+    if backend == "flat":
+        return FaceIndex()
+    if backend == "ivf":
+        return IVFFlatIndex(nlist=settings.IVF_NLIST, nprobe=settings.IVF_NPROBE)
+    if backend == "hnsw":
+        return HNSWFaceIndex(
+            m=settings.HNSW_M,
+            ef_construction=settings.HNSW_EF_CONSTRUCTION,
+            ef_search=settings.HNSW_EF_SEARCH,
+        )
+    raise ValueError(f"Unknown FACE_INDEX_BACKEND: {backend!r}")
+
+
+# -----------------------------
+# Снапшот на диске (memory-mapped)
+# -----------------------------
+# path/
+#   CURRENT                  -> имя актуального снапшота (меняется атомарно)
+#   snapshot-<ts>-<pid>/
+#     vectors.npy, user_ids.npy, meta.json, + файлы бэкенда
+
+def save_snapshot(index: FaceIndex, path: str):
+    """Write the index to a new snapshot directory and switch CURRENT to it."""
+    os.makedirs(path, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}-{os.getpid()}"
+    directory = os.path.join(path, name)
+    os.makedirs(directory)
+
+    with index._lock:
+        n = index._size
+        np.save(os.path.join(directory, "vectors.npy"), index._matrix[:n])
+        np.save(os.path.join(directory, "user_ids.npy"), index._user_ids[:n])
+        index.save_extra(directory)
+        index.dirty = False
+        meta = {
+            "kind": index.kind,
+            "dim": index.dim,
+            "size": n,
+            "watermark": index.watermark.isoformat() if index.watermark else None,
+        }
+
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    current_tmp = os.path.join(path, f"CURRENT.{os.getpid()}")
+    with open(current_tmp, "w") as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(path, "CURRENT"))
+
+    # старые снапшоты можно удалять: уже открытые mmap остаются валидными
+    for entry in os.listdir(path):
+        if entry.startswith("snapshot-") and entry != name:
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+
+def read_snapshot(index: FaceIndex, path: str):
+    """Return (user_ids, mmap vectors, watermark, extra_dir) or None."""
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            directory = os.path.join(path, f.read().strip())
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta["dim"] != index.dim or not meta["watermark"]:
+        return None
+
+    # mmap_mode="c": страницы общие между воркерами, запись уходит в приватную копию
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="c")
+    user_ids = np.load(os.path.join(directory, "user_ids.npy"))
+    # структуры ANN берём только если снапшот от того же бэкенда
+    extra_dir = directory if meta["kind"] == index.kind else None
+    return user_ids, vectors, datetime.fromisoformat(meta["watermark"]), extra_dir
+
+
+# -----------------------------
+# Загрузка из БД
+# -----------------------------
+
+def _fetch_templates(db, *criteria, batch_size: int = 10_000):
+    result = db.execute(
+        select(Biometric.user_id, Biometric.face_template).where(*criteria).execution_options(yield_per=batch_size)
+    )
+    # расшифровка пачками: один decrypt_many на batch_size строк
+    for rows in result.partitions():
+        for (user_id, _), template in zip(rows, open_templates([blob for _, blob in rows])):
+            yield user_id, template.vector
+
+
+def _build_full(index: FaceIndex, db, total: int):
+    """Decrypt every ``Biometric.face_template`` into a preallocated matrix."""
+    user_ids = np.empty(total, dtype=np.int64)
+    vectors = np.empty((total, index.dim), dtype=np.float32)
+
+    n = 0
+    for user_id, embedding in _fetch_templates(db):
+        if n == total:
+            break  # строки добавились во время загрузки — их догонит add()
+        user_ids[n] = user_id
+        vectors[n] = embedding
+        n += 1
+
+    index.build(user_ids[:n], vectors[:n])
+
+
+def load_face_index(index: FaceIndex, path: str = ""):
+    """Attach the on-disk snapshot and catch up on changed rows, or rebuild from the DB.
+
+    Only rows with ``updated_at >= snapshot watermark`` are decrypted on the
+    snapshot path. The watermark is kept FACE_INDEX_WATERMARK_MARGIN_SEC
+    behind ``max(updated_at)``: on Postgres ``now()`` is the transaction
+    start, so a transaction still open at load time can commit rows older
+    than the max we read. When the row count still doesn't match afterwards, the
+    index is rebuilt from scratch. A fresh snapshot is written when ``path``
+    is set.
+    """
+    index.begin_build()
+    db = SessionLocal()
+    try:
+        watermark = db.query(func.max(Biometric.updated_at)).scalar()
+        if watermark is not None:
+            # перечитываем немного лишнего, зато не теряем строки долгих транзакций
+            watermark -= timedelta(seconds=settings.FACE_INDEX_WATERMARK_MARGIN_SEC)
+        total = db.query(func.count(Biometric.id)).scalar() or 0
+
+        snapshot = read_snapshot(index, path) if path else None
+        since = None
+        changed = 0
+        if snapshot is not None:
+            user_ids, vectors, since, extra_dir = snapshot
+            index.build(user_ids, vectors, normalized=True, extra_dir=extra_dir)
+            for user_id, embedding in _fetch_templates(db, Biometric.updated_at >= since):
+                index.add(user_id, embedding)
+                changed += 1
+
+            if len(index) != total:
+                logger.warning("Face index snapshot is inconsistent (%d != %d), rebuilding", len(index), total)
+                snapshot = since = None
+                index.begin_build()
+
+        if snapshot is None:
+            _build_full(index, db, total)
+            changed = len(index)
+    except BaseException:
+        index.abort_build()
+        raise
+    finally:
+        db.close()
+
+    index.watermark = watermark
+    logger.info("Face index (%s) ready: %d templates, %d decrypted", index.kind, len(index), changed)
+
+    # строки в пределах запаса перечитываются на каждом старте — снапшот
+    # переписываем только если появилось что-то новее него
+    if path and changed and watermark != since:
+        save_snapshot(index, path)
+
+
+face_index = create_face_index(settings.FACE_INDEX_BACKEND)
@@ -0,0 +1,142 @@
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.inference_pool import limit_model_threads, limit_onnx_threads, onnx_threads_per_worker
+
+# без этих модулей пайплайн не работает (bbox/kps, pose, embedding)
+REQUIRED_MODULES = {"detection", "landmark_3d_68", "recognition"}
+LIVENESS_MODULES = ["detection", "landmark_3d_68"]
+
+
+def load_face_analysis(pack: str, det_size: int, allowed_modules: list[str], onnx_threads: int):
+    """Build and prepare a FaceAnalysis restricted to ``allowed_modules``."""
+    import insightface
+
+    model = insightface.app.FaceAnalysis(name=pack, allowed_modules=allowed_modules)
+    model.prepare(ctx_id=-1, det_size=(det_size, det_size))
+    # workers пула * потоки ONNX ~= ядра CPU, иначе потоки дерутся за ядра
+    limit_onnx_threads(model, onnx_threads)
+    return model
+
+
+def load_recognition(pack: str, onnx_threads: int):
+    """Only the recognition model of ``pack`` (no detector): for the legacy model of a migration."""
+    import glob
+    import os
+
+    from insightface.model_zoo import model_zoo
+    from insightface.utils import ensure_available
+
+    for onnx_file in sorted(glob.glob(os.path.join(ensure_available("models", pack), "*.onnx"))):
+        model = model_zoo.get_model(onnx_file)
+        if model is not None and model.taskname == "recognition":
+            model.prepare(ctx_id=-1)
+            limit_model_threads(model, onnx_threads)
+            return model
+    raise ValueError(f"No recognition model in pack {pack!r}")
+
+
+class FaceModelRegistry:
+    """Process-wide holder of the InsightFace models.
+
+    Nothing is loaded at import time: models are built on first use (or by
+    the app lifespan at startup), exactly once, under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._face = None
+        self._liveness = None
+        self._legacy = None
+        self._loaded = False
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded
+
+    def load(self, onnx_threads: int | None = None):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+
+            missing = REQUIRED_MODULES - set(settings.FACE_ALLOWED_MODULES)
+            if missing:
+                raise ValueError(f"FACE_ALLOWED_MODULES must include {sorted(missing)}")
+
+            threads = onnx_threads or onnx_threads_per_worker()
+            self._face = load_face_analysis(
+                settings.FACE_MODEL_PACK, settings.FACE_DET_SIZE, settings.FACE_ALLOWED_MODULES, threads
+            )
+            if settings.LIVENESS_MODEL_PACK:
+                self._liveness = load_face_analysis(
+                    settings.LIVENESS_MODEL_PACK, settings.LIVENESS_DET_SIZE, LIVENESS_MODULES, threads
+                )
+            if settings.FACE_LEGACY_MODEL_PACK:
+                # детектор и выравнивание общие, старая модель нужна только для embedding
+                self._legacy = load_recognition(settings.FACE_LEGACY_MODEL_PACK, threads)
+            self._loaded = True
+
+    def warmup(self):
+        """One dummy pass through every loaded model.
+
+        The first ``session.run`` allocates ORT arenas and picks kernels, which
+        otherwise lands on the first real user request.
+        """
+        from insightface.app.common import Face
+
+        for model in filter(None, [self.face, self.liveness]):
+            size = model.det_model.input_size
+            blank = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+            model.det_model.detect(blank, max_num=0, metric="default")
+
+            face = Face(bbox=np.array([0, 0, size[0], size[1]], dtype=np.float32))
+            model.models["landmark_3d_68"].get(blank, face)
+
+            rec = model.models.get("recognition")
+            if rec is not None:
+                rec.get_feat([np.zeros((rec.input_size[1], rec.input_size[0], 3), dtype=np.uint8)])
+        if self._legacy is not None:
+            size = self._legacy.input_size
+            self._legacy.get_feat([np.zeros((size[1], size[0], 3), dtype=np.uint8)])
+
+    @property
+    def face(self):
+        self.load()
+        return self._face
+
+    @property
+    def liveness(self):
+        """Light pack for liveness-only frames, or None when not configured."""
+        self.load()
+        return self._liveness
+
+    @property
+    def legacy_recognition(self):
+        """Recognition model of FACE_LEGACY_MODEL_PACK during a migration, else None."""
+        self.load()
+        return self._legacy
+
+    def recognition(self, model_id: str):
+        """Recognition model that produced templates tagged ``model_id``."""
+        if model_id == settings.FACE_MODEL_PACK:
+            return self.face.models["recognition"]
+        if model_id == settings.FACE_LEGACY_MODEL_PACK and self.legacy_recognition is not None:
+            return self._legacy
+        raise ValueError(f"Recognition model {model_id!r} is not loaded")
+
+    def loaded_models(self) -> dict:
+        if not self._loaded:
+            return {}
+        models = {settings.FACE_MODEL_PACK: sorted(self._face.models)}
+        if self._liveness is not None:
+            models[settings.LIVENESS_MODEL_PACK] = sorted(self._liveness.models)
+        if self._legacy is not None:
+            models[settings.FACE_LEGACY_MODEL_PACK] = ["recognition"]
+        return models
+
+
+face_models = FaceModelRegistry()
@@ -0,0 +1,365 @@
+import numpy as np
+import cv2
+
+from app.core.config import settings
+from app.services.face_models import face_models
+from app.services.frame_filter import check_frame
+from app.services.image_io import ImageTooLarge, decode_image
+from app.services.metrics import timed
+
+
+# -----------------------------
+# Вспомогательные функции
+# -----------------------------
+
+def _decode_frame(content) -> tuple[np.ndarray | None, str | None]:
+    try:
+        img = decode_image(content)
+    except ImageTooLarge:
+        return None, "too_large"
+    return img, None if img is not None else "decode_failed"
+
+
+@timed("face_analysis")
+def get_best_face(img):
+    """Return the biggest detected face (most likely the user)."""
+    faces = face_models.face.get(img)
+    if not faces:
+        return None
+
+    # выбираем самое крупное лицо (по площади bbox)
+    best = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+    return best
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Cosine similarity between embeddings."""
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def cosine_similarities(matrix: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Cosine similarity of every row of ``matrix`` against ``b``."""
+    return (matrix @ b) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(b))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+def centroid(templates: np.ndarray) -> np.ndarray:
+    """L2-normalized mean of the (normalized) templates."""
+    return normalize_rows(normalize_rows(templates).mean(axis=0))
+
+
+def score_templates(probes: np.ndarray, templates: np.ndarray, fusion: str = "max") -> np.ndarray:
+    """Score of every probe frame against all templates of one user.
+
+    One (F, T) similarity matrix for all probes and templates; ``max`` takes
+    the best template per probe, ``centroid`` compares with the mean template.
+    """
+    probes = normalize_rows(probes)
+    if fusion == "centroid":
+        return probes @ centroid(templates)
+    if fusion == "max":
+        return (probes @ normalize_rows(templates).T).max(axis=1)
+    raise ValueError(f"Unknown score fusion: {fusion!r}")
+
+
+# -----------------------------
+# Батч-пайплайн для нескольких кадров
+# -----------------------------
+
+def _largest(bboxes: np.ndarray, kpss):
+    """Pick the biggest detection and wrap it into an insightface Face."""
+    from insightface.app.common import Face
+
+    if bboxes.shape[0] == 0:
+        return None
+
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    i = int(np.argmax(areas))
+    return Face(
+        bbox=bboxes[i, 0:4],
+        kps=kpss[i] if kpss is not None else None,
+        det_score=bboxes[i, 4],
+    )
+
+
+def _det_supports_batch(det) -> bool:
+    """SCRFD export with 3-D outputs and a dynamic batch axis."""
+    batch_dim = det.session.get_inputs()[0].shape[0]
+    return bool(det.batched) and not isinstance(batch_dim, int)
+
+
+def _letterbox(img, input_size):
+    """Same resize + zero padding as ``RetinaFace.detect``."""
+    im_ratio = float(img.shape[0]) / img.shape[1]
+    model_ratio = float(input_size[1]) / input_size[0]
+    if im_ratio > model_ratio:
+        new_height = input_size[1]
+        new_width = int(new_height / im_ratio)
+    else:
+        new_width = input_size[0]
+        new_height = int(new_width * im_ratio)
+
+    det_scale = float(new_height) / img.shape[0]
+    det_img = np.zeros((input_size[1], input_size[0], 3), dtype=np.uint8)
+    det_img[:new_height, :new_width, :] = cv2.resize(img, (new_width, new_height))
+    return det_img, det_scale
+
+
+def _anchor_centers(det, height: int, width: int, stride: int) -> np.ndarray:
+    key = (height, width, stride)
+    centers = det.center_cache.get(key)
+    if centers is None:
+        centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+        centers = (centers * stride).reshape((-1, 2))
+        if det._num_anchors > 1:
+            centers = np.stack([centers] * det._num_anchors, axis=1).reshape((-1, 2))
+        if len(det.center_cache) < 100:
+            det.center_cache[key] = centers
+    return centers
+
+
+def _decode_scrfd(det, net_outs, b: int, input_height: int, input_width: int, det_scale: float):
+    """Decode one batch element of SCRFD outputs (mirrors ``RetinaFace.forward/detect``)."""
+    from insightface.model_zoo.retinaface import distance2bbox, distance2kps
+
+    fmc = det.fmc
+    scores_list, bboxes_list, kpss_list = [], [], []
+
+    for idx, stride in enumerate(det._feat_stride_fpn):
+        scores = net_outs[idx][b]
+        bbox_preds = net_outs[idx + fmc][b] * stride
+        centers = _anchor_centers(det, input_height // stride, input_width // stride, stride)
+
+        pos_inds = np.where(scores >= det.det_thresh)[0]
+        scores_list.append(scores[pos_inds])
+        bboxes_list.append(distance2bbox(centers, bbox_preds)[pos_inds])
+        if det.use_kps:
+            kps_preds = net_outs[idx + fmc * 2][b] * stride
+            kpss = distance2kps(centers, kps_preds).reshape((-1, 5, 2))
+            kpss_list.append(kpss[pos_inds])
+
+    scores = np.vstack(scores_list)
+    order = scores.ravel().argsort()[::-1]
+    bboxes = np.vstack(bboxes_list) / det_scale
+    pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+    keep = det.nms(pre_det)
+
+    kpss = None
+    if det.use_kps:
+        kpss = (np.vstack(kpss_list) / det_scale)[order, :, :][keep, :, :]
+    return pre_det[keep, :], kpss
+
+
+@timed("detect")
+def detect_faces(imgs: list, model=None) -> list:
+    """Biggest face per image (or None), detection batched when the model allows it.
+
+    buffalo_l's det_10g is exported with a fixed batch of 1; for such models
+    this falls back to one detector call per image.
+    """
+    det = (model or face_models.face).det_model
+    if len(imgs) < 2 or not _det_supports_batch(det):
+        return [_largest(*det.detect(img, max_num=0, metric="default")) for img in imgs]
+
+    input_size = det.input_size
+    letterboxed = [_letterbox(img, input_size) for img in imgs]
+    blob = cv2.dnn.blobFromImages(
+        [det_img for det_img, _ in letterboxed],
+        1.0 / det.input_std,
+        input_size,
+        (det.input_mean, det.input_mean, det.input_mean),
+        swapRB=True,
+    )
+    net_outs = det.session.run(det.output_names, {det.input_name: blob})
+
+    faces = []
+    for b, (_, det_scale) in enumerate(letterboxed):
+        bboxes, kpss = _decode_scrfd(det, net_outs, b, blob.shape[2], blob.shape[3], det_scale)
+        faces.append(_largest(bboxes, kpss))
+    return faces
+
+
+# стандартное выравнивание ArcFace; get_feat сам приводит к input_size модели
+CROP_SIZE = 112
+
+
+def align_faces(imgs: list, faces: list) -> list[np.ndarray]:
+    from insightface.utils import face_align
+
+    return [face_align.norm_crop(img, landmark=face.kps, image_size=CROP_SIZE) for img, face in zip(imgs, faces)]
+
+
+@timed("embed")
+def embed_crops(crops: list, rec=None) -> np.ndarray:
+    """Embeddings of aligned crops, one ONNX call for all (current model by default)."""
+    rec = rec or face_models.face.models["recognition"]
+    return np.asarray(rec.get_feat(crops), dtype=np.float32)
+
+
+def embed_faces(imgs: list, faces: list, rec=None) -> np.ndarray:
+    """ArcFace embeddings for aligned crops of ``faces``."""
+    return embed_crops(align_faces(imgs, faces), rec)
+
+
+def analyze_frames(contents: list, model_id: str | None = None) -> tuple[list[dict], list[dict]]:
+    """Decode every frame and return (frames with a face, rejected frames).
+
+    Pipeline: decode all -> cheap quality gate (blur/exposure/size/duplicates)
+    -> detect (batched) -> pose per face -> recognition for all crops in a
+    single batch. Each rejected frame is reported as ``{"idx", "reason"}``.
+    With ``LIVENESS_MODEL_PACK`` set, detection and pose use the light pack
+    and only the most frontal frame is embedded (the others carry
+    ``embedding=None``). ``model_id`` other than FACE_MODEL_PACK embeds
+    with that (legacy) model and keeps the aligned ``crop`` of every frame
+    for background re-embedding. Runs inside the inference pool (one job
+    per request), so it must stay synchronous and must not touch the DB.
+    """
+    rec = face_models.recognition(model_id or settings.FACE_MODEL_PACK)
+    keep_crops = rec is not face_models.face.models["recognition"]
+
+    rejected = []
+    decoded = []
+    seen_hashes = []
+    for idx, content in enumerate(contents):
+        img, reason = _decode_frame(content)
+        if img is not None:
+            reason = check_frame(img, seen_hashes)
+        if reason:
+            rejected.append({"idx": idx, "reason": reason})
+        else:
+            decoded.append((idx, img))
+    if not decoded:
+        return [], rejected
+
+    liveness_model = face_models.liveness
+    model = liveness_model or face_models.face
+    faces = detect_faces([img for _, img in decoded], model)
+
+    found = []
+    for (idx, img), face in zip(decoded, faces):
+        if face is None:
+            rejected.append({"idx": idx, "reason": "no_face"})
+        else:
+            found.append((idx, img, face))
+    rejected.sort(key=lambda r: r["idx"])
+    if not found:
+        return [], rejected
+
+    # pose (pitch/yaw/roll) считает 3D-landmark модель
+    pose_model = model.models["landmark_3d_68"]
+    for _, img, face in found:
+        pose_model.get(img, face)
+
+    crops = [None] * len(found)
+    if liveness_model is None:
+        crops = align_faces([img for _, img, _ in found], [face for _, _, face in found])
+        embeddings = list(embed_crops(crops, rec))
+    else:
+        # similarity берётся только по front кадру — остальные не эмбеддим
+        front = min(range(len(found)), key=lambda i: abs(float(found[i][2].pose[0])))
+        _, img, light_face = found[front]
+        # kps от основного детектора точнее; если он лицо не нашёл — берём лёгкий
+        face = detect_faces([img])[0] or light_face
+        embeddings = [None] * len(found)
+        if keep_crops:
+            crops = align_faces([img for _, img, _ in found], [f for _, _, f in found])
+        crops[front] = align_faces([img], [face])[0]
+        embeddings[front] = embed_crops([crops[front]], rec)[0]
+
+    frames = [
+        {
+            "idx": idx,
+            "yaw": float(face.pose[0]),  # yaw (left/right head turn)
+            "embedding": embeddings[i],
+            "crop": crops[i] if keep_crops else None,
+        }
+        for i, (idx, _, face) in enumerate(found)
+    ]
+    return frames, rejected
+
+
+def embed_enroll_images(contents: list) -> list[tuple[np.ndarray | None, float | None, str | None]]:
+    """(embedding, yaw, rejection reason) for every image, for bulk enrollment.
+
+    Same gate as the verify pipeline (decode, quality, biggest face) but no
+    duplicate check across images; detection is batched when the model
+    allows it and recognition runs once for all found faces.
+    """
+    results = [None] * len(contents)
+    decoded = []
+    for i, content in enumerate(contents):
+        img, reason = _decode_frame(content)
+        if img is not None:
+            reason = check_frame(img)
+        if reason:
+            results[i] = (None, None, reason)
+        else:
+            decoded.append((i, img))
+
+    found = []
+    if decoded:
+        for (i, img), face in zip(decoded, detect_faces([img for _, img in decoded])):
+            if face is None:
+                results[i] = (None, None, "no_face")
+            else:
+                found.append((i, img, face))
+
+    if found:
+        pose_model = face_models.face.models["landmark_3d_68"]
+        for _, img, face in found:
+            pose_model.get(img, face)
+        embeddings = embed_faces([img for _, img, _ in found], [face for _, _, face in found])
+        for (i, _, face), embedding in zip(found, embeddings):
+            results[i] = (embedding, float(face.pose[0]), None)
+
+    return results
+
+
+def analyze_frame(
+    content,
+    embed_if_yaw_below: float = float("inf"),
+    seen_hashes: list[int] | None = None,
+    model_id: str | None = None,
+) -> tuple[dict | None, str | None]:
+    """Single-frame variant for streaming sessions: (frame, rejection reason).
+
+    Pose is always computed; the (more expensive) embedding only when the
+    frame is more frontal than ``embed_if_yaw_below`` — i.e. when it would
+    become the new front frame. ``seen_hashes`` carries the duplicate check
+    across the frames of one session. ``model_id`` works as in
+    ``analyze_frames``.
+    """
+    rec = face_models.recognition(model_id or settings.FACE_MODEL_PACK)
+    keep_crops = rec is not face_models.face.models["recognition"]
+
+    img, reason = _decode_frame(content)
+    if img is None:
+        return None, reason
+
+    reason = check_frame(img, seen_hashes)
+    if reason:
+        return None, reason
+
+    liveness_model = face_models.liveness
+    model = liveness_model or face_models.face
+    face = detect_faces([img], model)[0]
+    if face is None:
+        return None, "no_face"
+
+    model.models["landmark_3d_68"].get(img, face)
+    yaw = float(face.pose[0])  # yaw (left/right head turn)
+
+    embedding = crop = None
+    if abs(yaw) < embed_if_yaw_below:
+        if liveness_model is not None:
+            face = detect_faces([img])[0] or face
+        crop = align_faces([img], [face])[0]
+        embedding = embed_crops([crop], rec)[0]
+    elif keep_crops:
+        crop = align_faces([img], [face])[0]
+
+    return {"yaw": yaw, "embedding": embedding, "crop": crop if keep_crops else None}, None
@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+# проверки считаются на уменьшенной копии — дёшево и почти не зависит от размера кадра
+CHECK_SIZE = 320
+
+
+def _gray_small(img: np.ndarray) -> np.ndarray:
+    h, w = img.shape[:2]
+    scale = CHECK_SIZE / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash: neighbouring-pixel gradients of a 9x8 thumbnail."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def check_frame(img: np.ndarray, seen_hashes: list[int] | None = None) -> str | None:
+    """Cheap quality gate before face analysis.
+
+    Returns the rejection reason (``too_small``, ``too_dark``, ``overexposed``,
+    ``blurry``, ``duplicate``) or None when the frame should be analyzed.
+    Hashes of accepted frames are appended to ``seen_hashes``.
+    """
+    if not settings.FRAME_FILTER_ENABLED:
+        return None
+
+    h, w = img.shape[:2]
+    if min(h, w) < settings.FRAME_MIN_SIDE:
+        return "too_small"
+
+    gray = _gray_small(img)
+
+    brightness = float(gray.mean())
+    if brightness < settings.FRAME_MIN_BRIGHTNESS:
+        return "too_dark"
+    if brightness > settings.FRAME_MAX_BRIGHTNESS:
+        return "overexposed"
+
+    # дисперсия лапласиана — классическая мера резкости
+    if cv2.Laplacian(gray, cv2.CV_64F).var() < settings.FRAME_MIN_SHARPNESS:
+        return "blurry"
+
+    if seen_hashes is not None:
+        frame_hash = dhash(gray)
+        if any((frame_hash ^ seen).bit_count() <= settings.FRAME_DUP_MAX_DISTANCE for seen in seen_hashes):
+            return "duplicate"
+        seen_hashes.append(frame_hash)
+
+    return None
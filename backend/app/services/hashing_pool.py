@@ -0,0 +1,202 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.core import security
+from app.core.config import settings
+from app.services.metrics import stage
+
+
+class HashingPool:
+    """Process pool for Argon2 with a global memory budget.
+
+    Every job declares how much memory its Argon2 call needs; jobs are only
+    started while the sum stays within ``memory_budget_mb``. Up to
+    ``queue_size`` jobs may wait for budget, beyond that (or after waiting
+    ``timeout`` seconds) callers get a 429 — a login spike turns into
+    queueing and 429s instead of the container being OOM-killed.
+    """
+
+    def __init__(self, workers: int, memory_budget_mb: int, queue_size: int, timeout: float, retry_after: int):
+        self.workers = workers
+        self.memory_budget_mb = memory_budget_mb
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._cond = None
+        self._loop = None
+
+        self._waiting = 0
+        self._running = 0
+        self._in_use_mb = 0
+        self._releases: set[asyncio.Task] = set()
+
+        # completed — только успешные; латентность считается только по ним
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.max_waiting = 0
+        self._latencies = deque(maxlen=1024)  # секунды, ожидание + хэширование
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # процессы стартуют при первом хэшировании, а не при импорте
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # spawn: воркеру не нужны потоки/модели родителя
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        return self._cond
+
+    def _reject(self, detail: str):
+        self.rejected += 1
+        return HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def _give_back(self, cond: asyncio.Condition, cost_mb: int):
+        async with cond:
+            self._in_use_mb -= cost_mb
+            self._running -= 1
+            cond.notify_all()
+
+    def _release(self, cond: asyncio.Condition, cost_mb: int):
+        task = asyncio.ensure_future(self._give_back(cond, cost_mb))
+        self._releases.add(task)
+        task.add_done_callback(self._releases.discard)
+
+    def _on_job_done(self, future: asyncio.Future, cond: asyncio.Condition, cost_mb: int):
+        if not future.cancelled():
+            future.exception()  # результат мог остаться без читателя (вызывающий отменён)
+        self._release(cond, cost_mb)
+
+    async def run(self, memory_kb: int, fn, *args):
+        """Run ``fn(*args)`` in a worker process once ``memory_kb`` fits the budget.
+
+        The budget is given back when the worker process is really done,
+        not when the caller stops waiting: a cancelled caller (MFA decided
+        early, client gone) leaves Argon2 running and its memory in use.
+        """
+        cost_mb = min(max(1, memory_kb // 1024), self.memory_budget_mb)
+        if self._waiting >= self.queue_size:
+            raise self._reject("Too many authentication requests, retry later")
+
+        started = time.monotonic()
+        cond = self._condition()
+
+        self._waiting += 1
+        self.max_waiting = max(self.max_waiting, self._waiting)
+        try:
+            async with cond:
+                await asyncio.wait_for(
+                    cond.wait_for(lambda: self._in_use_mb + cost_mb <= self.memory_budget_mb),
+                    timeout=self.timeout,
+                )
+                self._in_use_mb += cost_mb
+                self._running += 1
+        except asyncio.TimeoutError:
+            raise self._reject("Authentication queue timeout, retry later")
+        finally:
+            self._waiting -= 1
+
+        try:
+            try:
+                future = asyncio.wrap_future(self._get_executor().submit(fn, *args))
+            except BaseException:
+                self._release(cond, cost_mb)
+                raise
+            future.add_done_callback(lambda f: self._on_job_done(f, cond, cost_mb))
+            # shield: отмена вызывающего не отменяет future — бюджет держим до конца процесса
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except BrokenProcessPool:
+            # воркер умер (например, OOM) — пересоздаём пул
+            self.failed += 1
+            self._reset_executor()
+            raise HTTPException(503, detail="Hashing worker crashed, retry later")
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    # --- удобные обёртки над app.core.security ---
+
+    # этап включает ожидание бюджета в очереди — это и есть цена для запроса
+    async def hash_password(self, password: str) -> str:
+        with stage("argon2_hash"):
+            return await self.run(security.PASSWORD_MEMORY_KB, security.hash_password, password)
+
+    async def verify_password(self, plain: str, hashed: str) -> bool:
+        with stage("argon2_verify"):
+            return await self.run(security.PASSWORD_MEMORY_KB, security.verify_password, plain, hashed)
+
+    async def hash_pin(self, pin: str) -> str:
+        with stage("argon2_hash"):
+            return await self.run(security.PIN_MEMORY_KB, security.hash_pin, pin)
+
+    async def verify_pin(self, plain: str, hashed: str) -> bool:
+        with stage("argon2_verify"):
+            return await self.run(security.PIN_MEMORY_KB, security.verify_pin, plain, hashed)
+
+    def stats(self) -> dict:
+        latencies = np.array(self._latencies) if self._latencies else np.zeros(1)
+        return {
+            "workers": self.workers,
+            "queue_depth": self._waiting,
+            "max_queue_depth": self.max_waiting,
+            "running": self._running,
+            "memory_in_use_mb": self._in_use_mb,
+            "memory_budget_mb": self.memory_budget_mb,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+            "latency_p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hashing_pool = HashingPool(
+    workers=settings.HASHING_WORKERS,
+    memory_budget_mb=settings.HASHING_MEMORY_BUDGET_MB,
+    queue_size=settings.HASHING_QUEUE_SIZE,
+    timeout=settings.HASHING_TIMEOUT_SEC,
+    retry_after=settings.HASHING_RETRY_AFTER_SEC,
+)
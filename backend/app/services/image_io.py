@@ -0,0 +1,187 @@
+import asyncio
+import io
+import struct
+import threading
+from tempfile import SpooledTemporaryFile
+
+import cv2
+import numpy as np
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import settings
+from app.services.metrics import stage, timed
+
+
+class ImageTooLarge(ValueError):
+    """Image exceeds IMAGE_MAX_PIXELS even after reduced decoding."""
+
+
+# -----------------------------
+# Размер из заголовка (без декодирования)
+# -----------------------------
+
+# SOF0..SOF15, кроме DHT (C4), JPG (C8) и DAC (CC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(buf) -> tuple[int, int] | None:
+    i, n = 2, len(buf)
+    while i + 4 <= n:
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:  # padding
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # без длины
+            i += 2
+            continue
+        length = struct.unpack_from(">H", buf, i + 2)[0]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            height, width = struct.unpack_from(">HH", buf, i + 5)
+            return width, height
+        i += 2 + length
+    return None
+
+
+def image_size(buf) -> tuple[str, int, int] | None:
+    """(format, width, height) from the JPEG/PNG header, or None."""
+    if len(buf) >= 4 and buf[0] == 0xFF and buf[1] == 0xD8:
+        size = _jpeg_size(buf)
+        return ("jpeg", *size) if size else None
+    if len(buf) >= 24 and bytes(buf[:8]) == b"\x89PNG\r\n\x1a\n":
+        width, height = struct.unpack_from(">II", buf, 16)
+        return "png", width, height
+    return None
+
+
+# -----------------------------
+# Декодирование
+# -----------------------------
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def reduction_factor(width: int, height: int, target: int) -> int:
+    """Largest 1/2/4/8 scale that keeps the long side >= ``target``."""
+    long_side = max(width, height)
+    for factor in (8, 4, 2):
+        if long_side // factor >= target:
+            return factor
+    return 1
+
+
+@timed("decode")
+def decode_image(file_bytes, target: int | None = None):
+    """Decode bytes into a cv2 BGR image, not larger than needed.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling, chosen
+    from the header) so the long side stays >= ``target`` (the detector input
+    by default). Returns None for undecodable data; raises ``ImageTooLarge``
+    when the decoded frame would exceed IMAGE_MAX_PIXELS.
+    """
+    target = target or settings.FACE_DET_SIZE
+    np_arr = np.frombuffer(file_bytes, np.uint8)
+
+    flag = cv2.IMREAD_COLOR
+    header = image_size(np_arr)
+    if header is not None:
+        fmt, width, height = header
+        factor = reduction_factor(width, height, target) if fmt == "jpeg" else 1
+        if (width // factor) * (height // factor) > settings.IMAGE_MAX_PIXELS:
+            raise ImageTooLarge(f"{width}x{height} image exceeds the pixel budget")
+        flag = _REDUCED_FLAGS[factor]
+
+    img = cv2.imdecode(np_arr, flag)
+    if img is not None and img.shape[0] * img.shape[1] > settings.IMAGE_MAX_PIXELS:
+        # формат без разобранного заголовка (webp и т.п.) — проверяем после
+        raise ImageTooLarge(f"{img.shape[1]}x{img.shape[0]} image exceeds the pixel budget")
+    return img
+
+
+# -----------------------------
+# Чтение UploadFile в переиспользуемые буферы
+# -----------------------------
+
+class UploadBuffers:
+    """Small free-list of bytearrays uploads are read into.
+
+    Avoids a fresh ``bytes`` object (and its copy) per uploaded frame.
+    Buffers bigger than ``keep_bytes`` are not returned to the pool so a
+    single huge upload doesn't pin memory forever.
+    """
+
+    def __init__(self, max_buffers: int, keep_bytes: int):
+        self.max_buffers = max_buffers
+        self.keep_bytes = keep_bytes
+        self._free: list[bytearray] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size: int) -> bytearray:
+        with self._lock:
+            for i, buf in enumerate(self._free):
+                if len(buf) >= size:
+                    return self._free.pop(i)
+        return bytearray(max(size, 64 * 1024))
+
+    def release(self, buf: bytearray):
+        if len(buf) > self.keep_bytes:
+            return
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buf)
+
+
+upload_buffers = UploadBuffers(
+    max_buffers=settings.UPLOAD_BUFFER_POOL_SIZE,
+    keep_bytes=settings.UPLOAD_BUFFER_KEEP_MB * 1024 * 1024,
+)
+
+
+def _in_memory(fileobj) -> bool:
+    """Reading ``fileobj`` can't block on disk I/O, so no thread hop is needed."""
+    if isinstance(fileobj, io.BytesIO):
+        return True
+    # SpooledTemporaryFile до rollover держит данные в памяти; нет _rolled
+    # (другая реализация) — считаем, что файл на диске, и читаем в потоке
+    return isinstance(fileobj, SpooledTemporaryFile) and getattr(fileobj, "_rolled", True) is False
+
+
+async def read_upload(file: UploadFile, buffers: list[bytearray]) -> memoryview:
+    """Read ``file`` into a pooled buffer (appended to ``buffers``), return a view of the data.
+
+    The caller hands ``buffers`` back with ``release_buffers`` once nothing
+    reads the views anymore.
+    """
+    max_bytes = settings.IMAGE_MAX_UPLOAD_MB * 1024 * 1024
+    size = file.size
+    if size is None:
+        file.file.seek(0, 2)
+        size = file.file.tell()
+    if size > max_bytes:
+        raise HTTPException(413, detail="Uploaded image is too large")
+
+    buf = upload_buffers.acquire(size)
+    buffers.append(buf)
+    view = memoryview(buf)[:size]
+
+    with stage("upload_read"):
+        file.file.seek(0)
+        if _in_memory(file.file):
+            read = file.file.readinto(view)
+        else:
+            read = await asyncio.to_thread(file.file.readinto, view)
+    return view[:read]
+
+
+def release_buffers(buffers: list[bytearray]):
+    for buf in buffers:
+        upload_buffers.release(buf)
+    buffers.clear()
@@ -0,0 +1,124 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+
+class InferencePool:
+    """Bounded thread pool for CPU-bound model inference.
+
+    onnxruntime releases the GIL inside ``session.run``, so a few threads are
+    enough to keep inference off the event loop. The number of accepted jobs
+    (running + waiting) is capped; when the cap is hit the caller gets a 429
+    with ``Retry-After`` instead of queueing forever.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float, retry_after: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Jobs accepted but not finished yet (running + queued)."""
+        return self._pending
+
+    def _acquire(self) -> bool:
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._pending += 1
+        return True
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, on_done=None):
+        """Run ``fn(*args)`` in the pool, with admission control and a timeout.
+
+        ``on_done()`` is called once the job is really finished (or rejected),
+        even if the caller already gave up on it by timeout — use it to free
+        buffers the job reads from.
+        """
+        if not self._acquire():
+            if on_done is not None:
+                on_done()
+            raise HTTPException(
+                status_code=429,
+                detail="Inference queue is full, retry later",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        try:
+            # контекст запроса едет в поток: этапы инференса попадают в его Server-Timing
+            future = self._executor.submit(contextvars.copy_context().run, fn, *args)
+        except BaseException:
+            self._release()
+            if on_done is not None:
+                on_done()
+            raise
+
+        # слот освобождается только когда поток реально закончил работу
+        # (или задача была отменена, не успев стартовать)
+        future.add_done_callback(self._release)
+        if on_done is not None:
+            future.add_done_callback(lambda _: on_done())
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Inference timed out")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def onnx_threads_per_worker() -> int:
+    """intra-op threads per ONNX session so that workers * threads ~= cores."""
+    if settings.INFERENCE_ONNX_THREADS > 0:
+        return settings.INFERENCE_ONNX_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, settings.INFERENCE_WORKERS))
+
+
+def limit_onnx_threads(face_analysis, threads: int):
+    """Recreate the sessions of a prepared FaceAnalysis with a fixed thread count.
+
+    insightface doesn't forward SessionOptions, and by default every session
+    grabs all cores, which oversubscribes the CPU as soon as two pool workers
+    run at once.
+    """
+    for model in face_analysis.models.values():
+        limit_model_threads(model, threads)
+
+
+def limit_model_threads(model, threads: int):
+    """Same as ``limit_onnx_threads`` for a single insightface model_zoo model."""
+    import onnxruntime
+
+    opts = onnxruntime.SessionOptions()
+    opts.intra_op_num_threads = threads
+    opts.inter_op_num_threads = 1
+
+    providers = model.session.get_providers()
+    model.session = onnxruntime.InferenceSession(model.model_file, sess_options=opts, providers=providers)
+
+
+inference_pool = InferencePool(
+    workers=settings.INFERENCE_WORKERS,
+    queue_size=settings.INFERENCE_QUEUE_SIZE,
+    timeout=settings.INFERENCE_TIMEOUT_SEC,
+    retry_after=settings.INFERENCE_RETRY_AFTER_SEC,
+)
@@ -0,0 +1,226 @@
+import functools
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ENABLED = settings.METRICS_ENABLED
+
+# секунды; от декодирования кадра (мс) до Argon2 под нагрузкой и инференса пачки
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# этапы текущего запроса: [(stage, seconds)] — для Server-Timing и slow log
+_request_stages: ContextVar[list | None] = ContextVar("request_stages", default=None)
+
+
+class Histogram:
+    """Cumulative-on-render Prometheus histogram (no client library needed)."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple, Histogram] = {}
+        self._counters: dict[tuple, int] = {}
+
+    def observe(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, labels: tuple):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self, gauges: dict[str, float] | None = None, counters: dict[str, float] | None = None) -> str:
+        """Prometheus text exposition format (0.0.4).
+
+        ``gauges`` and ``counters`` are point-in-time values read from other
+        components; ``counters`` must only ever grow (names end in ``_total``).
+        """
+        with self._lock:
+            histograms = sorted(
+                (name, labels, list(h.counts), h.sum, h.count) for (name, labels), h in self._histograms.items()
+            )
+            own_counters = sorted((name, labels, value) for (name, labels), value in self._counters.items())
+        # внешние счётчики — без меток, рядом со своими
+        own_counters += [(name, (), value) for name, value in sorted((counters or {}).items())]
+
+        lines = []
+        typed = set()
+        for name, labels, counts, total, count in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for name, labels, value in own_counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+
+
+# -----------------------------
+# Этапы
+# -----------------------------
+
+def record_stage(stage: str, seconds: float):
+    registry.observe("biometric_stage_duration_seconds", (("stage", stage),), seconds)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+def stage(name: str):
+    """``with stage("decode"): ...`` — a shared no-op when metrics are disabled."""
+    return _Stage(name) if ENABLED else _NOOP
+
+
+def timed(name: str):
+    """Decorator form of ``stage``; returns the function untouched when disabled."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+# -----------------------------
+# ASGI middleware
+# -----------------------------
+
+class MetricsMiddleware:
+    """Request duration per route, optional Server-Timing header and slow-request log.
+
+    Only added to the app when METRICS_ENABLED is on.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages = []
+        token = _request_stages.set(stages)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.SERVER_TIMING:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", _server_timing(stages, time.perf_counter() - started).encode())
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stages.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            registry.observe("http_request_duration_seconds", (("method", scope["method"]), ("route", route)), elapsed)
+            registry.inc("http_requests_total", (("method", scope["method"]), ("route", route), ("status", status)))
+            _log_if_slow(scope["method"], route, status, elapsed, stages)
+
+
+def _server_timing(stages: list, total: float) -> str:
+    # одинаковые этапы (несколько кадров) суммируются
+    merged = {}
+    for name, seconds in stages:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _log_if_slow(method: str, route: str, status: int, elapsed: float, stages: list):
+    if not settings.SLOW_REQUEST_MS or elapsed * 1000 < settings.SLOW_REQUEST_MS:
+        return
+    if random.random() >= settings.SLOW_REQUEST_SAMPLE_RATE:
+        return
+    logger.warning(
+        "Slow request %s %s -> %s in %.0fms: %s",
+        method, route, status, elapsed * 1000, _server_timing(stages, elapsed),
+    )
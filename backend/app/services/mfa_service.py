@@ -0,0 +1,85 @@
+import asyncio
+
+from fastapi import HTTPException
+
+
+class FactorPolicy:
+    """``required`` factors must all pass, and at least ``min_factors`` in total."""
+
+    def __init__(self, required: list[str], min_factors: int):
+        self.required = set(required)
+        self.min_factors = max(min_factors, len(self.required))
+
+    def missing(self, submitted) -> str | None:
+        """Why the submitted factors can never satisfy the policy (or None)."""
+        absent = sorted(self.required - set(submitted))
+        if absent:
+            return f"Required factors missing: {', '.join(absent)}"
+        if len(submitted) < self.min_factors:
+            return f"At least {self.min_factors} factor(s) required"
+        return None
+
+    def outcome(self, passed: set, failed: set, pending: set) -> bool | None:
+        """True/False once the result can't change anymore, None while it still can."""
+        if self.required & failed:
+            return False
+        if self.required <= passed and len(passed) >= self.min_factors:
+            return True
+        if len(passed) + len(pending) < self.min_factors:
+            return False
+        return None
+
+
+def _factor_result(task: asyncio.Task) -> tuple[dict, HTTPException | None]:
+    try:
+        result = dict(task.result())
+    except HTTPException as e:
+        result = {"verified": False, "detail": e.detail}
+        # 429/5xx — перегрузка, а не неверный фактор: клиенту стоит повторить
+        if e.status_code == 429 or e.status_code >= 500:
+            return {"status": "error", "detail": e.detail}, e
+    verified = bool(result.pop("verified"))
+    return {"status": "passed" if verified else "failed", **result}, None
+
+
+async def evaluate_factors(factors: dict, policy: FactorPolicy) -> tuple[bool, dict]:
+    """Run the factor coroutines concurrently, stop as soon as the policy is decided.
+
+    ``factors`` maps a name to a zero-argument callable (e.g. a
+    ``functools.partial``) creating a coroutine that returns a dict with
+    ``verified`` (plus details), or raises HTTPException — 4xx counts as a
+    failed factor. Coroutines are only created here, so a caller that fails
+    while preparing the factors leaves nothing un-awaited.
+    Factors still running when the outcome is known are cancelled and
+    reported as ``skipped``; pool jobs already started finish in the
+    background and free their slots (inference) and memory budget
+    (hashing) only when they are really done. If the policy fails while
+    some factor hit an overloaded pool (429/5xx), that error is raised
+    instead of a plain failure.
+    """
+    tasks = {asyncio.ensure_future(factory()): name for name, factory in factors.items()}
+    results = {name: {"status": "skipped"} for name in factors}
+    passed, failed = set(), set()
+    errors = []
+    pending = set(tasks)
+
+    try:
+        outcome = None
+        while pending and outcome is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                results[name], error = _factor_result(task)
+                if error is not None:
+                    errors.append(error)
+                (passed if results[name]["status"] == "passed" else failed).add(name)
+            outcome = policy.outcome(passed, failed, {tasks[task] for task in pending})
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    if not outcome and errors:
+        raise errors[0]
+    return bool(outcome), results
@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+
+class RateLimiter:
+    """Sliding-window limiter: at most ``limit`` events per ``window`` seconds per key.
+
+    Keeps the timestamps of the last ``limit`` events per key (exact window,
+    O(limit) memory per key). Keys live in an LRU capped at ``max_keys`` so a
+    flood of distinct IPs cannot grow memory without bound.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events: OrderedDict[object, deque] = OrderedDict()
+
+    def retry_after(self, key) -> float:
+        """Seconds until ``key`` may act again (0 when it is allowed now)."""
+        events = self._events.get(key)
+        if events is None or len(events) < self.limit:
+            return 0.0
+        return max(0.0, events[0] + self.window - time.monotonic())
+
+    def hit(self, key):
+        events = self._events.get(key)
+        if events is None:
+            events = self._events[key] = deque(maxlen=self.limit)
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+        else:
+            self._events.move_to_end(key)
+        events.append(time.monotonic())
+
+    def reset(self, key):
+        self._events.pop(key, None)
+
+    def __len__(self):
+        return len(self._events)
+
+
+def _limiter(limit: int, window: float) -> RateLimiter:
+    return RateLimiter(limit, window, settings.RATE_LIMIT_MAX_KEYS)
+
+
+# все попытки входа (пароль + PIN) с одного IP
+auth_ip_limiter = _limiter(settings.RATE_LIMIT_AUTH_IP_ATTEMPTS, settings.RATE_LIMIT_AUTH_IP_WINDOW_SEC)
+# попытки пароля по email с последнего успешного входа (user_id до БД неизвестен)
+login_failure_limiter = _limiter(settings.RATE_LIMIT_LOGIN_FAILURES, settings.RATE_LIMIT_LOGIN_WINDOW_SEC)
+# попытки PIN по user_id с последнего успеха — заменяет pin_attempts/pin_locked_until
+pin_failure_limiter = _limiter(settings.RATE_LIMIT_PIN_FAILURES, settings.RATE_LIMIT_PIN_WINDOW_SEC)
+# face verify: каждая попытка — это инференс
+face_user_limiter = _limiter(settings.RATE_LIMIT_FACE_ATTEMPTS, settings.RATE_LIMIT_FACE_WINDOW_SEC)
+face_ip_limiter = _limiter(settings.RATE_LIMIT_FACE_IP_ATTEMPTS, settings.RATE_LIMIT_FACE_WINDOW_SEC)
+# voice verify — те же лимиты, что у лица (тоже инференс на каждую попытку)
+voice_user_limiter = _limiter(settings.RATE_LIMIT_FACE_ATTEMPTS, settings.RATE_LIMIT_FACE_WINDOW_SEC)
+voice_ip_limiter = _limiter(settings.RATE_LIMIT_FACE_IP_ATTEMPTS, settings.RATE_LIMIT_FACE_WINDOW_SEC)
+
+
+def check_rate(
+    limiter: RateLimiter,
+    key,
+    status_code: int = 429,
+    detail: str = "Too many attempts, try again later",
+):
+    """Raise ``status_code`` (with Retry-After) if ``key`` is over the limit, else count the attempt.
+
+    Failure limiters (password/PIN) count every attempt up front and are
+    ``reset`` on success — so concurrent guesses cannot all slip past the
+    check before the first failure is recorded.
+    """
+    if not settings.RATE_LIMIT_ENABLED or key is None:
+        return
+    wait = limiter.retry_after(key)
+    if wait > 0:
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(int(wait) + 1)},
+        )
+    limiter.hit(key)
+
+
+def rate_limiter_stats() -> dict:
+    return {
+        "auth_ip": len(auth_ip_limiter),
+        "login_failures": len(login_failure_limiter),
+        "pin_failures": len(pin_failure_limiter),
+        "face_user": len(face_user_limiter),
+        "face_ip": len(face_ip_limiter),
+        "voice_user": len(voice_user_limiter),
+        "voice_ip": len(voice_ip_limiter),
+    }
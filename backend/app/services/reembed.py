@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.locks import lock_users
+from app.db.session import AsyncSessionLocal
+from app.models.biometric import Biometric
+from app.models.face_template import FaceTemplate
+from app.services.audit_writer import log_action
+from app.services.face_index import face_index
+from app.services.face_service import centroid, embed_crops
+from app.services.inference_pool import inference_pool
+from app.services.metrics import stage
+from app.services.template_cache import template_cache
+from app.services.template_codec import seal_template
+
+logger = logging.getLogger(__name__)
+
+
+class Reembedder:
+    """Background re-enrollment of users still on the legacy recognition model.
+
+    While FACE_LEGACY_MODEL_PACK is set, users without FACE_MODEL_PACK
+    templates are verified with the old model. After a successful
+    verification the aligned face crops of that session are queued here and
+    embedded again with the current model; the user's templates and
+    centroid are then replaced in one transaction. Nothing is stored on
+    disk: a job lost on restart is queued again on the user's next login.
+
+    The worker is throttled so migration never competes with live traffic:
+    one user at a time, at most one per ``interval`` seconds, and only when
+    the inference pool has nothing else to do.
+    """
+
+    def __init__(self, max_queue: int, interval: float, idle_poll: float):
+        self.max_queue = max_queue
+        self.interval = interval
+        self.idle_poll = idle_poll
+
+        # user_id -> [(crop, yaw)]; повторная постановка пользователя заменяет кадры
+        self._jobs: OrderedDict[int, list[tuple[np.ndarray, float]]] = OrderedDict()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+        self.submitted = 0
+        self.reembedded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.REEMBED_ENABLED and bool(settings.FACE_LEGACY_MODEL_PACK)
+
+    def submit(self, user_id: int, frames: list[tuple[np.ndarray, float]]) -> bool:
+        """Queue ``(crop, yaw)`` frames of a verified legacy user; False if not accepted."""
+        frames = [(crop, yaw) for crop, yaw in frames if crop is not None]
+        if not self.enabled or not frames:
+            return False
+        if user_id not in self._jobs and len(self._jobs) >= self.max_queue:
+            # не страшно: пользователь снова попадёт в очередь при следующем входе
+            self.dropped += 1
+            return False
+        self._jobs[user_id] = frames
+        self.submitted += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    # --- фоновая обработка ---
+
+    async def start(self):
+        if self._task is not None or not self.enabled:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # незавершённые задачи не сохраняем — см. docstring
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._wakeup = None
+
+    async def _wait_idle(self):
+        while inference_pool.pending:
+            await asyncio.sleep(self.idle_poll)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._jobs:
+                await self._wait_idle()
+                user_id, frames = self._jobs.popitem(last=False)
+                try:
+                    await self.reembed(user_id, frames)
+                except HTTPException:
+                    # пул успели занять живые запросы — вернём задачу в очередь
+                    self._jobs.setdefault(user_id, frames)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Re-embedding of user %s failed", user_id)
+                await asyncio.sleep(self.interval)
+
+    async def reembed(self, user_id: int, frames: list[tuple[np.ndarray, float]]) -> bool:
+        """Replace the user's legacy templates with current-model ones; False if skipped."""
+        embeddings = await inference_pool.run(embed_crops, [crop for crop, _ in frames])
+        user_centroid = centroid(embeddings)
+
+        with stage("reembed_write"):
+            async with AsyncSessionLocal() as db:
+                # та же блокировка, что и в enroll: иначе параллельный enroll
+                # может записать новые шаблоны между проверкой и удалением
+                if await db.scalar(lock_users([user_id])) is None:
+                    self.skipped += 1
+                    return False
+                templates = list((await db.scalars(select(FaceTemplate).where(FaceTemplate.user_id == user_id))).all())
+                biometric = await db.scalar(select(Biometric).where(Biometric.user_id == user_id))
+                if biometric is None or any(t.model_id == settings.FACE_MODEL_PACK for t in templates):
+                    # пользователь успел перерегистрироваться (или удалён) — не трогаем
+                    self.skipped += 1
+                    return False
+
+                for template in templates:
+                    await db.delete(template)
+                for embedding, (_, yaw) in zip(embeddings, frames):
+                    db.add(FaceTemplate(
+                        user_id=user_id,
+                        template=seal_template(embedding),
+                        model_id=settings.FACE_MODEL_PACK,
+                        yaw=yaw,
+                    ))
+                biometric.face_template = seal_template(user_centroid)
+                await db.commit()
+
+        template_cache.invalidate(user_id)
+        if settings.FACE_INDEX_ENABLED:
+            face_index.add(user_id, user_centroid)
+        log_action(user_id, "face_reembed")
+        self.reembedded += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": len(self._jobs),
+            "submitted": self.submitted,
+            "reembedded": self.reembedded,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+reembedder = Reembedder(
+    max_queue=settings.REEMBED_QUEUE_SIZE,
+    interval=settings.REEMBED_INTERVAL_SEC,
+    idle_poll=settings.REEMBED_IDLE_POLL_SEC,
+)
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+from app.core.config import settings
+
+
+class UserTemplates(NamedTuple):
+    user_id: int
+    model_id: str        # модель, которой сняты шаблоны (во время миграции — может быть старая)
+    matrix: np.ndarray   # (T, dim), L2-нормализованы, read-only
+
+
+class TemplateCache:
+    """LRU + TTL cache of decrypted, L2-normalized face templates by user_id.
+
+    A value is ``UserTemplates``: the user's (T, dim) template matrix, one
+    row per template, and the model that produced it. The matrix is
+    float16 when templates are stored quantized (TEMPLATE_DTYPE), which
+    halves the footprint; scoring upcasts the few rows it touches.
+
+    Bounded by memory (sum of ``ndarray.nbytes``), not by entry count. The
+    cache is per process: ``invalidate`` only clears the local copy, other
+    workers pick up a re-enrollment when their entry expires (TTL).
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._data: OrderedDict[int, tuple[float, UserTemplates]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> UserTemplates | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, templates = entry
+            if expires_at <= now:
+                self._drop(user_id)
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return templates
+
+    def put(self, user_id: int, embedding: np.ndarray, model_id: str | None = None) -> UserTemplates:
+        """Normalize rows, freeze and store ``embedding``; returns the cached entry."""
+        vector = np.array(embedding, dtype=np.float32, ndmin=2)
+        vector /= np.linalg.norm(vector, axis=1, keepdims=True)
+        if settings.TEMPLATE_DTYPE != "float32":
+            # точнее хранимого шаблона float16 в кэше всё равно не станет
+            vector = vector.astype(np.float16)
+        vector.flags.writeable = False
+        templates = UserTemplates(user_id, model_id or settings.FACE_MODEL_PACK, vector)
+
+        if vector.nbytes > self.max_bytes:
+            return templates
+
+        with self._lock:
+            if user_id in self._data:
+                self._drop(user_id)
+            self._data[user_id] = (time.monotonic() + self.ttl, templates)
+            self._bytes += vector.nbytes
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+        return templates
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            if user_id in self._data:
+                self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _drop(self, user_id: int):
+        _, templates = self._data.pop(user_id)
+        self._bytes -= templates.matrix.nbytes
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+template_cache = TemplateCache(
+    max_bytes=settings.TEMPLATE_CACHE_MAX_MB * 1024 * 1024,
+    ttl=settings.TEMPLATE_CACHE_TTL_SEC,
+)
@@ -0,0 +1,115 @@
+"""Versioned binary envelope for biometric templates (inside the AES-GCM ciphertext).
+
+    magic "BT" | version u8 | dtype u8 | flags u8 | model_id length u8 | dim u16 | scale f32 | model_id | payload
+
+Everything little-endian. ``payload`` is ``dim`` values of ``dtype``
+(float32, float16, or int8 with a per-vector ``scale``). Rows written
+before the envelope are bare float32 bytes and decode as version 0.
+"""
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.security import decrypt_data, decrypt_many, encrypt_data
+
+MAGIC = b"BT"
+VERSION = 1
+FLAG_NORMALIZED = 0x01
+
+_HEADER = struct.Struct("<2sBBBBHf")
+DTYPES = {"float32": (0, np.dtype("<f4")), "float16": (1, np.dtype("<f2")), "int8": (2, np.dtype("i1"))}
+_BY_CODE = {code: (name, dtype) for name, (code, dtype) in DTYPES.items()}
+
+
+class Template(NamedTuple):
+    vector: np.ndarray   # float32 или float16 (view на plaintext), int8 — уже деквантован
+    model_id: str
+    dtype: str
+    normalized: bool
+    version: int
+
+
+def encode_template(vector: np.ndarray, model_id: str, dtype: str | None = None) -> bytes:
+    """L2-normalize ``vector`` and pack it into the envelope in ``dtype`` (TEMPLATE_DTYPE by default)."""
+    dtype = dtype or settings.TEMPLATE_DTYPE
+    code, np_dtype = DTYPES[dtype]
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    vector = vector / np.linalg.norm(vector)
+
+    scale = 0.0
+    if dtype == "int8":
+        # симметричная квантизация на вектор: max|v| -> 127
+        scale = float(np.abs(vector).max()) / 127.0 or 1.0
+        payload = np.round(vector / scale).astype(np_dtype)
+    else:
+        payload = vector.astype(np_dtype)
+
+    model = model_id.encode("utf-8")
+    header = _HEADER.pack(MAGIC, VERSION, code, FLAG_NORMALIZED, len(model), len(vector), scale)
+    return header + model + payload.tobytes()
+
+
+def decode_template(data: bytes, default_model: str = "") -> Template:
+    """Parse an envelope (or a legacy bare float32 blob) without copying the payload.
+
+    float32/float16 vectors are read-only views into ``data``; int8 is
+    dequantized to float32 (one small copy).
+    """
+    if len(data) >= _HEADER.size and data[:2] == MAGIC:
+        _, version, code, flags, model_len, dim, scale = _HEADER.unpack_from(data)
+        known = _BY_CODE.get(code)
+        offset = _HEADER.size + model_len
+        # заголовок сходится с длиной — иначе это legacy float32, случайно начавшийся с "BT"
+        if known is not None and len(data) == offset + dim * known[1].itemsize:
+            name, np_dtype = known
+            vector = np.frombuffer(data, dtype=np_dtype, count=dim, offset=offset)
+            if name == "int8":
+                vector = vector.astype(np.float32) * np.float32(scale)
+            model_id = bytes(data[_HEADER.size:offset]).decode("utf-8")
+            return Template(vector, model_id, name, bool(flags & FLAG_NORMALIZED), version)
+
+    return Template(np.frombuffer(data, dtype="<f4"), default_model, "float32", False, 0)
+
+
+def is_current(template: Template, model_id: str) -> bool:
+    """Already stored the way new templates would be (no lazy rewrite needed)."""
+    return (
+        template.version == VERSION
+        and template.dtype == settings.TEMPLATE_DTYPE
+        and template.model_id == model_id
+    )
+
+
+# -----------------------------
+# Шифрование
+# -----------------------------
+
+def seal_template(vector: np.ndarray, model_id: str | None = None) -> bytes:
+    """Envelope + ``encrypt_data``; the face model (FACE_MODEL_PACK) by default."""
+    return encrypt_data(encode_template(vector, model_id or settings.FACE_MODEL_PACK))
+
+
+def open_template(blob: bytes, default_model: str | None = None) -> Template:
+    """``decrypt_data`` + envelope; legacy rows are attributed to ``default_model``.
+
+    Without ``default_model`` a bare blob is a face template of the model
+    being migrated from (FACE_LEGACY_MODEL_PACK), or of FACE_MODEL_PACK when
+    no migration is running.
+    """
+    return decode_template(decrypt_data(blob), default_model or _default_face_model())
+
+
+def open_templates(blobs: list, default_models: list | None = None) -> list[Template]:
+    """``open_template`` for a batch, with one ``decrypt_many`` call (index build, bulk loads)."""
+    fallback = _default_face_model()
+    default_models = default_models or [None] * len(blobs)
+    return [
+        decode_template(data, default_model or fallback)
+        for data, default_model in zip(decrypt_many(blobs), default_models)
+    ]
+
+
+def _default_face_model() -> str:
+    return settings.FACE_LEGACY_MODEL_PACK or settings.FACE_MODEL_PACK
@@ -0,0 +1,109 @@
+import heapq
+import time
+
+from app.core.config import settings
+
+
+class MemoryTokenStore:
+    """Revoked JWT ids kept in process memory until the token expires.
+
+    ``dict`` for O(1) lookups plus a heap ordered by ``exp`` so expired
+    entries are evicted cheaply on every write. Revocations are local to the
+    worker process — with several workers use the Redis store.
+
+    At most ``max_entries`` ids are kept: when full, the entry that expires
+    soonest is dropped (and counted in ``evicted``), so that token becomes
+    usable again for the rest of its lifetime. Size the bound for the
+    logouts/refreshes of one REFRESH_TOKEN_EXPIRE_DAYS window, or use Redis.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._revoked: dict[str, float] = {}
+        self._expiry: list[tuple[float, str]] = []
+        self.evicted = 0
+
+    def _evict(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            exp, jti = heapq.heappop(self._expiry)
+            if self._revoked.get(jti) == exp:
+                del self._revoked[jti]
+
+    def _evict_soonest(self):
+        while self._expiry:
+            exp, jti = heapq.heappop(self._expiry)
+            if self._revoked.get(jti) == exp:
+                del self._revoked[jti]
+                self.evicted += 1
+                return
+
+    async def revoke(self, jti: str, exp: float) -> bool:
+        """Revoke ``jti`` until ``exp``; False if it was already revoked."""
+        now = time.time()
+        self._evict(now)
+        if exp <= now:
+            return True  # токен и так уже не пройдёт проверку exp
+        if jti in self._revoked:
+            return False
+        if len(self._revoked) >= self.max_entries:
+            # лимит памяти: жертвуем записью, которой осталось жить меньше всех
+            self._evict_soonest()
+        self._revoked[jti] = exp
+        heapq.heappush(self._expiry, (exp, jti))
+        return True
+
+    async def is_revoked(self, jti: str) -> bool:
+        exp = self._revoked.get(jti)
+        return exp is not None and exp > time.time()
+
+    async def close(self):
+        pass
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._revoked),
+            "max_entries": self.max_entries,
+            "evicted": self.evicted,
+        }
+
+
+class RedisTokenStore:
+    """Same interface on top of Redis (``SET NX EX``), shared by all workers."""
+
+    def __init__(self, url: str, prefix: str = "revoked:"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    async def revoke(self, jti: str, exp: float) -> bool:
+        ttl = int(exp - time.time()) + 1
+        if ttl <= 0:
+            return True
+        return bool(await self._redis.set(self._prefix + jti, 1, ex=ttl, nx=True))
+
+    async def is_revoked(self, jti: str) -> bool:
+        return bool(await self._redis.exists(self._prefix + jti))
+
+    async def close(self):
+        await self._redis.aclose()
+
+    def stats(self) -> dict:
+        # размер хранит Redis (TTL на ключах), здесь его не считаем
+        return {"backend": "redis"}
+
+
+def create_token_store(url: str = "", max_entries: int = 100_000):
+    """In-memory store by default, Redis for ``redis://`` / ``rediss://`` URLs."""
+    if not url:
+        return MemoryTokenStore(max_entries)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisTokenStore(url)
+    raise ValueError(f"Unsupported TOKEN_STORE_URL: {url!r}")
+
+
+token_store = create_token_store(settings.TOKEN_STORE_URL, settings.TOKEN_STORE_MAX_ENTRIES)
@@ -0,0 +1,72 @@
+import os
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.inference_pool import onnx_threads_per_worker
+
+
+class VoiceModelRegistry:
+    """Process-wide holder of the ONNX speaker-embedding model.
+
+    Expects a WeSpeaker/ECAPA-style export: log-mel fbank of shape
+    (1, T, VOICE_N_MELS) in, one embedding per utterance out. Like the face
+    models it is built on first use (or by the app lifespan), once, under a
+    lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._input_name = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(settings.VOICE_MODEL_PATH)
+
+    @property
+    def model_id(self) -> str:
+        """Model tag written into voice templates: the ONNX file name."""
+        return os.path.splitext(os.path.basename(settings.VOICE_MODEL_PATH))[0] or "voice"
+
+    @property
+    def ready(self) -> bool:
+        return self._session is not None
+
+    def load(self, onnx_threads: int | None = None):
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            if not self.configured:
+                raise RuntimeError("VOICE_MODEL_PATH is not set")
+
+            import onnxruntime
+
+            opts = onnxruntime.SessionOptions()
+            opts.intra_op_num_threads = onnx_threads or onnx_threads_per_worker()
+            opts.inter_op_num_threads = 1
+            session = onnxruntime.InferenceSession(
+                settings.VOICE_MODEL_PATH, sess_options=opts, providers=["CPUExecutionProvider"]
+            )
+            self._input_name = session.get_inputs()[0].name
+            self._session = session
+
+    def warmup(self):
+        self.embed(np.zeros((int(settings.VOICE_SEGMENT_SEC * 100), settings.VOICE_N_MELS), dtype=np.float32))
+
+    def embed(self, feats: np.ndarray) -> np.ndarray:
+        """Embedding of one (T, n_mels) feature segment."""
+        self.load()
+        out = self._session.run(None, {self._input_name: feats[np.newaxis]})[0]
+        return np.asarray(out, dtype=np.float32).reshape(-1)
+
+    def loaded_models(self) -> dict:
+        if self._session is None:
+            return {}
+        return {"voice": settings.VOICE_MODEL_PATH}
+
+
+voice_models = VoiceModelRegistry()
@@ -0,0 +1,197 @@
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.audio_io import AudioError, StreamingResampler, open_audio
+from app.services.metrics import ENABLED as METRICS_ENABLED, record_stage
+from app.services.voice_models import voice_models
+
+# кадры fbank: окно 25 мс, шаг 10 мс (как в Kaldi/WeSpeaker)
+FRAME_SEC = 0.025
+HOP_SEC = 0.010
+FRAMES_PER_SEC = round(1 / HOP_SEC)
+PREEMPHASIS = 0.97
+# сколько кадров тишины после речи ещё считаем речью (концы слов)
+VAD_HANGOVER_FRAMES = 20
+
+
+# -----------------------------
+# Признаки (log-mel fbank)
+# -----------------------------
+
+def _mel(hz):
+    return 1127.0 * np.log(1.0 + np.asarray(hz) / 700.0)
+
+
+def mel_filterbank(sample_rate: int, n_fft: int, n_mels: int, fmin: float = 20.0) -> np.ndarray:
+    """(n_mels, n_fft // 2 + 1) triangular filters on the Kaldi mel scale."""
+    fmax = sample_rate / 2
+    edges = np.linspace(_mel(fmin), _mel(fmax), n_mels + 2)
+    bins = _mel(np.fft.rfftfreq(n_fft, 1.0 / sample_rate))
+    left, center, right = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    up = (bins - left) / (center - left)
+    down = (right - bins) / (right - center)
+    return np.maximum(0.0, np.minimum(up, down)).astype(np.float32)
+
+
+class FbankStream:
+    """Log-mel fbank + frame energy, fed chunk by chunk.
+
+    Keeps only the samples of the last incomplete frame between calls, so
+    the output for a chunked signal is the same as for the whole signal.
+    """
+
+    def __init__(self, sample_rate: int, n_mels: int):
+        self.frame = int(sample_rate * FRAME_SEC)
+        self.hop = int(sample_rate * HOP_SEC)
+        self.n_fft = 1 << (self.frame - 1).bit_length()
+        self.window = np.hamming(self.frame).astype(np.float32)
+        self.filters = mel_filterbank(sample_rate, self.n_fft, n_mels)
+        self._buf = np.zeros(0, dtype=np.float32)
+
+    def push(self, samples: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(feats (N, n_mels), frame energy in dBFS (N,)) for the frames completed by ``samples``."""
+        buf = np.concatenate([self._buf, samples])
+        count = 0 if len(buf) < self.frame else 1 + (len(buf) - self.frame) // self.hop
+        self._buf = buf[count * self.hop:]
+        if count == 0:
+            return np.zeros((0, len(self.filters)), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.frame)[::self.hop][:count]
+        energy_db = 10.0 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+        frames = frames - frames.mean(axis=1, keepdims=True)
+        emphasized = np.empty_like(frames)
+        emphasized[:, 1:] = frames[:, 1:] - PREEMPHASIS * frames[:, :-1]
+        emphasized[:, 0] = frames[:, 0] * (1.0 - PREEMPHASIS)
+        # масштаб int16, как у модели при обучении (Kaldi fbank)
+        spectrum = np.abs(np.fft.rfft(emphasized * self.window * 32768.0, n=self.n_fft)) ** 2
+        feats = np.log(np.maximum(spectrum.astype(np.float32) @ self.filters.T, 1e-10))
+        return feats.astype(np.float32), energy_db.astype(np.float32)
+
+
+def speech_mask(energy_db: np.ndarray, threshold_db: float, hangover: int) -> tuple[np.ndarray, int]:
+    """Energy VAD with hangover: (mask, hangover left for the next chunk)."""
+    mask = np.empty(len(energy_db), dtype=bool)
+    for i, loud in enumerate(energy_db > threshold_db):
+        if loud:
+            hangover = VAD_HANGOVER_FRAMES
+        elif hangover > 0:
+            hangover -= 1
+        else:
+            mask[i] = False
+            continue
+        mask[i] = True
+    return mask, hangover
+
+
+# -----------------------------
+# Инкрементальный embedding
+# -----------------------------
+
+class EmbeddingAccumulator:
+    """Running, frame-weighted mean of segment embeddings.
+
+    Speech frames are collected into a fixed-size segment; every full
+    segment is embedded right away (per-segment mean normalization) and
+    only the running sum is kept, so memory does not grow with the length
+    of the recording.
+    """
+
+    def __init__(self, segment_frames: int, n_mels: int):
+        self.segment_frames = segment_frames
+        self._segment = np.empty((segment_frames, n_mels), dtype=np.float32)
+        self._filled = 0
+        self._sum = None
+        self.frames = 0
+        self.segments = 0
+        self.seconds = 0.0  # время в модели
+
+    def _embed(self, feats: np.ndarray):
+        started = time.perf_counter()
+        embedding = voice_models.embed(feats - feats.mean(axis=0))
+        self.seconds += time.perf_counter() - started
+        weighted = embedding / np.linalg.norm(embedding) * len(feats)
+        self._sum = weighted if self._sum is None else self._sum + weighted
+        self.segments += 1
+
+    def push(self, feats: np.ndarray):
+        while len(feats):
+            take = min(len(feats), self.segment_frames - self._filled)
+            self._segment[self._filled:self._filled + take] = feats[:take]
+            self._filled += take
+            self.frames += take
+            feats = feats[take:]
+            if self._filled == self.segment_frames:
+                self._embed(self._segment)
+                self._filled = 0
+
+    def finish(self, min_tail_frames: int) -> np.ndarray | None:
+        """L2-normalized embedding of everything pushed, or None without speech."""
+        # хвост короче min_tail_frames только шумит среднее — если есть полные сегменты
+        if self._filled and (self._filled >= min_tail_frames or self._sum is None):
+            self._embed(self._segment[:self._filled])
+            self._filled = 0
+        if self._sum is None:
+            return None
+        return (self._sum / np.linalg.norm(self._sum)).astype(np.float32)
+
+
+def voice_embedding(fileobj) -> dict:
+    """Speaker embedding of an uploaded recording, computed while it is being decoded.
+
+    Pipeline per ~0.5 s chunk: decode -> mono -> resample to
+    VOICE_SAMPLE_RATE -> fbank -> energy VAD (silence dropped everywhere,
+    not only at the ends) -> segment buffer -> model on every full segment.
+    Reading stops after VOICE_MAX_AUDIO_SEC of audio or VOICE_MAX_SPEECH_SEC
+    of speech. Runs inside the inference pool, so it stays synchronous.
+    Raises ``AudioError`` for undecodable audio or too little speech.
+    """
+    voice_models.load()
+    rate, chunks = open_audio(fileobj)
+    if rate <= 0:
+        raise AudioError("Invalid sample rate")
+
+    target = settings.VOICE_SAMPLE_RATE
+    resampler = StreamingResampler(rate, target)
+    fbank = FbankStream(target, settings.VOICE_N_MELS)
+    accumulator = EmbeddingAccumulator(int(settings.VOICE_SEGMENT_SEC * FRAMES_PER_SEC), settings.VOICE_N_MELS)
+    max_samples = int(settings.VOICE_MAX_AUDIO_SEC * rate)
+    max_speech = int(settings.VOICE_MAX_SPEECH_SEC * FRAMES_PER_SEC)
+
+    read = 0
+    hangover = 0
+    started = time.perf_counter()
+    try:
+        for chunk in chunks:
+            chunk = chunk[:max_samples - read]
+            read += len(chunk)
+            feats, energy_db = fbank.push(resampler.process(chunk))
+            mask, hangover = speech_mask(energy_db, settings.VOICE_VAD_DB, hangover)
+            accumulator.push(feats[mask][:max_speech - accumulator.frames])
+            if read >= max_samples or accumulator.frames >= max_speech:
+                break
+        embedding = accumulator.finish(min_tail_frames=accumulator.segment_frames // 2)
+    except (ValueError, EOFError) as e:
+        if isinstance(e, AudioError):
+            raise
+        raise AudioError("Invalid audio file") from e
+    finally:
+        chunks.close()
+
+    if METRICS_ENABLED:
+        # один замер на запрос, а не на каждый чанк
+        record_stage("voice_frontend", time.perf_counter() - started - accumulator.seconds)
+        record_stage("voice_embed", accumulator.seconds)
+
+    speech_seconds = accumulator.frames / FRAMES_PER_SEC
+    if embedding is None or speech_seconds < settings.VOICE_MIN_SPEECH_SEC:
+        raise AudioError("Not enough speech in the recording")
+
+    return {
+        "embedding": embedding,
+        "audio_seconds": round(read / rate, 2),
+        "speech_seconds": round(speech_seconds, 2),
+        "segments": accumulator.segments,
+    }
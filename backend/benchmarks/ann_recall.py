@@ -0,0 +1,110 @@
+"""Recall/latency of the ANN face index backends against exact search.
+
+    python -m benchmarks.ann_recall --size 200000 --queries 500 --backends flat ivf hnsw
+
+The gallery is synthetic (clustered unit vectors, like real embeddings of
+many people); pass ``--snapshot DIR`` to use a saved FACE_INDEX_PATH snapshot
+instead. Results are printed and optionally written as JSON (``--out``).
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.face_index import EMBEDDING_DIM, FaceIndex, HNSWFaceIndex, IVFFlatIndex, read_snapshot
+
+
+def synthetic_gallery(size: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    vectors = centers[labels] + 0.8 * rng.standard_normal((size, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_index(backend: str, args) -> FaceIndex:
+    if backend == "flat":
+        return FaceIndex()
+    if backend == "ivf":
+        return IVFFlatIndex(nlist=args.nlist, nprobe=args.nprobe)
+    if backend == "hnsw":
+        return HNSWFaceIndex(m=args.hnsw_m, ef_search=args.ef_search)
+    raise ValueError(backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--snapshot", default="")
+    parser.add_argument("--backends", nargs="+", default=["flat", "ivf", "hnsw"])
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--out", default="")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        snapshot = read_snapshot(FaceIndex(), args.snapshot)
+        if snapshot is None:
+            parser.error(f"no usable snapshot in {args.snapshot}")
+        user_ids, gallery = snapshot[0], np.asarray(snapshot[1])
+    else:
+        gallery = synthetic_gallery(args.size, EMBEDDING_DIM, args.clusters)
+        user_ids = np.arange(len(gallery))
+
+    rng = np.random.default_rng(1)
+    picked = rng.choice(len(gallery), args.queries, replace=False)
+    queries = gallery[picked] + 0.3 * rng.standard_normal((args.queries, EMBEDDING_DIM)).astype(np.float32)
+
+    # эталон — точный top-k
+    exact = FaceIndex()
+    exact.build(user_ids, gallery)
+    truth = [{uid for uid, _ in exact.search(q, args.k, -1.0)} for q in queries]
+
+    results = []
+    for backend in args.backends:
+        try:
+            index = make_index(backend, args)
+        except ImportError as e:
+            print(f"{backend:>5}: skipped ({e})")
+            continue
+
+        started = time.perf_counter()
+        index.build(user_ids, gallery)
+        build_sec = time.perf_counter() - started
+
+        latencies, hits = [], 0
+        for q, expected in zip(queries, truth):
+            started = time.perf_counter()
+            found = index.search(q, args.k, -1.0)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(expected & {uid for uid, _ in found})
+
+        row = {
+            "backend": backend,
+            "size": len(gallery),
+            "k": args.k,
+            "recall": hits / (args.k * len(queries)),
+            "build_sec": round(build_sec, 3),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "stats": index.stats(),
+        }
+        results.append(row)
+        print(
+            f"{backend:>5}: recall@{args.k}={row['recall']:.4f} "
+            f"p50={row['p50_ms']}ms p99={row['p99_ms']}ms build={row['build_sec']}s"
+        )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
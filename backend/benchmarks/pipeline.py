@@ -0,0 +1,489 @@
+"""Per-stage latency and endpoint throughput of the face pipeline and auth.
+
+    python -m benchmarks.pipeline --database sqlite:////tmp/bench.db --out bench.json
+    python -m benchmarks.pipeline --images ./faces --concurrency 1 4 16 --compare bench.json
+
+Runs fully in-process: stages are called directly, endpoints through
+``TestClient`` (lifespan, middleware and pools included) from a thread pool
+per concurrency level. The database is ``--database`` (a local SQLite file
+by default, DATABASE_URL is ignored); anything but SQLite or a database on
+localhost needs ``--yes-i-mean-it``. Tables and a benchmark user are
+created on the fly, the user and its templates are deleted at the end
+(audit rows stay). Without KEYRING_PATH a throwaway keyring is used.
+Images come from
+``--images`` (jpg/png files), insightface's bundled samples, or are
+synthetic (no faces — detection cost only). Face stages are skipped when
+the models cannot be loaded. Rate limiting is switched off for the run.
+
+The JSON result (``--out``) holds stage percentiles, req/s per endpoint and
+concurrency, peak RSS, loaded models and the accuracy/size of every
+template storage dtype (float32 / float16 / int8) on synthetic identities;
+``--compare`` prints the change against a previous result.
+"""
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE = "sqlite:///./benchmark.db"
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+def database_url(argv: list[str]) -> str:
+    """``--database`` from the command line; refuses a remote database unless confirmed."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--yes-i-mean-it", action="store_true")
+    args, _ = parser.parse_known_args(argv)
+    url = make_url(args.database)
+    local = url.get_backend_name() == "sqlite" or url.host in LOCAL_HOSTS
+    if not local and not args.yes_i_mean_it:
+        raise SystemExit(
+            f"Refusing to benchmark against {url.render_as_string(hide_password=True)}: "
+            "it creates and deletes a test user there. Pass --yes-i-mean-it to confirm."
+        )
+    return args.database
+
+
+def scratch_keyring():
+    """Throwaway keyring (and master key) for the run, removed at exit."""
+    from app.core.keyring import new_keyring, write_keyring_file
+
+    directory = tempfile.mkdtemp(prefix="bench-keyring-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    master_key = os.urandom(32)
+    path = os.path.join(directory, "keyring.json")
+    write_keyring_file(path, new_keyring(master_key))
+    os.environ["KEYRING_PATH"] = path
+    os.environ["MASTER_KEY"] = master_key.hex()
+
+
+# до импорта app.*: настройки читаются при импорте.
+# DATABASE_URL из окружения сознательно не используем — он может указывать на боевую БД
+if __name__ == "__main__":
+    os.environ["DATABASE_URL"] = database_url(sys.argv[1:])
+    if not os.environ.get("KEYRING_PATH"):
+        scratch_keyring()
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("FACE_PRELOAD", "false")
+os.environ.setdefault("FACE_INDEX_ENABLED", "false")
+
+import glob
+import json
+import platform
+import resource
+import subprocess
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+from sqlalchemy import delete, select
+
+from app.core import security
+from app.core.config import settings
+from app.core.jwt_manager import create_access_token, decode_token
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.audit import AuditLog  # noqa: F401 — регистрирует таблицы
+from app.models.biometric import Biometric
+from app.models.face_template import FaceTemplate
+from app.models.user import User
+from app.services.face_models import face_models
+from app.services.face_service import analyze_frames, cosine_similarity, decode_image, get_best_face, score_templates
+from app.services.template_codec import DTYPES, decode_template, encode_template, open_template, seal_template
+
+BENCH_EMAIL = "benchmark@example.com"
+BENCH_PASSWORD = "benchmark-password"
+BENCH_PIN = "4321"
+
+
+# -----------------------------
+# Измерения
+# -----------------------------
+
+def summarize(latencies_ms: list[float]) -> dict:
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "n": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def measure(fn, inputs: list, repeat: int, warmup: int = 2) -> dict:
+    """Call ``fn(x)`` over ``inputs`` (cycled) ``repeat`` times after a warmup."""
+    for i in range(min(warmup, repeat)):
+        fn(inputs[i % len(inputs)])
+    latencies = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return summarize(latencies)
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process (pool workers are separate processes and not included)."""
+    # ru_maxrss в KiB на Linux (в байтах на macOS)
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+# -----------------------------
+# Входные данные
+# -----------------------------
+
+def synthetic_image(seed: int, width: int = 1280, height: int = 960) -> bytes:
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+    img = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def load_images(directory: str) -> tuple[list[bytes], str]:
+    paths = []
+    if directory:
+        paths = sorted(glob.glob(os.path.join(directory, "*.jp*g")) + glob.glob(os.path.join(directory, "*.png")))
+        if not paths:
+            raise SystemExit(f"No .jpg/.png images in {directory}")
+        source = directory
+    else:
+        try:
+            import insightface
+
+            paths = sorted(glob.glob(os.path.join(os.path.dirname(insightface.__file__), "data", "images", "*.jpg")))
+            source = "insightface samples"
+        except ImportError:
+            pass
+    if not paths:
+        return [synthetic_image(seed) for seed in range(4)], "synthetic"
+
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images, source
+
+
+def load_models() -> str | None:
+    try:
+        face_models.load()
+        face_models.warmup()
+    except Exception as e:  # нет insightface / моделей — face-этапы пропускаются
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def prepare_db(with_face: bool) -> int:
+    """Create tables and the benchmark user (+ synthetic face templates)."""
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.email == BENCH_EMAIL).first()
+        if user is None:
+            user = User(
+                email=BENCH_EMAIL,
+                hashed_password=security.hash_password(BENCH_PASSWORD),
+                hashed_pin=security.hash_pin(BENCH_PIN),
+            )
+            db.add(user)
+            db.commit()
+        if with_face and db.query(Biometric).filter(Biometric.user_id == user.id).first() is None:
+            rng = np.random.default_rng(0)
+            templates = rng.standard_normal((3, 512)).astype(np.float32)
+            for template in templates:
+                db.add(FaceTemplate(
+                    user_id=user.id, template=seal_template(template), model_id=settings.FACE_MODEL_PACK, yaw=0.0
+                ))
+            db.add(Biometric(user_id=user.id, face_template=seal_template(templates.mean(axis=0))))
+            db.commit()
+        return user.id
+
+
+def cleanup_db():
+    """Delete the benchmark user with its templates (audit rows are kept)."""
+    with SessionLocal() as db:
+        user_ids = list(db.scalars(select(User.id).where(User.email == BENCH_EMAIL)))
+        if user_ids:
+            db.execute(delete(FaceTemplate).where(FaceTemplate.user_id.in_(user_ids)))
+            db.execute(delete(Biometric).where(Biometric.user_id.in_(user_ids)))
+            db.execute(delete(User).where(User.id.in_(user_ids)))
+            db.commit()
+
+
+# -----------------------------
+# Этапы
+# -----------------------------
+
+def bench_stages(images: list[bytes], args, models_ok: bool) -> dict:
+    rng = np.random.default_rng(0)
+    vectors = list(rng.standard_normal((64, 512)).astype(np.float32))
+    blobs = [v.tobytes() for v in vectors]
+    ciphertexts = [security.encrypt_data(b) for b in blobs]
+    tokens = [create_access_token(i) for i in range(16)]
+    password_hash = security.hash_password(BENCH_PASSWORD)
+    pin_hash = security.hash_pin(BENCH_PIN)
+
+    stages = {
+        "decode_image": measure(decode_image, images, args.repeat),
+        "cosine_similarity": measure(lambda v: cosine_similarity(v, vectors[0]), vectors, args.repeat * 10),
+        "score_templates_3x5": measure(
+            lambda _: score_templates(np.stack(vectors[:3]), np.stack(vectors[3:8])), [None], args.repeat * 10
+        ),
+        "encrypt_data": measure(security.encrypt_data, blobs, args.repeat * 10),
+        "decrypt_data": measure(security.decrypt_data, ciphertexts, args.repeat * 10),
+        f"decrypt_many_x{len(ciphertexts)}": measure(security.decrypt_many, [ciphertexts], args.repeat),
+        "open_template": measure(open_template, [seal_template(v) for v in vectors], args.repeat * 10),
+        "jwt_decode": measure(decode_token, tokens, args.repeat * 10),
+        "argon2_hash_password": measure(security.hash_password, [BENCH_PASSWORD], args.argon2_repeat, warmup=1),
+        "argon2_verify_password": measure(
+            lambda p: security.verify_password(p, password_hash), [BENCH_PASSWORD], args.argon2_repeat, warmup=1
+        ),
+        "argon2_verify_pin": measure(lambda p: security.verify_pin(p, pin_hash), [BENCH_PIN], args.argon2_repeat, warmup=1),
+    }
+    if models_ok:
+        decoded = [img for img in (decode_image(b) for b in images) if img is not None]
+        stages["get_best_face"] = measure(get_best_face, decoded, args.repeat)
+        frames = [images[i % len(images)] for i in range(args.frames)]
+        stages[f"analyze_frames_x{args.frames}"] = measure(analyze_frames, [frames], max(1, args.repeat // 4))
+    return stages
+
+
+# -----------------------------
+# Форматы хранения шаблонов
+# -----------------------------
+
+def bench_template_formats(args) -> dict:
+    """Score drift and decision flips of quantized templates vs float32.
+
+    Synthetic identities: a random unit "identity" vector per user, probes
+    and templates are noisy copies of it. Genuine cosine is centred on
+    THRESHOLD (worst case for flips), impostor ~0. Every pair is scored with
+    the float32 template and with the template after an encode/decode
+    round trip in each dtype.
+    """
+    from app.api.v1.biometrics import THRESHOLD
+
+    rng = np.random.default_rng(1)
+    users, dim = args.template_users, 512
+
+    def noisy(base):
+        v = base + rng.standard_normal(base.shape).astype(np.float32) * 0.035
+        return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+    identities = rng.standard_normal((users, dim)).astype(np.float32)
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+    templates, probes = noisy(identities), noisy(identities)
+    # impostor: пробы сдвинуты на одного пользователя
+    impostors = np.roll(probes, 1, axis=0)
+
+    reference = {
+        "genuine": np.einsum("ij,ij->i", probes, templates),
+        "impostor": np.einsum("ij,ij->i", impostors, templates),
+    }
+    results = {}
+    for dtype in DTYPES:
+        blobs = [encode_template(t, settings.FACE_MODEL_PACK, dtype) for t in templates]
+        decoded = np.stack([decode_template(b).vector.astype(np.float32) for b in blobs])
+        row = {
+            "bytes": len(blobs[0]),
+            "encrypted_bytes": len(security.encrypt_data(blobs[0])),
+            "decode": measure(decode_template, blobs, args.repeat * 10),
+        }
+        for kind, pairs in (("genuine", probes), ("impostor", impostors)):
+            scores = np.einsum("ij,ij->i", pairs, decoded)
+            drift = np.abs(scores - reference[kind])
+            row[kind] = {
+                "max_abs_drift": float(drift.max()),
+                "mean_abs_drift": float(drift.mean()),
+                "decision_flips": int(((scores >= THRESHOLD) != (reference[kind] >= THRESHOLD)).sum()),
+            }
+        results[dtype] = row
+        print(
+            f"template {dtype:<8} {row['bytes']:>5} B  genuine drift max={row['genuine']['max_abs_drift']:.5f} "
+            f"flips={row['genuine']['decision_flips']}/{users}  impostor flips={row['impostor']['decision_flips']}"
+        )
+    results["genuine_mean_score"] = float(reference["genuine"].mean())
+    return results
+
+
+# -----------------------------
+# Эндпоинты под нагрузкой
+# -----------------------------
+
+def run_load(send, requests: int, concurrency: int) -> dict:
+    """``requests`` calls of ``send()`` from ``concurrency`` threads."""
+    latencies, statuses = [], Counter()
+
+    def one(_):
+        started = time.perf_counter()
+        status = send()
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[status] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "rps": round(requests / wall, 2),
+        **summarize(latencies),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+def bench_endpoints(user_id: int, images: list[bytes], args, models_ok: bool) -> list[dict]:
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    token = create_access_token(user_id)
+    auth = {"Authorization": f"Bearer {token}"}
+    frames = [images[i % len(images)] for i in range(args.frames)]
+
+    results = []
+    with TestClient(app) as client:
+        endpoints = {
+            "GET /secure": lambda: client.get("/secure", headers=auth).status_code,
+            "POST /auth/login": lambda: client.post(
+                "/api/v1/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+            ).status_code,
+            "POST /auth/login/pin": lambda: client.post(
+                "/api/v1/auth/login/pin", json={"user_id": user_id, "pin": BENCH_PIN}
+            ).status_code,
+        }
+        if models_ok:
+            endpoints["POST /biometrics/face/verify-multiframe"] = lambda: client.post(
+                "/api/v1/biometrics/face/verify-multiframe",
+                params={"user_id": user_id},
+                files=[("files", (f"{i}.jpg", data, "image/jpeg")) for i, data in enumerate(frames)],
+                headers=auth,
+            ).status_code
+
+        for name, send in endpoints.items():
+            send()  # прогрев (пулы, кэши, соединения)
+            for concurrency in args.concurrency:
+                row = {"endpoint": name, **run_load(send, args.requests, concurrency)}
+                results.append(row)
+                print(f"{name:<45} c={concurrency:<3} {row['rps']:>8} req/s  p50={row['p50_ms']}ms p99={row['p99_ms']}ms {row['status']}")
+    return results
+
+
+# -----------------------------
+# Сравнение с прошлым запуском
+# -----------------------------
+
+def _delta(new: float, old: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(result: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline['meta'].get('commit')}):")
+    for name, stage in result["stages"].items():
+        old = baseline["stages"].get(name)
+        if old:
+            print(f"  {name:<45} p50 {old['p50_ms']} -> {stage['p50_ms']}ms ({_delta(stage['p50_ms'], old['p50_ms'])})")
+    old_load = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("endpoints", [])}
+    for row in result["endpoints"]:
+        old = old_load.get((row["endpoint"], row["concurrency"]))
+        if old:
+            print(
+                f"  {row['endpoint']:<45} c={row['concurrency']:<3} "
+                f"{old['rps']} -> {row['rps']} req/s ({_delta(row['rps'], old['rps'])})"
+            )
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE, help="SQLAlchemy URL (DATABASE_URL is ignored)")
+    parser.add_argument("--yes-i-mean-it", action="store_true", help="allow a database that is not SQLite/localhost")
+    parser.add_argument("--images", default="", help="directory with .jpg/.png images")
+    parser.add_argument("--repeat", type=int, default=50, help="iterations per (fast) stage")
+    parser.add_argument("--argon2-repeat", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=3, help="frames per verify-multiframe request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="requests per endpoint and concurrency level")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--template-users", type=int, default=5000, help="synthetic identities for the dtype evaluation")
+    parser.add_argument("--out", default="")
+    parser.add_argument("--compare", default="", help="previous --out JSON to compare against")
+    args = parser.parse_args()
+
+    images, source = load_images(args.images)
+    models_error = load_models()
+    if models_error:
+        print(f"face models unavailable, face stages skipped ({models_error})")
+    models_ok = models_error is None
+
+    try:
+        user_id = prepare_db(with_face=models_ok)
+
+        stages = bench_stages(images, args, models_ok)
+        for name, stage in stages.items():
+            print(f"{name:<45} p50={stage['p50_ms']}ms p90={stage['p90_ms']}ms p99={stage['p99_ms']}ms (n={stage['n']})")
+
+        template_formats = bench_template_formats(args)
+
+        endpoints = [] if args.skip_endpoints else bench_endpoints(user_id, images, args, models_ok)
+    finally:
+        cleanup_db()
+
+    result = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": engine.dialect.name,
+            "images": {"source": source, "count": len(images)},
+            "settings": {
+                key: getattr(settings, key)
+                for key in (
+                    "INFERENCE_WORKERS", "INFERENCE_ONNX_THREADS", "HASHING_WORKERS",
+                    "FACE_MODEL_PACK", "LIVENESS_MODEL_PACK", "FACE_DET_SIZE", "FACE_SCORE_FUSION",
+                    "TEMPLATE_DTYPE", "KEYRING_PATH",
+                )
+            },
+        },
+        "models": face_models.loaded_models() if models_ok else {},
+        "models_error": models_error,
+        "stages": stages,
+        "endpoints": endpoints,
+        "template_formats": template_formats,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"peak RSS: {result['peak_rss_mb']} MB, models: {result['models'] or 'none'}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
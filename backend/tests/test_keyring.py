@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.core.keyring import Keyring, new_keyring, write_keyring_file
+
+LEGACY_KEY = bytes(range(32))
+
+
+def legacy_blob(plaintext: bytes, nonce: bytes | None = None) -> bytes:
+    """Ciphertext as written before the keyring: ``nonce | ciphertext``, no header."""
+    nonce = nonce or os.urandom(12)
+    return nonce + AESGCM(LEGACY_KEY).encrypt(nonce, plaintext, None)
+
+
+@pytest.fixture
+def keyring():
+    return Keyring({1: os.urandom(32), 2: os.urandom(32)}, active=2, legacy_key=LEGACY_KEY)
+
+
+def test_encrypt_writes_the_active_key_header(keyring):
+    blob = keyring.encrypt(b"template")
+
+    assert blob[:3] == b"DK\x01"
+    assert keyring.key_id(blob) == 2
+    assert keyring.decrypt(blob) == b"template"
+
+
+def test_header_is_authenticated(keyring):
+    blob = keyring.encrypt(b"template")
+    # подмена key id в заголовке: другой ключ, и AAD не сходится
+    tampered = blob[:3] + (1).to_bytes(4, "little") + blob[7:]
+
+    with pytest.raises(InvalidTag):
+        keyring.decrypt(tampered)
+
+
+def test_legacy_ciphertext_falls_back_to_legacy_key(keyring):
+    assert keyring.key_id(legacy_blob(b"old")) is None
+    assert keyring.decrypt(legacy_blob(b"old")) == b"old"
+
+
+def test_legacy_nonce_that_looks_like_a_header(keyring):
+    # nonce случайно начинается с "DK\x01" и известного key id
+    blob = legacy_blob(b"old template", nonce=b"DK\x01\x02\x00\x00\x00" + os.urandom(5))
+
+    assert keyring.key_id(blob) == 2
+    assert keyring.decrypt(blob) == b"old template"
+    assert keyring.decrypt_many([blob]) == [b"old template"]
+
+
+def test_legacy_ciphertext_without_legacy_key():
+    keyring = Keyring({1: os.urandom(32)}, active=1)
+
+    with pytest.raises(InvalidTag):
+        keyring.decrypt(legacy_blob(b"old"))
+
+
+def test_unknown_data_key_raises_key_error(keyring):
+    newer = Keyring({3: os.urandom(32)}, active=3)
+
+    with pytest.raises(KeyError):
+        keyring.decrypt(newer.encrypt(b"template"))
+
+
+def test_decrypt_many_mixes_epochs_and_legacy():
+    keys = {1: os.urandom(32), 2: os.urandom(32)}
+    epoch1 = Keyring({1: keys[1]}, active=1)
+    keyring = Keyring(keys, active=2, legacy_key=LEGACY_KEY)
+    blobs = [epoch1.encrypt(b"a"), legacy_blob(b"b"), keyring.encrypt(b"c")]
+
+    assert keyring.decrypt_many(blobs) == [b"a", b"b", b"c"]
+
+
+def test_from_file_checks_the_master_key(tmp_path):
+    master_key = os.urandom(32)
+    path = str(tmp_path / "keyring.json")
+    write_keyring_file(path, new_keyring(master_key))
+
+    keyring = Keyring.from_file(path, master_key)
+    assert keyring.active == 1
+    assert keyring.decrypt(keyring.encrypt(b"template")) == b"template"
+
+    with pytest.raises(ValueError):
+        Keyring.from_file(path, os.urandom(32))
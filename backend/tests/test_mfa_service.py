@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.mfa_service import FactorPolicy, evaluate_factors
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def factor(verified: bool, delay: float = 0.0, **details):
+    async def check():
+        await asyncio.sleep(delay)
+        return {"verified": verified, **details}
+    return check
+
+
+def failing(status_code: int, delay: float = 0.0):
+    async def check():
+        await asyncio.sleep(delay)
+        raise HTTPException(status_code, detail="nope")
+    return check
+
+
+# -----------------------------
+# FactorPolicy
+# -----------------------------
+
+def test_min_factors_is_at_least_the_required_ones():
+    assert FactorPolicy(["face", "pin"], 1).min_factors == 2
+
+
+def test_missing():
+    policy = FactorPolicy(["face"], 2)
+
+    assert policy.missing(["pin", "password"]) == "Required factors missing: face"
+    assert policy.missing(["face"]) == "At least 2 factor(s) required"
+    assert policy.missing(["face", "pin"]) is None
+
+
+def test_outcome():
+    policy = FactorPolicy(["face"], 2)
+
+    assert policy.outcome({"face", "pin"}, set(), set()) is True
+    # обязательный фактор не прошёл — исход известен сразу
+    assert policy.outcome(set(), {"face"}, {"pin"}) is False
+    # необязательный не прошёл, но ещё может набраться min_factors
+    assert policy.outcome({"face"}, {"pin"}, {"voice"}) is None
+    assert policy.outcome({"face"}, {"pin"}, set()) is False
+    assert policy.outcome({"pin"}, set(), {"face"}) is None
+
+
+# -----------------------------
+# evaluate_factors
+# -----------------------------
+
+def test_required_failure_short_circuits():
+    policy = FactorPolicy(["face"], 2)
+    started = time.monotonic()
+
+    verified, results = run(evaluate_factors(
+        {"face": factor(False, similarity=0.1), "pin": factor(True, delay=5)}, policy
+    ))
+
+    # медленный PIN не дожидаемся
+    assert time.monotonic() - started < 1
+    assert verified is False
+    assert results["face"] == {"status": "failed", "similarity": 0.1}
+    assert results["pin"] == {"status": "skipped"}
+
+
+def test_passes_once_policy_is_satisfied():
+    policy = FactorPolicy(["face"], 2)
+
+    verified, results = run(evaluate_factors(
+        {"face": factor(True), "pin": factor(True), "voice": factor(True, delay=5)}, policy
+    ))
+
+    assert verified is True
+    assert results["face"]["status"] == results["pin"]["status"] == "passed"
+    assert results["voice"] == {"status": "skipped"}
+
+
+def test_client_error_counts_as_failed_factor():
+    policy = FactorPolicy([], 1)
+
+    verified, results = run(evaluate_factors({"pin": failing(400)}, policy))
+
+    assert verified is False
+    assert results["pin"]["status"] == "failed"
+
+
+def test_overload_is_raised_when_policy_fails():
+    policy = FactorPolicy(["face"], 2)
+
+    with pytest.raises(HTTPException) as error:
+        run(evaluate_factors({"face": failing(429), "pin": factor(True)}, policy))
+    assert error.value.status_code == 429
+
+
+def test_overload_of_optional_factor_is_ignored_on_success():
+    policy = FactorPolicy(["face"], 2)
+
+    verified, results = run(evaluate_factors(
+        {"face": factor(True), "voice": failing(503), "pin": factor(True, delay=0.01)}, policy
+    ))
+
+    assert verified is True
+    assert results["voice"]["status"] == "error"
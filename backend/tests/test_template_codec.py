@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from app.services.template_codec import DTYPES, VERSION, decode_template, encode_template
+
+
+@pytest.fixture
+def vector():
+    return np.random.default_rng(0).standard_normal(512).astype(np.float32)
+
+
+@pytest.mark.parametrize("dtype", list(DTYPES))
+def test_round_trip(vector, dtype):
+    template = decode_template(encode_template(vector, "antelopev2", dtype))
+
+    assert template.version == VERSION
+    assert template.model_id == "antelopev2"
+    assert template.dtype == dtype
+    assert template.normalized is True
+    expected = vector / np.linalg.norm(vector)
+    assert np.allclose(template.vector.astype(np.float32), expected, atol=0.01)
+
+
+def test_legacy_float32_blob(vector):
+    template = decode_template(vector.tobytes(), default_model="buffalo_l")
+
+    assert template.version == 0
+    assert template.model_id == "buffalo_l"
+    assert template.dtype == "float32"
+    assert template.normalized is False
+    assert np.array_equal(template.vector, vector)
+
+
+def test_legacy_blob_starting_with_magic(vector):
+    # float32, у которого первые байты случайно "BT": длина с заголовком не сходится
+    data = bytearray(vector.tobytes())
+    data[:2] = b"BT"
+    template = decode_template(bytes(data), default_model="buffalo_l")
+
+    assert template.version == 0
+    assert template.vector.size == 512
+
+
+def test_float32_payload_is_a_view(vector):
+    data = encode_template(vector, "antelopev2", "float32")
+    template = decode_template(data)
+
+    assert not template.vector.flags.writeable
+    assert not template.vector.flags.owndata
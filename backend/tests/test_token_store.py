@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from app.services.token_store import MemoryTokenStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_revoke_detects_reuse():
+    store = MemoryTokenStore(max_entries=10)
+    exp = time.time() + 60
+
+    assert run(store.revoke("a", exp)) is True
+    # повторный refresh тем же токеном — reuse
+    assert run(store.revoke("a", exp)) is False
+    assert run(store.is_revoked("a")) is True
+    assert run(store.is_revoked("b")) is False
+
+
+def test_expired_token_is_not_stored():
+    store = MemoryTokenStore(max_entries=10)
+
+    assert run(store.revoke("a", time.time() - 1)) is True
+    assert len(store) == 0
+
+
+def test_expired_entries_are_evicted_on_write():
+    store = MemoryTokenStore(max_entries=10)
+    now = time.time()
+    run(store.revoke("short", now + 0.05))
+    run(store.revoke("long", now + 60))
+
+    time.sleep(0.1)
+    run(store.revoke("other", now + 60))
+
+    assert len(store) == 2
+    assert run(store.is_revoked("short")) is False
+    assert store.evicted == 0  # истёкшие записи не считаются вытесненными
+
+
+def test_bound_drops_the_soonest_expiring_entry():
+    store = MemoryTokenStore(max_entries=2)
+    now = time.time()
+    run(store.revoke("late", now + 300))
+    run(store.revoke("soon", now + 60))
+
+    assert run(store.revoke("new", now + 120)) is True
+
+    assert len(store) == 2
+    assert run(store.is_revoked("soon")) is False
+    assert run(store.is_revoked("late")) is True
+    assert run(store.is_revoked("new")) is True
+    assert store.stats() == {"backend": "memory", "entries": 2, "max_entries": 2, "evicted": 1}